@@ -8,6 +8,32 @@ import Team from "../models/Team";
 
 const crewaiApiUrl = process.env.CREWAI_API_URL || "http://localhost:8001";
 
+// Ingestão em background no serviço Python: o upload retorna um job, acompanhado até terminar
+const KNOWLEDGE_JOB_POLL_INTERVAL = 1000; // 1 segundo
+const KNOWLEDGE_JOB_TIMEOUT = parseInt(process.env.KNOWLEDGE_JOB_TIMEOUT_MS || "600000", 10); // 10 minutos
+
+const wait = (ms: number) => new Promise(resolve => setTimeout(resolve, ms));
+
+// Aguarda o job de ingestão terminar (GET /knowledge/jobs/:jobId) e retorna o status final
+const waitIngestionJob = async (jobId: string): Promise<any> => {
+  const deadline = Date.now() + KNOWLEDGE_JOB_TIMEOUT;
+
+  while (Date.now() < deadline) {
+    const { data: job } = await axios.get(
+      `${crewaiApiUrl}/api/v2/knowledge/jobs/${jobId}`,
+      { timeout: 10000 }
+    );
+
+    if (job.status === "done" || job.status === "failed") {
+      return job;
+    }
+
+    await wait(KNOWLEDGE_JOB_POLL_INTERVAL);
+  }
+
+  throw new AppError("Tempo esgotado ao processar documento", 504);
+};
+
 // Listar documentos de uma equipe
 export const index = async (req: Request, res: Response): Promise<Response> => {
   const { teamId } = req.params;
@@ -51,6 +77,20 @@ export const upload = async (req: Request, res: Response): Promise<Response> =>
 
   const file = req.file;
 
+  // Nova versão de um documento já existente (só os trechos alterados são regravados)
+  const replaceDocumentId: string | undefined = req.body?.replaceDocumentId;
+  let replacedKnowledgeBase: KnowledgeBase | null = null;
+
+  if (replaceDocumentId) {
+    replacedKnowledgeBase = await KnowledgeBase.findOne({
+      where: { teamId: parseInt(teamId), companyId, documentId: replaceDocumentId }
+    });
+
+    if (!replacedKnowledgeBase) {
+      throw new AppError("Documento não encontrado", 404);
+    }
+  }
+
   // Validar tipo de arquivo
   const allowedTypes = [
     "application/pdf",
@@ -77,18 +117,50 @@ export const upload = async (req: Request, res: Response): Promise<Response> =>
     });
     formData.append("team_id", teamId);
     formData.append("company_id", companyId.toString());
+    formData.append("background", "true");
+    if (req.body?.force === "true" || req.body?.force === true) {
+      formData.append("force", "true");
+    }
+    if (replaceDocumentId) {
+      formData.append("replace_document_id", replaceDocumentId);
+    }
+    // Chunker configurado na equipe ("chars" ou "sentences"); sem configuração, o serviço usa o padrão
+    if (team.knowledgeChunker) {
+      formData.append("chunker", team.knowledgeChunker);
+    }
 
-    // Enviar para o serviço Python
+    // Enviar para o serviço Python: responde na hora com o job de ingestão
     const response = await axios.post(
       `${crewaiApiUrl}/api/v2/knowledge/upload`,
       formData,
       {
         headers: formData.getHeaders(),
-        timeout: 60000 // 60 segundos
+        timeout: 60000 // 60 segundos (só o envio do arquivo)
       }
     );
 
-    const { document_id, chunks_count, word_count } = response.data;
+    const { job_id, already_exists } = response.data;
+
+    // Documentos grandes levam mais que o timeout de uma requisição: acompanhar o job
+    const job = await waitIngestionJob(job_id);
+
+    if (job.status === "failed") {
+      throw new AppError(job.error || "Erro ao processar documento", 500);
+    }
+
+    const { document_id, chunks_count, word_count } = job;
+
+    // Mesmo conteúdo já enviado para a equipe (ou em processamento por outro upload,
+    // que o serviço devolve como o mesmo job): reutilizar o registro existente
+    if (already_exists || !replacedKnowledgeBase) {
+      const existing = await KnowledgeBase.findOne({
+        where: { teamId: parseInt(teamId), companyId, documentId: document_id }
+      });
+
+      if (existing) {
+        return res.status(200).json(existing);
+      }
+    }
 
     // Determinar tipo de arquivo
     let fileType = "txt";
@@ -100,6 +172,19 @@ export const upload = async (req: Request, res: Response): Promise<Response> =>
       fileType = "xlsx";
     }
 
+    if (replacedKnowledgeBase) {
+      await replacedKnowledgeBase.update({
+        filename: file.originalname,
+        fileType,
+        fileSize: file.size,
+        chunksCount: chunks_count,
+        wordCount: word_count,
+        status: "ready"
+      });
+
+      return res.status(200).json(replacedKnowledgeBase);
+    }
+
     // Criar registro no banco de dados
     const knowledgeBase = await KnowledgeBase.create({
       teamId: parseInt(teamId),
@@ -115,6 +200,10 @@ export const upload = async (req: Request, res: Response): Promise<Response> =>
 
     return res.status(201).json(knowledgeBase);
   } catch (error: any) {
+    if (error instanceof AppError) {
+      throw error;
+    }
+
     console.error("Erro ao processar documento:", error);
 
     if (error.response) {
@@ -96,7 +96,8 @@ export const update = async (req: Request, res: Response): Promise<Response> =>
     managerLLM,
     temperature,
     verbose,
-    managerAgentId
+    managerAgentId,
+    knowledgeChunker
   } = req.body;
 
   const team = await Team.findOne({
@@ -121,6 +122,13 @@ export const update = async (req: Request, res: Response): Promise<Response> =>
     }
   }
 
+  // Validar knowledgeChunker se fornecido (null/"" = padrão do serviço)
+  if (knowledgeChunker !== undefined && knowledgeChunker !== null && knowledgeChunker !== "") {
+    if (!["chars", "sentences"].includes(knowledgeChunker)) {
+      throw new AppError("knowledgeChunker deve ser 'chars' ou 'sentences'", 400);
+    }
+  }
+
   await team.update({
     name: name || team.name,
     description: description !== undefined ? description : team.description,
@@ -130,7 +138,8 @@ export const update = async (req: Request, res: Response): Promise<Response> =>
     managerLLM: managerLLM !== undefined ? managerLLM : team.managerLLM,
     temperature: temperature !== undefined ? temperature : team.temperature,
     verbose: verbose !== undefined ? verbose : team.verbose,
-    managerAgentId: managerAgentId !== undefined ? managerAgentId : team.managerAgentId
+    managerAgentId: managerAgentId !== undefined ? managerAgentId : team.managerAgentId,
+    knowledgeChunker: knowledgeChunker !== undefined ? knowledgeChunker || null : team.knowledgeChunker
   });
 
   return res.status(200).json(team);
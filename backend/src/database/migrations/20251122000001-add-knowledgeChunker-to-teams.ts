@@ -0,0 +1,15 @@
+import { QueryInterface, DataTypes } from "sequelize";
+
+module.exports = {
+  up: async (queryInterface: QueryInterface) => {
+    await queryInterface.addColumn("Teams", "knowledgeChunker", {
+      type: DataTypes.ENUM("chars", "sentences"),
+      allowNull: true,
+      comment: "Chunker da base de conhecimento (null = padrão do serviço, KNOWLEDGE_CHUNKER)"
+    });
+  },
+
+  down: async (queryInterface: QueryInterface) => {
+    await queryInterface.removeColumn("Teams", "knowledgeChunker");
+  }
+};
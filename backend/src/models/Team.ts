@@ -93,6 +93,13 @@ class Team extends Model<Team> {
   })
   managerAgentId: number;
 
+  @Column({
+    type: DataType.ENUM("chars", "sentences"),
+    allowNull: true,
+    comment: "Chunker da base de conhecimento (null = padrão do serviço, KNOWLEDGE_CHUNKER)"
+  })
+  knowledgeChunker: "chars" | "sentences" | null;
+
   @ForeignKey(() => Company)
   @Column
   companyId: number;
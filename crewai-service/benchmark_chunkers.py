@@ -0,0 +1,141 @@
+# benchmark_chunkers.py - Compara os chunkers da Knowledge Base
+#
+# Para cada chunker mede quantidade/tamanho dos chunks, tempo de chunking e
+# taxa de acerto na busca: frases do próprio texto viram consultas (parte
+# das palavras, embaralhadas) e há acerto quando algum dos top-k chunks
+# contém a frase inteira.
+#
+# Uso:
+#   python benchmark_chunkers.py                              # corpus sintético
+#   python benchmark_chunkers.py manual.pdf precos.xlsx       # arquivos reais
+#   python benchmark_chunkers.py --ranker bm25 --queries 500 --top-k 3
+
+import argparse
+import random
+import time
+from typing import Dict, List
+
+from bm25_index import tokenize
+from document_extraction import DocumentExtractor
+from knowledge_index import build_index, resolve_ranker
+from text_chunker import CHUNKERS, count_tokens, split_sentences
+
+
+def load_text(path: str, extractor: DocumentExtractor) -> str:
+    extension = path.lower().split('.')[-1]
+    with open(path, 'rb') as f:
+        content = f.read()
+
+    if extension == 'pdf':
+        return extractor.extract_pdf(content)
+    if extension in ['docx', 'doc']:
+        return extractor.extract_docx(content)
+    if extension in ['xlsx', 'xls']:
+        return extractor.extract_xlsx(content)
+    return content.decode('utf-8', errors='ignore')
+
+
+def synthetic_corpus(seed: int = 7) -> str:
+    """FAQ em parágrafos + tabela de preços no formato do extrator de XLSX"""
+    rng = random.Random(seed)
+    subjects = ['entrega', 'troca', 'garantia', 'pagamento', 'horário', 'cadastro', 'cupom', 'frete', 'devolução', 'nota fiscal']
+    verbs = ['pode ser solicitada', 'é realizada', 'fica disponível', 'deve ser confirmada', 'é calculada', 'é enviada']
+    places = ['pelo aplicativo', 'na loja física', 'pelo WhatsApp', 'no site', 'por e-mail', 'com o atendente']
+    times = ['em até 2 dias úteis', 'no mesmo dia', 'após a aprovação do pagamento', 'de segunda a sexta', 'em até 7 dias corridos']
+
+    paragraphs = []
+    for i in range(300):
+        sentences = [
+            f"A {rng.choice(subjects)} do pedido {i}{j} {rng.choice(verbs)} {rng.choice(places)} {rng.choice(times)}."
+            for j in range(rng.randint(2, 6))
+        ]
+        paragraphs.append(" ".join(sentences))
+
+    rows = [f"{'produto':<20} {'categoria':<12} {'preco':>10} {'estoque':>8}"]
+    for i in range(1500):
+        rows.append(
+            f"{'item-' + str(i) + '-' + rng.choice(subjects).replace(' ', '-'):<20} "
+            f"{rng.choice(['bebidas', 'limpeza', 'padaria', 'frios', 'hortifruti']):<12} "
+            f"{rng.randint(1, 999) + rng.randint(0, 99) / 100:>10.2f} {rng.randint(0, 500):>8}"
+        )
+
+    return "\n\n".join(paragraphs) + f"\n\n{'=' * 60}\nPLANILHA: Precos\n{'=' * 60}\n\n" + "\n".join(rows) + "\n"
+
+
+def sample_queries(text: str, count: int, rng: random.Random) -> List[Dict[str, str]]:
+    """Frases/linhas com 6+ palavras; a consulta usa ~60% das palavras, embaralhadas"""
+    sentences = [sentence for sentence in split_sentences(text) if len(tokenize(sentence)) >= 6]
+
+    queries = []
+    for sentence in rng.sample(sentences, min(count, len(sentences))):
+        words = sentence.split()
+        picked = rng.sample(words, min(len(words), max(3, int(len(words) * 0.6))))
+        queries.append({'sentence': sentence, 'query': " ".join(picked)})
+    return queries
+
+
+def evaluate(name: str, text: str, queries: List[Dict[str, str]], ranker: str, top_k: int, repeat: int) -> Dict[str, float]:
+    chunker = CHUNKERS[name]
+
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        chunks = list(chunker([text]))
+        timings.append(time.perf_counter() - started)
+
+    chunk_data = [
+        {'chunkId': f"bench_chunk_{i}", 'documentId': 'bench', 'chunkIndex': i, 'content': content, 'metadata': {}}
+        for i, content in enumerate(chunks)
+    ]
+    index = build_index(chunk_data, ranker)
+    normalized = [" ".join(content.split()) for content in chunks]
+
+    hits = 0
+    ranked_lists = index.search_batch([q['query'] for q in queries], top_k)
+    for q, ranked in zip(queries, ranked_lists):
+        if any(q['sentence'] in normalized[position] for position, score in ranked if score > 0):
+            hits += 1
+
+    token_counts = [count_tokens(content) for content in chunks]
+    return {
+        'chunks': len(chunks),
+        'avg_tokens': sum(token_counts) / len(chunks) if chunks else 0,
+        'max_tokens': max(token_counts) if chunks else 0,
+        'ms': min(timings) * 1000,
+        'mb_per_s': len(text) / 1e6 / min(timings) if min(timings) else 0,
+        'hit_rate': hits / len(queries) if queries else 0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compara os chunkers da Knowledge Base")
+    parser.add_argument("files", nargs="*", help="Arquivos PDF/DOCX/XLSX/TXT (padrão: corpus sintético)")
+    parser.add_argument("--ranker", default=None, help="tfidf ou bm25 (padrão: KNOWLEDGE_RANKER)")
+    parser.add_argument("--queries", type=int, default=300, help="Consultas amostradas do texto")
+    parser.add_argument("--top-k", type=int, default=3)
+    parser.add_argument("--repeat", type=int, default=3, help="Repetições para medir o tempo (melhor caso)")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    if args.files:
+        extractor = DocumentExtractor()
+        text = "\n".join(load_text(path, extractor) for path in args.files)
+        extractor.shutdown()
+    else:
+        text = synthetic_corpus()
+
+    ranker = resolve_ranker(args.ranker)
+    queries = sample_queries(text, args.queries, random.Random(args.seed))
+    print(f"📚 Corpus: {len(text)} caracteres, {len(queries)} consultas, ranker={ranker}, top_k={args.top_k}")
+
+    print(f"{'chunker':<10} {'chunks':>7} {'tok/chunk':>10} {'tok máx':>8} {'tempo ms':>9} {'MB/s':>7} {'acerto':>7}")
+    for name in CHUNKERS:
+        result = evaluate(name, text, queries, ranker, args.top_k, args.repeat)
+        print(
+            f"{name:<10} {result['chunks']:>7} {result['avg_tokens']:>10.1f} {result['max_tokens']:>8} "
+            f"{result['ms']:>9.1f} {result['mb_per_s']:>7.2f} {result['hit_rate']:>7.1%}"
+        )
+
+
+if __name__ == "__main__":
+    main()
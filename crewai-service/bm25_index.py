@@ -0,0 +1,129 @@
+# bm25_index.py - Índice invertido com ranking BM25 para a Knowledge Base
+
+import re
+import unicodedata
+from collections import Counter
+from typing import List, Dict, Any, Tuple
+import numpy as np
+from sparse_index_files import PostingsIndex, terms_table, lookup_term_rows, postings_arrays
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+# Tokens maiores que isso (base64, hashes, lixo de PDF) ficam fora do vocabulário
+MAX_TERM_LENGTH = 40
+
+
+def tokenize(text: str) -> List[str]:
+    """Tokeniza sem acentos e em minúsculas ("Horário" == "horario")"""
+    nfd = unicodedata.normalize('NFD', text.lower())
+    folded = ''.join(char for char in nfd if unicodedata.category(char) != 'Mn')
+    return [token for token in _TOKEN_RE.findall(folded) if len(token) <= MAX_TERM_LENGTH]
+
+
+class BM25Index(PostingsIndex):
+    """
+    Índice invertido (posting lists por termo) com score BM25 (Okapi)
+
+    A contribuição BM25 de cada (termo, chunk) não depende da query, então
+    é calculada uma vez na construção e guardada em postings_weights. A
+    busca só percorre as listas dos termos da query: o custo depende do
+    número de postings que casam, não do tamanho do corpus, e o top-k é
+    uma seleção parcial entre os chunks que casaram.
+    """
+
+    ranker = 'bm25'
+
+    @classmethod
+    def build(cls, chunk_data: List[Dict[str, Any]], k1: float = 1.5, b: float = 0.75) -> 'BM25Index':
+        term_postings: Dict[str, List[Tuple[int, int]]] = {}
+        doc_lengths = np.zeros(len(chunk_data), dtype=np.float32)
+
+        for doc_idx, chunk in enumerate(chunk_data):
+            counts = Counter(tokenize(chunk['content']))
+            doc_lengths[doc_idx] = sum(counts.values())
+            for term, tf in counts.items():
+                term_postings.setdefault(term, []).append((doc_idx, tf))
+
+        terms = terms_table(list(term_postings))
+        indptr = [0]
+        docs: List[int] = []
+        tfs: List[int] = []
+        for term in terms.tolist():
+            for doc_idx, tf in term_postings[term]:
+                docs.append(doc_idx)
+                tfs.append(tf)
+            indptr.append(len(docs))
+
+        postings_indptr = np.array(indptr, dtype=np.int64)
+        postings_docs = np.array(docs, dtype=np.int32)
+        tf = np.array(tfs, dtype=np.float32)
+
+        n_docs = len(chunk_data)
+        avg_doc_length = float(doc_lengths.mean()) if n_docs else 0.0
+        doc_freq = np.diff(postings_indptr).astype(np.float64)
+        idf = np.log(1.0 + (n_docs - doc_freq + 0.5) / (doc_freq + 0.5)).astype(np.float32)
+
+        if avg_doc_length:
+            norm = k1 * (1 - b + b * doc_lengths[postings_docs] / avg_doc_length)
+            term_idf = np.repeat(idf, np.diff(postings_indptr))
+            weights = (term_idf * tf * (k1 + 1) / (tf + norm)).astype(np.float32)
+        else:
+            weights = np.zeros(len(postings_docs), dtype=np.float32)
+
+        arrays = {
+            'terms': terms,
+            'postings_indptr': postings_indptr,
+            'postings_docs': postings_docs,
+            'postings_weights': weights,
+        }
+        params = {'k1': k1, 'b': b, 'avg_doc_length': avg_doc_length}
+        return cls([chunk['chunkId'] for chunk in chunk_data], arrays, params)
+
+    def query_vector(self, query: str) -> Tuple[List[int], List[float]]:
+        """Cada termo distinto da query soma sua contribuição BM25 uma vez"""
+        query_terms = sorted(set(tokenize(query)))
+        rows = [row for row in lookup_term_rows(self.terms, query_terms) if row >= 0]
+        return rows, [1.0] * len(rows)
+
+    def build_segment(self, chunk_data: List[Dict[str, Any]], segments: List['BM25Index']) -> 'BM25Index':
+        """
+        Segmento incremental com vocabulário próprio (cresce com termos novos)
+
+        Usa k1/b/avg_doc_length deste índice (o segmento base) e o IDF com N e
+        document frequency somando os segmentos existentes. Os pesos dos
+        segmentos antigos não são recalculados - essa diferença (drift) é
+        corrigida pela compactação.
+        """
+        k1, b = self.params['k1'], self.params['b']
+        avg_doc_length = self.params['avg_doc_length']
+
+        chunk_counts = [Counter(tokenize(chunk['content'])) for chunk in chunk_data]
+        terms = terms_table(list({term for counts in chunk_counts for term in counts}))
+        term_list = terms.tolist()
+
+        n_docs = sum(len(segment) for segment in segments) + len(chunk_data)
+        doc_freq = np.zeros(len(terms), dtype=np.float64)
+        for segment in segments:
+            for row, segment_row in enumerate(lookup_term_rows(segment.terms, term_list)):
+                if segment_row >= 0:
+                    doc_freq[row] += segment.postings_indptr[segment_row + 1] - segment.postings_indptr[segment_row]
+        for counts in chunk_counts:
+            for row in lookup_term_rows(terms, list(counts)):
+                doc_freq[row] += 1
+        idf = np.log(1.0 + (n_docs - doc_freq + 0.5) / (doc_freq + 0.5))
+
+        term_rows: List[int] = []
+        positions: List[int] = []
+        weights: List[float] = []
+        for position, counts in enumerate(chunk_counts):
+            doc_length = sum(counts.values())
+            norm = k1 * (1 - b + b * doc_length / avg_doc_length) if avg_doc_length else k1
+            for (term, tf), row in zip(counts.items(), lookup_term_rows(terms, list(counts))):
+                term_rows.append(row)
+                positions.append(position)
+                weights.append(idf[row] * tf * (k1 + 1) / (tf + norm))
+
+        arrays = {'terms': terms}
+        arrays.update(postings_arrays(term_rows, positions, weights, len(terms), len(chunk_data)))
+        params = {'k1': k1, 'b': b, 'avg_doc_length': avg_doc_length}
+        return BM25Index([chunk['chunkId'] for chunk in chunk_data], arrays, params)
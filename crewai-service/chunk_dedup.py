@@ -0,0 +1,152 @@
+# chunk_dedup.py - Detecção de chunks duplicados (MinHash + LSH, confirmação por texto normalizado)
+
+import re
+import zlib
+import hashlib
+import unicodedata
+from typing import Callable, Dict, List, Optional
+import numpy as np
+from bm25_index import tokenize
+
+# 128 permutações em 16 bandas de 8 linhas: chunks com o mesmo texto
+# normalizado têm a mesma assinatura e caem nos mesmos buckets
+NUM_PERM = 128
+BANDS = 16
+ROWS_PER_BAND = NUM_PERM // BANDS
+
+# Palavras por shingle
+SHINGLE_SIZE = 3
+
+_MERSENNE_PRIME = (1 << 31) - 1
+
+_WORD_PATTERN = re.compile(r'\w+', re.UNICODE)
+
+
+def normalize_text(text: str) -> str:
+    """Palavras e números do chunk, sem acentos e em minúsculas (nenhum token é descartado)"""
+    nfd = unicodedata.normalize('NFD', text.lower())
+    folded = ''.join(char for char in nfd if unicodedata.category(char) != 'Mn')
+    return ' '.join(_WORD_PATTERN.findall(folded))
+
+
+class MinHasher:
+    """
+    Assinaturas MinHash de chunks e chaves LSH (uma por banda)
+
+    Os shingles são trigramas de palavras já normalizadas (sem acento,
+    minúsculas), então "Preço: R$ 10" e "preco r$ 10" geram o mesmo
+    conjunto. A assinatura é determinística (seed fixa): pode ser gravada
+    no chunk store e comparada entre processos.
+    """
+
+    def __init__(self, num_perm: int = NUM_PERM, bands: int = BANDS, seed: int = 42):
+        rng = np.random.RandomState(seed)
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows_per_band = num_perm // bands
+        self._a = rng.randint(1, _MERSENNE_PRIME, size=num_perm).astype(np.uint64)
+        self._b = rng.randint(0, _MERSENNE_PRIME, size=num_perm).astype(np.uint64)
+
+    def _shingles(self, text: str) -> np.ndarray:
+        tokens = tokenize(text)
+        if len(tokens) < SHINGLE_SIZE:
+            grams = [" ".join(tokens)] if tokens else []
+        else:
+            grams = [" ".join(tokens[i:i + SHINGLE_SIZE]) for i in range(len(tokens) - SHINGLE_SIZE + 1)]
+        hashes = {zlib.crc32(gram.encode('utf-8')) & _MERSENNE_PRIME for gram in grams}
+        return np.fromiter(hashes, dtype=np.uint64, count=len(hashes))
+
+    def signature(self, text: str) -> Optional[np.ndarray]:
+        """Assinatura (num_perm valores uint32) ou None para texto sem palavras"""
+        shingles = self._shingles(text)
+        if len(shingles) == 0:
+            return None
+        hashed = (np.outer(self._a, shingles) + self._b[:, None]) % _MERSENNE_PRIME
+        return hashed.min(axis=1).astype(np.uint32)
+
+    def band_keys(self, signature: np.ndarray) -> List[str]:
+        """Uma chave por banda; chunks que compartilham alguma chave são candidatos"""
+        return [
+            f"{band}:" + hashlib.blake2b(
+                signature[band * self.rows_per_band:(band + 1) * self.rows_per_band].tobytes(),
+                digest_size=8
+            ).hexdigest()
+            for band in range(self.bands)
+        ]
+
+    @staticmethod
+    def similarity(signature_a: np.ndarray, signature_b: np.ndarray) -> float:
+        """Jaccard estimado entre dois chunks"""
+        return float(np.mean(signature_a == signature_b))
+
+    @staticmethod
+    def to_bytes(signature: np.ndarray) -> bytes:
+        return signature.astype(np.uint32).tobytes()
+
+    @staticmethod
+    def from_bytes(data: bytes) -> np.ndarray:
+        return np.frombuffer(data, dtype=np.uint32)
+
+
+MINHASHER = MinHasher()
+
+
+class NearDuplicateLinker:
+    """
+    Decide, chunk a chunk, se ele repete um chunk já existente
+
+    Só vira link o chunk cujo texto normalizado (normalize_text) é idêntico
+    ao do canônico: o link guarda conteúdo vazio e as buscas leem o texto do
+    canônico, então qualquer diferença real (um preço, uma data) precisa
+    manter o próprio conteúdo. O LSH da equipe (`lookup(band_keys)` ->
+    {chunk_id: assinatura}) só encontra os candidatos; os de assinatura
+    idêntica têm o texto conferido via `contents(chunk_ids)` -> {chunk_id:
+    conteúdo}. Chunks anteriores do mesmo documento que ainda não foram
+    gravados também contam, então funciona com os chunks em streaming.
+    """
+
+    def __init__(
+        self,
+        lookup: Callable[[List[str]], Dict[str, np.ndarray]],
+        contents: Callable[[List[str]], Dict[str, str]]
+    ):
+        self._lookup = lookup
+        self._contents = contents
+        # Hash do texto normalizado -> chunk_id (chunks do documento ainda não gravados)
+        self._pending: Dict[str, str] = {}
+
+    @staticmethod
+    def _text_key(normalized: str) -> str:
+        return hashlib.blake2b(normalized.encode('utf-8'), digest_size=16).hexdigest()
+
+    def link(self, chunk_id: str, content: str) -> Optional[str]:
+        """chunk_id do canônico se `content` repete um chunk existente, senão None (e vira candidato)"""
+        signature = MINHASHER.signature(content)
+        if signature is None:
+            return None
+        normalized = normalize_text(content)
+        text_key = self._text_key(normalized)
+
+        # Mesmo texto normalizado => mesmos shingles => assinatura idêntica
+        candidates = sorted(
+            candidate_id
+            for candidate_id, candidate_signature in self._lookup(MINHASHER.band_keys(signature)).items()
+            if np.array_equal(candidate_signature, signature)
+        )
+        if candidates:
+            candidate_contents = self._contents(candidates)
+            for candidate_id in candidates:
+                candidate_content = candidate_contents.get(candidate_id)
+                if candidate_content is not None and normalize_text(candidate_content) == normalized:
+                    return candidate_id
+
+        pending_id = self._pending.get(text_key)
+        if pending_id is not None:
+            return pending_id
+
+        self._pending[text_key] = chunk_id
+        return None
+
+    def forget_pending(self):
+        """Os chunks anteriores já foram gravados (e estão no LSH da equipe)"""
+        self._pending.clear()
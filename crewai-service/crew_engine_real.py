@@ -1,8 +1,11 @@
 # crew_engine_real.py - Motor CrewAI COMPLETO com logging no backend e Knowledge Base
 
-from typing import Dict, Any, List, Optional
+from typing import Callable, Dict, Any, List, Optional
 import time
 import os
+import sys
+import asyncio
+import contextvars
 import requests
 import unicodedata
 from datetime import datetime, timedelta
@@ -10,10 +13,47 @@ import json
 from crewai import Agent, Task, Crew, Process
 from langchain_google_vertexai import ChatVertexAI
 from simple_knowledge_service import get_knowledge_service
+from llm_concurrency import get_llm_limiter
+from llm_client_pool import get_llm_client_pool
+from response_cache import get_response_cache
+from delegation_router import get_delegation_router
 # from claude_validator import ClaudeValidator  # DESABILITADO
 
 BACKEND_URL = os.getenv("BACKEND_URL", "http://localhost:8000")
 
+# Eventos do processamento para o endpoint de streaming: on_event(tipo, dados)
+EventCallback = Callable[[str, Dict[str, Any]], None]
+
+
+class StreamInterruptedError(Exception):
+    """O LLM falhou depois de trechos da resposta já terem sido enviados ao cliente"""
+
+# Buffer que recebe os prints da requisição atual (playground); None = console
+_log_capture: contextvars.ContextVar = contextvars.ContextVar('log_capture', default=None)
+
+
+class _ContextStdout:
+    """
+    sys.stdout que desvia os prints para o buffer do contexto atual
+
+    Com várias conversas no event loop ao mesmo tempo, trocar sys.stdout
+    por um StringIO capturaria os prints das outras e, intercalando dois
+    playgrounds, deixaria o stdout preso num buffer. Cada task tem o seu
+    contexto, então cada playground captura só os próprios logs.
+    """
+
+    def __init__(self, stream):
+        self._stream = stream
+
+    def write(self, text):
+        return (_log_capture.get() or self._stream).write(text)
+
+    def flush(self):
+        (_log_capture.get() or self._stream).flush()
+
+    def __getattr__(self, name):
+        return getattr(self._stream, name)
+
 class RealCrewEngine:
     """Motor CrewAI completo com suporte a sequential, hierarchical, manager, logging e Knowledge Base"""
 
@@ -21,6 +61,10 @@ class RealCrewEngine:
         print("🚀 Inicializando RealCrewEngine...")
         self.llm = None
         self.knowledge_service = get_knowledge_service()
+        self.llm_limiter = get_llm_limiter()
+        self.llm_pool = get_llm_client_pool()
+        self.response_cache = get_response_cache()
+        self.delegation_router = get_delegation_router()
         # self.claude_validator = None  # DESABILITADO
         self._initialize_llm()
         # self._initialize_claude_validator()  # DESABILITADO
@@ -38,13 +82,7 @@ class RealCrewEngine:
             if 'OPENAI_API_KEY' in os.environ:
                 del os.environ['OPENAI_API_KEY']
             
-            self.llm = ChatVertexAI(
-                model="gemini-2.0-flash-lite",
-                project=os.getenv("GOOGLE_CLOUD_PROJECT"),
-                location=os.getenv("GOOGLE_CLOUD_LOCATION"),
-                temperature=0.7,
-                max_output_tokens=1024,
-            )
+            self.llm = self.llm_pool.get("gemini-2.0-flash-lite", temperature=0.7, max_output_tokens=1024)
             print("✅ Vertex AI (gemini-2.0-flash-lite) inicializado com sucesso!")
         except Exception as e:
             print(f"⚠️ Erro ao inicializar Vertex AI: {e}")
@@ -65,8 +103,12 @@ class RealCrewEngine:
         except Exception as e:
             print(f"⚠️ Erro ao conectar com backend para salvar log: {e}")
 
-    def _get_llm_for_team(self, team_config: Dict[str, Any]) -> ChatVertexAI:
-        """Cria LLM customizado baseado nas configurações da equipe"""
+    def _save_log_in_background(self, log_data: Dict[str, Any]):
+        """Salva o log numa thread, sem atrasar a resposta (erros já são tratados em _save_log_to_backend)"""
+        asyncio.get_running_loop().run_in_executor(None, self._save_log_to_backend, log_data)
+
+    async def _get_llm_for_team(self, team_config: Dict[str, Any]) -> ChatVertexAI:
+        """LLM com as configurações da equipe (cliente compartilhado do pool, criado só na primeira vez, fora do event loop)"""
         temperature = team_config.get('temperature', 0.7)
         model = "gemini-2.0-flash-lite"
         
@@ -74,19 +116,20 @@ class RealCrewEngine:
             model = team_config['managerLLM']
         
         try:
-            llm = ChatVertexAI(
-                model=model,
-                project=os.getenv("GOOGLE_CLOUD_PROJECT"),
-                location=os.getenv("GOOGLE_CLOUD_LOCATION"),
-                temperature=temperature,
-                max_output_tokens=1024,
-            )
-            print(f"✅ LLM customizado criado: {model}, temperature={temperature}")
-            return llm
+            return await self.llm_pool.aget(model, temperature=temperature, max_output_tokens=1024)
         except Exception as e:
             print(f"⚠️ Erro ao criar LLM customizado: {e}, usando padrão")
             return self.llm
 
+    def _get_response_cache_settings(self, team_data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Cache de respostas é opt-in por equipe (responseCacheEnabled); None = desligado"""
+        if not team_data.get('responseCacheEnabled'):
+            return None
+        return {
+            'ttlSeconds': team_data.get('responseCacheTtlSeconds'),
+            'similarity': team_data.get('responseCacheSimilarity'),
+        }
+
     def _normalize_text(self, text: str) -> str:
         """Remove acentos e normaliza texto para comparação"""
         # Normaliza para NFD (separa caracteres base de acentos)
@@ -330,9 +373,22 @@ class RealCrewEngine:
         print("="*60 + "\n")
         return None
 
-    def _build_full_prompt(self, message: str, agent_data: Dict[str, Any], conversation_history: List[Dict[str, Any]], knowledge_context: Optional[str] = None) -> tuple[str, List[Dict[str, Any]]]:
+    def _get_prompt_resources(self, agent_data: Dict[str, Any]) -> Dict[str, List[Dict[str, Any]]]:
+        """Exemplos de treinamento e arquivos do agente (buscados no backend) que entram no prompt"""
+        agent_id = agent_data.get('id')
+        if not agent_id:
+            return {'trainingExamples': [], 'agentFiles': []}
+        return {
+            'trainingExamples': self._get_relevant_training_examples(agent_id, limit=5),
+            'agentFiles': self._get_agent_files(agent_id),
+        }
+
+    def _build_full_prompt(self, message: str, agent_data: Dict[str, Any], conversation_history: List[Dict[str, Any]], knowledge_context: Optional[str] = None, resources: Optional[Dict[str, List[Dict[str, Any]]]] = None) -> tuple[str, List[Dict[str, Any]]]:
         """Constrói o prompt completo com TODAS as configurações do agente + Knowledge Base + Tool Context
 
+        Args:
+            resources: exemplos e arquivos já buscados (_get_prompt_resources); None = buscar agora
+
         Returns:
             tuple: (prompt_completo, training_examples_usados)
         """
@@ -358,15 +414,15 @@ class RealCrewEngine:
             print(f"📚 Knowledge Base: SIM ({len(knowledge_context)} chars)")
         print("="*60 + "\n")
 
-        # Buscar exemplos de treinamento (Few-Shot Learning)
-        training_examples = []
-        agent_id = agent_data.get('id')
-        if agent_id:
-            training_examples = self._get_relevant_training_examples(agent_id, limit=5)
-            if training_examples:
-                print(f"🎓 {len(training_examples)} exemplos de treinamento serão usados para Few-Shot Learning")
-                for idx, ex in enumerate(training_examples, 1):
-                    print(f"   Exemplo {idx}: {ex.get('feedbackType')} - Priority {ex.get('priority')}")
+        # Buscar exemplos de treinamento (Few-Shot Learning) e arquivos do agente
+        if resources is None:
+            resources = self._get_prompt_resources(agent_data)
+        training_examples = resources['trainingExamples']
+        agent_files = resources['agentFiles']
+        if training_examples:
+            print(f"🎓 {len(training_examples)} exemplos de treinamento serão usados para Few-Shot Learning")
+            for idx, ex in enumerate(training_examples, 1):
+                print(f"   Exemplo {idx}: {ex.get('feedbackType')} - Priority {ex.get('priority')}")
 
         prompt_parts = []
         prompt_parts.append(f"Você é {name}, {role}.")
@@ -427,21 +483,19 @@ class RealCrewEngine:
             prompt_parts.append(examples_formatted)
 
         # ADICIONAR ARQUIVOS DISPONÍVEIS PARA ENVIO
-        if agent_id:
-            agent_files = self._get_agent_files(agent_id)
-            if agent_files:
-                prompt_parts.append("\n\n**📎 ARQUIVOS DISPONÍVEIS PARA ENVIO:**")
-                prompt_parts.append("Você tem os seguintes arquivos que pode enviar ao cliente quando solicitado:")
-                for file in agent_files:
-                    file_desc = file.get('description') or file.get('originalName', 'Arquivo')
-                    file_type = file.get('fileType', 'arquivo').upper()
-                    prompt_parts.append(f"- [SEND_FILE:{file.get('id')}] {file_desc} ({file_type})")
-                prompt_parts.append("\n**COMO ENVIAR ARQUIVOS:**")
-                prompt_parts.append("- Quando o cliente pedir um arquivo (cardápio, tabela de preços, documento, etc), inclua o código [SEND_FILE:id] na sua resposta")
-                prompt_parts.append("- Exemplo: 'Claro! Vou te enviar o cardápio agora. [SEND_FILE:1]'")
-                prompt_parts.append("- O arquivo será enviado automaticamente pelo sistema")
-                prompt_parts.append("- SEMPRE responda com uma frase natural ANTES do código [SEND_FILE:id]")
-                prompt_parts.append("- Você pode enviar múltiplos arquivos se necessário: [SEND_FILE:1] [SEND_FILE:2]")
+        if agent_files:
+            prompt_parts.append("\n\n**📎 ARQUIVOS DISPONÍVEIS PARA ENVIO:**")
+            prompt_parts.append("Você tem os seguintes arquivos que pode enviar ao cliente quando solicitado:")
+            for file in agent_files:
+                file_desc = file.get('description') or file.get('originalName', 'Arquivo')
+                file_type = file.get('fileType', 'arquivo').upper()
+                prompt_parts.append(f"- [SEND_FILE:{file.get('id')}] {file_desc} ({file_type})")
+            prompt_parts.append("\n**COMO ENVIAR ARQUIVOS:**")
+            prompt_parts.append("- Quando o cliente pedir um arquivo (cardápio, tabela de preços, documento, etc), inclua o código [SEND_FILE:id] na sua resposta")
+            prompt_parts.append("- Exemplo: 'Claro! Vou te enviar o cardápio agora. [SEND_FILE:1]'")
+            prompt_parts.append("- O arquivo será enviado automaticamente pelo sistema")
+            prompt_parts.append("- SEMPRE responda com uma frase natural ANTES do código [SEND_FILE:id]")
+            prompt_parts.append("- Você pode enviar múltiplos arquivos se necessário: [SEND_FILE:1] [SEND_FILE:2]")
 
         if do_list:
             prompt_parts.append("\n\n**VOCÊ DEVE:**")
@@ -465,7 +519,7 @@ class RealCrewEngine:
 
         return full_prompt, training_examples
 
-    def _validate_response_against_config(self, response: str, agent_data: Dict[str, Any], llm: ChatVertexAI, conversation_history: List[Dict[str, str]] = None) -> str:
+    async def _validate_response_against_config(self, response: str, agent_data: Dict[str, Any], llm: ChatVertexAI, conversation_history: List[Dict[str, str]] = None, tenant_id: Optional[str] = None) -> str:
         """
         Validacao 100% generica usando Claude Haiku (primário) ou Gemini Free (fallback)
         Claude: 95%+ acurácia, $0.0002-0.0006 por validação
@@ -525,7 +579,7 @@ class RealCrewEngine:
 
         try:
             from langchain_core.messages import HumanMessage
-            validation_response = llm.invoke([HumanMessage(content=validation_prompt)])
+            validation_response = await self.llm_limiter.ainvoke(llm, [HumanMessage(content=validation_prompt)], tenant_id)
             validation_text = validation_response.content.strip()
 
             print(f"Resultado: {validation_text}\n")
@@ -549,7 +603,7 @@ class RealCrewEngine:
 
                 rewrite_parts.append("\nResposta corrigida:")
                 rewrite_prompt = "".join(rewrite_parts)
-                rewrite_response = llm.invoke([HumanMessage(content=rewrite_prompt)])
+                rewrite_response = await self.llm_limiter.ainvoke(llm, [HumanMessage(content=rewrite_prompt)], tenant_id)
                 corrected = rewrite_response.content.strip()
 
                 print(f"Resposta corrigida:\n{corrected}\n" + "="*60 + "\n")
@@ -623,20 +677,24 @@ class RealCrewEngine:
         
         return agent
 
-    def _run_manual_hierarchical_delegation(
+    async def _run_manual_hierarchical_delegation(
         self,
         message: str,
         manager_agent_data: Dict[str, Any],
         specialist_agents_data: List[Dict[str, Any]],
         conversation_history: List[Dict[str, Any]],
         llm: ChatVertexAI,
-        knowledge_context: Optional[str] = None
+        knowledge_context: Optional[str] = None,
+        tenant_id: Optional[str] = None,
+        on_event: Optional[EventCallback] = None,
+        team_id: Optional[str] = None
     ) -> Dict[str, Any]:
         """
         Delegação hierárquica MANUAL usando apenas Vertex AI (sem CrewAI framework)
         
         Fluxo:
-        1. Manager analisa mensagem e decide qual especialista usar
+        1. Roteador local escolhe o especialista; só nos casos ambíguos o
+           Manager (LLM) analisa a mensagem e decide
         2. Especialista selecionado processa a mensagem
         3. Retorna resposta do especialista
         
@@ -647,6 +705,9 @@ class RealCrewEngine:
             conversation_history: Histórico da conversa
             llm: Modelo LLM Vertex AI
             knowledge_context: Contexto da KB (se houver)
+            tenant_id: Empresa (limite de chamadas simultâneas ao LLM por tenant)
+            on_event: Recebe o agente escolhido ("agent") e os trechos da resposta ("token")
+            team_id: Equipe (decisões e exemplos do roteador local); None = sempre pergunta ao manager
         
         Returns:
             Dict com success, response, agent_used, delegation_info
@@ -675,10 +736,17 @@ class RealCrewEngine:
             
             specialists_context = "\n".join(specialists_info)
             
-            # 2. Manager decide qual especialista usar (via Vertex AI)
-            print("\n🤔 Manager analisando mensagem para decidir delegação...")
-            
-            delegation_prompt = f"""Você é {manager_agent_data.get('name')}, {manager_agent_data.get('function')}.
+            # 2. Roteador local (palavras-chave, objetivos e decisões anteriores do manager)
+            route = self.delegation_router.route(team_id, message, manager_agent_data, specialist_agents_data)
+            if route is not None:
+                delegation_choice = str(route['choice'])
+                delegation_method = route['method']
+                print(f"⚡ Roteador local decidiu: '{delegation_choice}' ({route['method']}, score {route['score']}, margem {route['margin']})")
+            else:
+                # Caso ambíguo: Manager decide qual especialista usar (via Vertex AI)
+                print("\n🤔 Manager analisando mensagem para decidir delegação...")
+                
+                delegation_prompt = f"""Você é {manager_agent_data.get('name')}, {manager_agent_data.get('function')}.
 
 ESPECIALISTAS DISPONÍVEIS:
 {specialists_context}
@@ -717,11 +785,14 @@ RESPONDA APENAS COM O NÚMERO do especialista (1, 2, 3, etc.) OU "0" se você me
 
 RESPONDA APENAS O NÚMERO (0, 1, 2, 3...), NADA MAIS."""
 
-            from langchain_core.messages import HumanMessage
-            delegation_response = llm.invoke([HumanMessage(content=delegation_prompt)])
-            delegation_choice = delegation_response.content.strip()
-            
-            print(f"✅ Manager decidiu: '{delegation_choice}'")
+                from langchain_core.messages import HumanMessage
+                delegation_response = await self.llm_limiter.ainvoke(llm, [HumanMessage(content=delegation_prompt)], tenant_id)
+                delegation_choice = delegation_response.content.strip()
+                delegation_method = "manual_vertex_ai"
+                
+                print(f"✅ Manager decidiu: '{delegation_choice}'")
+                if delegation_choice.isdigit():
+                    self.delegation_router.record(team_id, message, manager_agent_data, specialist_agents_data, int(delegation_choice))
             
             # 3. Selecionar agente baseado na decisão
             try:
@@ -746,13 +817,22 @@ RESPONDA APENAS O NÚMERO (0, 1, 2, 3...), NADA MAIS."""
             
             # 4. Especialista selecionado gera a resposta
             print(f"\n🚀 Gerando resposta com {selected_agent_data.get('name')}...")
+            if on_event:
+                on_event("agent", {
+                    "agent": selected_agent_data.get('name'),
+                    "agent_id": selected_agent_data.get('id'),
+                    "manager": manager_agent_data.get('name'),
+                    "process_type": "hierarchical"
+                })
 
-            response_text, prompt_used, training_examples_used = self._create_simple_response(
+            response_text, prompt_used, training_examples_used = await self._create_simple_response(
                 message,
                 selected_agent_data,
                 conversation_history,
                 llm,
-                knowledge_context
+                knowledge_context,
+                tenant_id,
+                on_token=self._token_callback(on_event)
             )
 
             print(f"✅ Resposta gerada por {selected_agent_data.get('name')}")
@@ -766,10 +846,13 @@ RESPONDA APENAS O NÚMERO (0, 1, 2, 3...), NADA MAIS."""
                     "manager_choice": delegation_choice,
                     "delegated_to": selected_agent_data.get('name'),
                     "specialists_available": len(specialist_agents_data),
-                    "method": "manual_vertex_ai"
+                    "method": delegation_method
                 }
             }
             
+        except StreamInterruptedError:
+            # Resposta já começou a ser enviada: o fallback não pode responder por cima
+            raise
         except Exception as e:
             print(f"❌ Erro na delegação manual: {e}")
             import traceback
@@ -777,12 +860,22 @@ RESPONDA APENAS O NÚMERO (0, 1, 2, 3...), NADA MAIS."""
             
             # Fallback: Manager responde diretamente
             print("⚠️  Fallback: Manager responde diretamente...")
-            fallback_response, _, _ = self._create_simple_response(
+            if on_event:
+                on_event("agent", {
+                    "agent": manager_agent_data.get('name'),
+                    "agent_id": manager_agent_data.get('id'),
+                    "manager": manager_agent_data.get('name'),
+                    "process_type": "hierarchical",
+                    "fallback": True
+                })
+            fallback_response, _, _ = await self._create_simple_response(
                 message,
                 manager_agent_data,
                 conversation_history,
                 llm,
-                knowledge_context
+                knowledge_context,
+                tenant_id,
+                on_token=self._token_callback(on_event)
             )
             
             return {
@@ -797,32 +890,63 @@ RESPONDA APENAS O NÚMERO (0, 1, 2, 3...), NADA MAIS."""
             }
 
 
-    def _create_simple_response(self, message: str, agent_data: Dict[str, Any], conversation_history: List[Dict[str, Any]], llm: ChatVertexAI, knowledge_context: Optional[str] = None) -> tuple[str, str, List[Dict[str, Any]]]:
-        """Gera resposta usando Vertex AI diretamente
+    def _token_callback(self, on_event: Optional[EventCallback]) -> Optional[Callable[[str], None]]:
+        """Trechos da resposta viram eventos "token" (None = resposta sem streaming)"""
+        if on_event is None:
+            return None
+        return lambda text: on_event("token", {"text": text})
+
+    async def _create_simple_response(self, message: str, agent_data: Dict[str, Any], conversation_history: List[Dict[str, Any]], llm: ChatVertexAI, knowledge_context: Optional[str] = None, tenant_id: Optional[str] = None, on_token: Optional[Callable[[str], None]] = None, resources: Optional[Dict[str, List[Dict[str, Any]]]] = None) -> tuple[str, str, List[Dict[str, Any]]]:
+        """Gera resposta usando Vertex AI diretamente (sem bloquear o event loop)
+
+        Com on_token, usa a API de streaming do LLM e repassa cada trecho
+        assim que chega; a resposta completa continua sendo retornada.
+        resources: exemplos/arquivos já buscados para a chave do cache de respostas.
 
         Returns:
             tuple: (validated_response, prompt_completo, training_examples_usados)
         """
         try:
-            prompt, training_examples = self._build_full_prompt(message, agent_data, conversation_history, knowledge_context)
+            # O prompt busca exemplos e arquivos no backend (HTTP síncrono): roda numa thread
+            # (to_thread copia o contexto, então os prints continuam no log do playground)
+            prompt, training_examples = await asyncio.to_thread(
+                self._build_full_prompt, message, agent_data, conversation_history, knowledge_context, resources
+            )
 
             from langchain_core.messages import HumanMessage
-            response = llm.invoke([HumanMessage(content=prompt)])
+            if on_token:
+                parts = []
+                try:
+                    async for chunk in self.llm_limiter.astream(llm, [HumanMessage(content=prompt)], tenant_id):
+                        if isinstance(chunk.content, str) and chunk.content:
+                            parts.append(chunk.content)
+                            on_token(chunk.content)
+                except Exception as e:
+                    # O cliente já recebeu parte da resposta: a resposta padrão não pode ser emendada nela
+                    if parts:
+                        raise StreamInterruptedError(f"Geração interrompida após {len(parts)} trechos: {e}") from e
+                    raise
+                response_content = "".join(parts)
+            else:
+                response = await self.llm_limiter.ainvoke(llm, [HumanMessage(content=prompt)], tenant_id)
+                response_content = response.content
 
             print("\n" + "="*60)
             print("📥 RESPOSTA RECEBIDA:")
             print("="*60)
-            print(response.content)
+            print(response_content)
             print("="*60 + "\n")
 
             # TEMPORARIAMENTE DESABILITADO - DEBUGANDO
             # Aplicar validacao generica (100% baseada na config da equipe)
-            # validated_response = self._validate_response_against_config(response.content, agent_data, llm, conversation_history)
+            # validated_response = await self._validate_response_against_config(response_content, agent_data, llm, conversation_history, tenant_id)
             # return validated_response, prompt, training_examples
 
             print("⚠️ VALIDAÇÃO TEMPORARIAMENTE DESABILITADA - DEBUGANDO")
-            return response.content, prompt, training_examples
+            return response_content, prompt, training_examples
 
+        except StreamInterruptedError:
+            raise
         except Exception as e:
             print(f"❌ Erro ao gerar resposta: {e}")
             import traceback
@@ -849,11 +973,11 @@ RESPONDA APENAS O NÚMERO (0, 1, 2, 3...), NADA MAIS."""
         print("🧪 RUN PLAYGROUND CREW - Executando equipe temporária")
         print("="*60)
 
-        # Capturar logs verbosos
+        # Capturar logs verbosos (só os desta requisição)
         import io
-        import sys
         log_capture = io.StringIO()
-        original_stdout = sys.stdout
+        if not isinstance(sys.stdout, _ContextStdout):
+            sys.stdout = _ContextStdout(sys.stdout)
 
         success = False
         response_text = ""
@@ -882,7 +1006,7 @@ RESPONDA APENAS O NÚMERO (0, 1, 2, 3...), NADA MAIS."""
                 raise ValueError("LLM não inicializado")
 
             # Criar LLM customizado
-            custom_llm = self._get_llm_for_team({
+            custom_llm = await self._get_llm_for_team({
                 'temperature': temperature,
                 'processType': process_type,
                 'managerLLM': team_definition.get('managerLLM')
@@ -899,7 +1023,7 @@ RESPONDA APENAS O NÚMERO (0, 1, 2, 3...), NADA MAIS."""
                         formatted_history.append({"role": "Você", "body": msg.get('content', '')})
 
             # Redirecionar stdout para log_capture ANTES de processar
-            sys.stdout = log_capture
+            _log_capture.set(log_capture)
 
             # DECISÃO: Hierarchical ou Sequential
             if process_type == 'hierarchical':
@@ -933,11 +1057,12 @@ RESPONDA APENAS O NÚMERO (0, 1, 2, 3...), NADA MAIS."""
                     print(f"📚 Buscando Knowledge Base ANTES da delegação...")
                     try:
                         team_id_for_kb = str(team_definition.get('id', 'playground'))
-                        kb_chunks = self.knowledge_service.search_knowledge(
+                        kb_chunks = await self.knowledge_service.search_knowledge_async(
                             team_id=team_id_for_kb,
                             document_ids=list(all_kb_ids),
                             query=task,
-                            top_k=20
+                            top_k=20,
+                            ranker=team_definition.get('knowledgeRanker')
                         )
 
                         if kb_chunks:
@@ -950,13 +1075,15 @@ RESPONDA APENAS O NÚMERO (0, 1, 2, 3...), NADA MAIS."""
                         print(f"⚠️ Erro ao buscar KB: {e}")
 
                 # Chamar delegação hierárquica manual COM knowledge_context
-                delegation_result = self._run_manual_hierarchical_delegation(
+                delegation_result = await self._run_manual_hierarchical_delegation(
                     message=task,
                     manager_agent_data=manager_agent_data,
                     specialist_agents_data=specialist_agents_data,
                     conversation_history=formatted_history,
                     llm=custom_llm,
-                    knowledge_context=knowledge_context
+                    knowledge_context=knowledge_context,
+                    tenant_id=str(company_id),
+                    team_id=str(team_definition['id']) if team_definition.get('id') is not None else None
                 )
 
                 response_text = delegation_result.get('response', '')
@@ -991,11 +1118,12 @@ RESPONDA APENAS O NÚMERO (0, 1, 2, 3...), NADA MAIS."""
                         try:
                             # Usar teamId da definição se existir
                             team_id_for_kb = str(team_definition.get('id', 'playground'))
-                            kb_chunks = self.knowledge_service.search_knowledge(
+                            kb_chunks = await self.knowledge_service.search_knowledge_async(
                                 team_id=team_id_for_kb,
                                 document_ids=kb_ids,
                                 query=task,
-                                top_k=20
+                                top_k=20,
+                                ranker=team_definition.get('knowledgeRanker')
                             )
 
                             if kb_chunks:
@@ -1016,17 +1144,18 @@ RESPONDA APENAS O NÚMERO (0, 1, 2, 3...), NADA MAIS."""
 
             # Só gerar resposta se NÃO for hierarchical (que já gerou)
             if process_type != 'hierarchical':
-                response_text, prompt_used, training_examples_used = self._create_simple_response(
+                response_text, prompt_used, training_examples_used = await self._create_simple_response(
                     task,
                     selected_agent_data,
                     formatted_history,  # Histórico de conversação para contexto
                     custom_llm,
-                    knowledge_context
+                    knowledge_context,
+                    str(company_id)
                 )
             elapsed_time = time.time() - start_time
 
             # Restaurar stdout
-            sys.stdout = original_stdout
+            _log_capture.set(None)
             execution_logs = log_capture.getvalue()
 
             success = True
@@ -1059,7 +1188,7 @@ RESPONDA APENAS O NÚMERO (0, 1, 2, 3...), NADA MAIS."""
 
         except Exception as e:
             # Restaurar stdout em caso de erro
-            sys.stdout = original_stdout
+            _log_capture.set(None)
             execution_logs = log_capture.getvalue()
 
             print(f"❌ Erro no playground: {e}")
@@ -1087,9 +1216,16 @@ RESPONDA APENAS O NÚMERO (0, 1, 2, 3...), NADA MAIS."""
         agent_override: Optional[str] = None,
         remote_jid: Optional[str] = None,
         contact_id: Optional[int] = None,
-        ticket_id: Optional[int] = None
+        ticket_id: Optional[int] = None,
+        on_event: Optional[EventCallback] = None
     ) -> Dict[str, Any]:
-        """Processa mensagem usando configurações avançadas da equipe"""
+        """
+        Processa mensagem usando configurações avançadas da equipe
+
+        on_event (streaming): recebe "agent" quando o agente é escolhido e
+        "token" para cada trecho da resposta do LLM; o resultado final é o
+        mesmo dict retornado sem streaming.
+        """
         
         print("\n" + "="*60)
         print("🎯 PROCESSANDO MENSAGEM - CrewAI Real Engine")
@@ -1107,6 +1243,8 @@ RESPONDA APENAS O NÚMERO (0, 1, 2, 3...), NADA MAIS."""
         error_message = None
         selected_agent_data = None
         prompt_used = ""
+        training_examples_used = []
+        cached = None
 
         try:
             if not self.llm:
@@ -1151,7 +1289,7 @@ RESPONDA APENAS O NÚMERO (0, 1, 2, 3...), NADA MAIS."""
                     print(f"      - knowledgeBaseIds: {agent.get('knowledgeBaseIds')}")
             print()
 
-            custom_llm = self._get_llm_for_team({
+            custom_llm = await self._get_llm_for_team({
                 'temperature': temperature,
                 'processType': process_type,
                 'managerLLM': team_data.get('managerLLM')
@@ -1210,11 +1348,12 @@ RESPONDA APENAS O NÚMERO (0, 1, 2, 3...), NADA MAIS."""
                     if all_kb_ids:
                         print(f"📚 Buscando Knowledge Base: {len(all_kb_ids)} documentos")
                         try:
-                            kb_chunks = self.knowledge_service.search_knowledge(
+                            kb_chunks = await self.knowledge_service.search_knowledge_async(
                                 team_id=str(crew_id),
                                 document_ids=all_kb_ids,
                                 query=message,
-                                top_k=20
+                                top_k=20,
+                                ranker=team_data.get('knowledgeRanker')
                             )
 
                             if kb_chunks:
@@ -1268,13 +1407,16 @@ RESPONDA APENAS O NÚMERO (0, 1, 2, 3...), NADA MAIS."""
                 print("🚀 Iniciando delegação hierárquica com CrewAI Tasks...")
                 start_time = time.time()
                 
-                delegation_result = self._run_manual_hierarchical_delegation(
+                delegation_result = await self._run_manual_hierarchical_delegation(
                     message=message,
                     manager_agent_data=manager_agent_data,
                     specialist_agents_data=specialist_agents_data,
                     conversation_history=formatted_history,
                     llm=custom_llm,
-                    knowledge_context=knowledge_context
+                    knowledge_context=knowledge_context,
+                    tenant_id=tenant_id,
+                    on_event=on_event,
+                    team_id=str(crew_id)
                 )
                 
                 elapsed_time = time.time() - start_time
@@ -1311,6 +1453,12 @@ RESPONDA APENAS O NÚMERO (0, 1, 2, 3...), NADA MAIS."""
                     }
 
                 print(f"✅ Usando agente: {selected_agent_data.get('name')}")
+                if on_event:
+                    on_event("agent", {
+                        "agent": selected_agent_data.get('name'),
+                        "agent_id": selected_agent_data.get('id'),
+                        "process_type": process_type
+                    })
 
                 # Buscar Knowledge Base se o agente usar
                 knowledge_context = None
@@ -1322,11 +1470,12 @@ RESPONDA APENAS O NÚMERO (0, 1, 2, 3...), NADA MAIS."""
                     if kb_ids:
                         print(f"📚 Buscando Knowledge Base: {len(kb_ids)} documentos")
                         try:
-                            kb_chunks = self.knowledge_service.search_knowledge(
+                            kb_chunks = await self.knowledge_service.search_knowledge_async(
                                 team_id=str(crew_id),
                                 document_ids=kb_ids,
                                 query=message,
-                                top_k=20
+                                top_k=20,
+                                ranker=team_data.get('knowledgeRanker')
                             )
 
                             if kb_chunks:
@@ -1367,16 +1516,53 @@ RESPONDA APENAS O NÚMERO (0, 1, 2, 3...), NADA MAIS."""
                                 "error": str(e)
                             }
 
-                print("🚀 Gerando resposta com Vertex AI...")
                 start_time = time.time()
 
-                response_text, prompt_used, training_examples_used = self._create_simple_response(
-                    message,
-                    selected_agent_data,
-                    conversation_history or [],
-                    custom_llm,
-                    knowledge_context
-                )
+                # Cache de respostas (perguntas repetidas: horário, endereço, preços)
+                cache_settings = self._get_response_cache_settings(team_data)
+                cache_key = None
+                resources = None
+                if cache_settings and self.response_cache.is_cacheable(message, conversation_history):
+                    # Exemplos e arquivos entram na chave; buscados uma vez e reaproveitados no prompt
+                    resources = await asyncio.to_thread(self._get_prompt_resources, selected_agent_data)
+                    cache_key = self.response_cache.context_key(
+                        selected_agent_data,
+                        {'temperature': temperature, 'managerLLM': team_data.get('managerLLM')},
+                        self.knowledge_service.team_version(str(crew_id)),
+                        knowledge_context,
+                        conversation_history,
+                        resources
+                    )
+                    cached = self.response_cache.get(str(crew_id), cache_key, message, cache_settings['similarity'])
+
+                if cached:
+                    print(f"⚡ Resposta do cache (similaridade {cached['similarity']}, {cached['ageSeconds']}s atrás)")
+                    response_text = cached['response']
+                    prompt_used = f"[Response Cache] similarity={cached['similarity']}, age={cached['ageSeconds']}s"
+                    training_examples_used = []
+                    if on_event:
+                        on_event("token", {"text": response_text})
+                else:
+                    print("🚀 Gerando resposta com Vertex AI...")
+                    response_text, prompt_used, training_examples_used = await self._create_simple_response(
+                        message,
+                        selected_agent_data,
+                        conversation_history or [],
+                        custom_llm,
+                        knowledge_context,
+                        tenant_id,
+                        on_token=self._token_callback(on_event),
+                        resources=resources
+                    )
+
+                    # Prompt vazio = resposta padrão de erro, que não deve ser reaproveitada
+                    if cache_key and prompt_used:
+                        self.response_cache.set(
+                            str(crew_id), cache_key, message, response_text,
+                            agent_name=selected_agent_data.get('name'),
+                            generation_seconds=time.time() - start_time,
+                            ttl_seconds=cache_settings['ttlSeconds']
+                        )
 
                 elapsed_time = time.time() - start_time
                 success = True
@@ -1419,13 +1605,14 @@ RESPONDA APENAS O NÚMERO (0, 1, 2, 3...), NADA MAIS."""
                 "errorMessage": None
             }
             
-            self._save_log_to_backend(log_data)
+            self._save_log_in_background(log_data)
 
             return {
                 "success": True,
                 "response": response_text,
                 "agent_used": selected_agent_data.get('name'),
                 "processing_time": round(elapsed_time, 2),
+                "cache_hit": bool(cached),
                 "config_used": {
                     "process_type": process_type,
                     "temperature": temperature,
@@ -1454,8 +1641,12 @@ RESPONDA APENAS O NÚMERO (0, 1, 2, 3...), NADA MAIS."""
                     "success": False,
                     "errorMessage": error_message
                 }
-                self._save_log_to_backend(log_data)
-            
+                self._save_log_in_background(log_data)
+
+            # Streaming com tokens já enviados: o endpoint encerra com evento "error"
+            if isinstance(e, StreamInterruptedError):
+                raise
+
             return {
                 "success": False,
                 "response": "Desculpe, ocorreu um erro ao processar sua mensagem. Por favor, tente novamente.",
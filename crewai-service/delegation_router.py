@@ -0,0 +1,273 @@
+# delegation_router.py - Roteamento local do modo hierárquico (LLM do manager só nos casos ambíguos)
+
+import os
+import json
+import hashlib
+import threading
+from collections import deque
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+from sklearn.feature_extraction.text import TfidfVectorizer
+
+from response_cache import tokenize_message
+from ttl_cache import TTLCache
+
+DELEGATION_ROUTER_ENABLED = os.getenv('DELEGATION_ROUTER_ENABLED', '1') == '1'
+# Similaridade mínima com o exemplo mais próximo e vantagem mínima sobre o segundo agente
+DELEGATION_ROUTER_MIN_SCORE = float(os.getenv('DELEGATION_ROUTER_MIN_SCORE', '0.35'))
+DELEGATION_ROUTER_MIN_MARGIN = float(os.getenv('DELEGATION_ROUTER_MIN_MARGIN', '0.15'))
+# Decisões do manager (LLM) guardadas como exemplo, por agente
+DELEGATION_ROUTER_MAX_EXAMPLES = int(os.getenv('DELEGATION_ROUTER_MAX_EXAMPLES', '50'))
+# Cache de decisões por mensagem normalizada
+DELEGATION_ROUTER_CACHE_SIZE = int(os.getenv('DELEGATION_ROUTER_CACHE_SIZE', '5000'))
+DELEGATION_ROUTER_CACHE_TTL = float(os.getenv('DELEGATION_ROUTER_CACHE_TTL', '3600'))
+
+# Palavras que aparecem em pedidos de qualquer assunto ("quero", "preciso") e não indicam o especialista
+_GENERIC_WORDS = {'quero', 'queria', 'preciso', 'precisava', 'saber', 'sobre', 'tem', 'tenho', 'fazer', 'faco', 'consigo'}
+
+# Conversa sem pedido ("oi, tudo bem?"): o manager responde (escolha 0), como no prompt de delegação
+_SMALL_TALK = {'tudo', 'bem', 'td', 'blz', 'beleza', 'bom', 'boa', 'dia', 'tarde', 'noite', 'alguem', 'ae', 'opa', 'eai', 'hello', 'hi'}
+
+# Prefixo usado como radical ("exame"/"exames", "agendar"/"agendamento")
+_STEM_LENGTH = 5
+
+
+def _router_tokens(text: str) -> List[str]:
+    return [token for token in tokenize_message(text) if token not in _GENERIC_WORDS]
+
+
+def _stems(text: str) -> List[str]:
+    return [token[:_STEM_LENGTH] for token in text.split() if len(token) > 1]
+
+
+def _objective(agent: Dict[str, Any]) -> str:
+    return agent.get('objective') or agent.get('objetivo') or ''
+
+
+def _agent_key(agent: Dict[str, Any]) -> str:
+    return str(agent.get('id') if agent.get('id') is not None else agent.get('name'))
+
+
+class DelegationModel:
+    """
+    Classificador de um conjunto de agentes: TF-IDF de radicais sobre os
+    exemplos de cada agente (função, objetivo, cada palavra-chave e
+    mensagens que o manager já delegou para ele)
+
+    O score de um agente é a similaridade com o exemplo mais próximo;
+    a decisão só é aceita com score e vantagem sobre o segundo suficientes.
+    Palavras fora do vocabulário não pontuam, então assuntos que nenhum
+    agente menciona dão score 0 e vão para o manager.
+    """
+
+    def __init__(self, classes: List[Tuple[int, List[str]]]):
+        texts, labels = [], []
+        for choice, examples in classes:
+            for example in examples:
+                normalized = ' '.join(_router_tokens(example))
+                if normalized:
+                    texts.append(normalized)
+                    labels.append(choice)
+
+        self.choices = sorted({choice for choice, _ in classes})
+        self._labels = np.array(labels)
+        self._vectorizer = None
+        self._matrix = None
+        if texts:
+            self._vectorizer = TfidfVectorizer(analyzer=_stems, sublinear_tf=True)
+            self._matrix = self._vectorizer.fit_transform(texts)
+
+    def scores(self, normalized_message: str) -> Dict[int, float]:
+        result = {choice: 0.0 for choice in self.choices}
+        if self._vectorizer is None or not normalized_message:
+            return result
+
+        query = self._vectorizer.transform([normalized_message])
+        if not query.nnz:
+            return result
+
+        similarities = (self._matrix @ query.T).toarray().ravel()
+        for choice in self.choices:
+            mask = self._labels == choice
+            if mask.any():
+                result[choice] = float(similarities[mask].max())
+        return result
+
+
+class DelegationRouter:
+    """
+    Decide localmente qual especialista responde no modo hierárquico
+
+    Ordem: cache de decisões da mensagem normalizada -> conversa sem pedido
+    (manager) -> modelo local da equipe. Sem confiança suficiente, retorna
+    None e o chamador pergunta ao manager (LLM); a resposta dele é
+    registrada com `record` e passa a ser exemplo do agente escolhido, então
+    as mensagens ambíguas frequentes deixam de precisar do LLM.
+
+    O modelo é refeito quando os agentes mudam (assinatura da configuração)
+    ou chegam exemplos novos; os exemplos ficam em memória, por equipe.
+    """
+
+    def __init__(
+        self,
+        min_score: float = DELEGATION_ROUTER_MIN_SCORE,
+        min_margin: float = DELEGATION_ROUTER_MIN_MARGIN,
+        max_examples: int = DELEGATION_ROUTER_MAX_EXAMPLES,
+        enabled: bool = DELEGATION_ROUTER_ENABLED
+    ):
+        self.min_score = min_score
+        self.min_margin = min_margin
+        self.max_examples = max_examples
+        self.enabled = enabled
+        self.decisions = TTLCache(max_entries=DELEGATION_ROUTER_CACHE_SIZE, ttl_seconds=DELEGATION_ROUTER_CACHE_TTL)
+
+        # team_id -> agente -> mensagens delegadas pelo manager
+        self._examples: Dict[str, Dict[str, deque]] = {}
+        self._examples_version: Dict[str, int] = {}
+        # team_id -> (assinatura, versão dos exemplos, modelo)
+        self._models: Dict[str, Tuple[str, int, DelegationModel]] = {}
+        self._lock = threading.Lock()
+
+        self.local_decisions = 0
+        self.small_talk_decisions = 0
+        self.llm_fallbacks = 0
+        self.recorded = 0
+
+    def signature(self, manager_agent_data: Dict[str, Any], specialists: List[Dict[str, Any]]) -> str:
+        """Hash do que o roteamento usa da configuração (muda = decisões e modelo antigos não valem)"""
+        profile = [
+            [_agent_key(agent), agent.get('function'), _objective(agent), agent.get('keywords', [])]
+            for agent in [manager_agent_data] + list(specialists)
+        ]
+        return hashlib.sha1(json.dumps(profile, sort_keys=True, ensure_ascii=False, default=str).encode('utf-8')).hexdigest()
+
+    def _model(self, team_id: str, signature: str, manager_agent_data: Dict[str, Any], specialists: List[Dict[str, Any]]) -> DelegationModel:
+        with self._lock:
+            version = self._examples_version.get(team_id, 0)
+            cached = self._models.get(team_id)
+            if cached and cached[0] == signature and cached[1] == version:
+                return cached[2]
+            learned = {key: list(examples) for key, examples in self._examples.get(team_id, {}).items()}
+
+        classes = [(0, learned.get(_agent_key(manager_agent_data), []))]
+        for choice, agent in enumerate(specialists, 1):
+            profile = [agent.get('function') or '', _objective(agent)] + list(agent.get('keywords') or [])
+            classes.append((choice, profile + learned.get(_agent_key(agent), [])))
+        model = DelegationModel(classes)
+
+        with self._lock:
+            self._models[team_id] = (signature, version, model)
+        return model
+
+    def route(
+        self,
+        team_id: Optional[str],
+        message: str,
+        manager_agent_data: Dict[str, Any],
+        specialists: List[Dict[str, Any]]
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Escolha do agente sem chamar o LLM
+
+        Returns:
+            {'choice': 0 (manager) | 1..n (especialista), 'method', 'score', 'margin'}
+            ou None quando a mensagem é ambígua ou a equipe não tem id (perguntar ao manager)
+        """
+        if not self.enabled or not specialists or team_id is None:
+            return None
+
+        team_id = str(team_id)
+        signature = self.signature(manager_agent_data, specialists)
+        normalized = ' '.join(_router_tokens(message))
+
+        cached = self.decisions.get((team_id, signature, normalized))
+        if cached is not None:
+            return {**cached, 'method': 'cache'}
+
+        # Mensagem que some na normalização ("quero saber", "?", emoji) não é conversa: vai para o manager (LLM)
+        if normalized and all(token in _SMALL_TALK for token in normalized.split()):
+            self.small_talk_decisions += 1
+            decision = {'choice': 0, 'method': 'small_talk', 'score': 1.0, 'margin': 1.0}
+            self.decisions.set((team_id, signature, normalized), decision)
+            return decision
+
+        scores = self._model(team_id, signature, manager_agent_data, specialists).scores(normalized)
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+        best_choice, best_score = ranked[0]
+        margin = best_score - (ranked[1][1] if len(ranked) > 1 else 0.0)
+
+        if best_score < self.min_score or margin < self.min_margin:
+            self.llm_fallbacks += 1
+            return None
+
+        self.local_decisions += 1
+        decision = {'choice': best_choice, 'method': 'local_router', 'score': round(best_score, 3), 'margin': round(margin, 3)}
+        self.decisions.set((team_id, signature, normalized), decision)
+        return decision
+
+    def record(
+        self,
+        team_id: Optional[str],
+        message: str,
+        manager_agent_data: Dict[str, Any],
+        specialists: List[Dict[str, Any]],
+        choice: int
+    ):
+        """Decisão do manager (LLM): vai para o cache e vira exemplo do agente escolhido"""
+        if not self.enabled or team_id is None or not 0 <= choice <= len(specialists):
+            return
+
+        team_id = str(team_id)
+        normalized = ' '.join(_router_tokens(message))
+        if not normalized:
+            return
+        signature = self.signature(manager_agent_data, specialists)
+        self.decisions.set((team_id, signature, normalized), {'choice': choice, 'method': 'manager_llm', 'score': None, 'margin': None})
+
+        agent = manager_agent_data if choice == 0 else specialists[choice - 1]
+        with self._lock:
+            examples = self._examples.setdefault(team_id, {}).setdefault(_agent_key(agent), deque(maxlen=self.max_examples))
+            if normalized not in examples:
+                examples.append(normalized)
+                self._examples_version[team_id] = self._examples_version.get(team_id, 0) + 1
+            self.recorded += 1
+
+    def invalidate_team(self, team_id: str):
+        """Esquece exemplos, modelo e decisões da equipe"""
+        team_id = str(team_id)
+        with self._lock:
+            self._examples.pop(team_id, None)
+            self._examples_version[team_id] = self._examples_version.get(team_id, 0) + 1
+            self._models.pop(team_id, None)
+        self.decisions.invalidate(lambda key: key[0] == team_id)
+
+    def stats(self) -> Dict[str, Any]:
+        routed = self.local_decisions + self.small_talk_decisions + self.decisions.hits
+        total = routed + self.llm_fallbacks
+        with self._lock:
+            examples = {team_id: sum(len(items) for items in agents.values()) for team_id, agents in self._examples.items()}
+        return {
+            'enabled': self.enabled,
+            'minScore': self.min_score,
+            'minMargin': self.min_margin,
+            'localDecisions': self.local_decisions,
+            'smallTalkDecisions': self.small_talk_decisions,
+            'cacheHits': self.decisions.hits,
+            'llmFallbacks': self.llm_fallbacks,
+            'localRate': round(routed / total, 3) if total else 0.0,
+            'recordedDecisions': self.recorded,
+            'learnedExamples': examples,
+            'decisionCache': self.decisions.stats(),
+        }
+
+
+# Instância global (singleton)
+_delegation_router = None
+
+def get_delegation_router() -> DelegationRouter:
+    """Retorna instância singleton do roteador local de delegação"""
+    global _delegation_router
+    if _delegation_router is None:
+        _delegation_router = DelegationRouter()
+    return _delegation_router
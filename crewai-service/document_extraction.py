@@ -0,0 +1,384 @@
+# document_extraction.py - Extração de texto em processos separados (PDF por páginas, XLSX por sheet)
+
+import io
+import os
+import sys
+import time
+import datetime
+import threading
+import multiprocessing
+from contextlib import contextmanager
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FuturesTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from typing import List, Optional, Tuple, Callable, Any, Iterator, Dict, Union
+
+try:
+    import resource  # Limite de CPU por processo (somente POSIX)
+except ImportError:
+    resource = None
+
+# Páginas de PDF por tarefa (cada fatia é parseada num processo)
+PDF_PAGES_PER_TASK = int(os.getenv('KNOWLEDGE_PDF_PAGES_PER_TASK', '20'))
+
+# Segundos de CPU que uma tarefa pode gastar antes do worker ser morto (SIGXCPU)
+EXTRACT_CPU_LIMIT = int(os.getenv('KNOWLEDGE_EXTRACT_CPU_LIMIT', '60'))
+
+# Tempo máximo esperando os workers de um arquivo (o processamento feito pelo chamador entre os resultados não conta)
+EXTRACT_TIMEOUT = float(os.getenv('KNOWLEDGE_EXTRACT_TIMEOUT', '300'))
+
+# Linhas de planilha por chunk (o cabeçalho é repetido em cada um) e teto de caracteres do grupo
+XLSX_ROWS_PER_CHUNK = int(os.getenv('KNOWLEDGE_XLSX_ROWS_PER_CHUNK', '50'))
+XLSX_CHUNK_CHARS = int(os.getenv('KNOWLEDGE_XLSX_CHUNK_CHARS', '4000'))
+
+
+class ExtractionError(Exception):
+    """Arquivo não pôde ser extraído (timeout, limite de CPU, worker morto)"""
+
+
+# Arquivo a extrair: bytes em memória ou caminho de um arquivo em disco (upload spooled).
+# Com o caminho, cada worker abre o arquivo por conta própria em vez de receber uma cópia dos bytes.
+Source = Union[bytes, str]
+
+
+# --- Funções executadas nos workers (sem print: o stdout é do processo pai) ---
+
+def _open_source(source: Source):
+    """Caminho ou BytesIO, aceitos por PyPDF2, python-docx e openpyxl"""
+    return io.BytesIO(source) if isinstance(source, (bytes, bytearray)) else source
+
+
+def _run_limited(cpu_limit: int, fn: Callable, *args) -> Any:
+    """Executa fn com limite de CPU; estourar o limite mata só este worker"""
+    if resource is None:
+        return fn(*args)
+
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    _, hard = resource.getrlimit(resource.RLIMIT_CPU)
+    soft = int(usage.ru_utime + usage.ru_stime) + cpu_limit
+    if hard != resource.RLIM_INFINITY:
+        soft = min(soft, hard)
+
+    resource.setrlimit(resource.RLIMIT_CPU, (soft, hard))
+    try:
+        return fn(*args)
+    finally:
+        resource.setrlimit(resource.RLIMIT_CPU, (hard, hard))
+
+
+def read_pdf_page_count(source: Source) -> int:
+    import PyPDF2
+    return len(PyPDF2.PdfReader(_open_source(source)).pages)
+
+
+def read_pdf_pages(source: Source, start: int, end: int) -> List[str]:
+    """Texto das páginas [start, end)"""
+    import PyPDF2
+    pages = PyPDF2.PdfReader(_open_source(source)).pages
+    return [pages[i].extract_text() for i in range(start, end)]
+
+
+def read_docx(source: Source) -> str:
+    import docx
+    document = docx.Document(_open_source(source))
+    return "\n".join([paragraph.text for paragraph in document.paragraphs])
+
+
+def read_xlsx_sheet_names(source: Source) -> List[str]:
+    import openpyxl
+    workbook = openpyxl.load_workbook(_open_source(source), read_only=True)
+    try:
+        return workbook.sheetnames
+    finally:
+        workbook.close()
+
+
+def _format_cell(value: Any) -> str:
+    if value is None:
+        return ''
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    if isinstance(value, datetime.datetime) and value.time() == datetime.time():
+        return value.date().isoformat()
+    if isinstance(value, (datetime.date, datetime.time)):
+        return value.isoformat()
+    return " ".join(str(value).split())
+
+
+def read_xlsx_row_groups(
+    source: Source,
+    sheet_name: str,
+    rows_per_group: int,
+    max_chars: int
+) -> Optional[Tuple[str, List[Tuple[int, int, str]], int, int]]:
+    """
+    Linhas da sheet em grupos, lidas em streaming (openpyxl read-only)
+
+    A primeira linha não vazia é o cabeçalho. Um grupo fecha com
+    `rows_per_group` linhas ou ao passar de `max_chars` caracteres.
+
+    Returns:
+        (cabeçalho, [(primeira linha, última linha, texto das linhas)],
+        linhas, colunas), ou None se a sheet não tiver dados
+    """
+    import openpyxl
+    workbook = openpyxl.load_workbook(_open_source(source), read_only=True, data_only=True)
+    try:
+        header = None
+        columns = 0
+        rows = 0
+        groups = []
+        group_rows: List[str] = []
+        group_chars = 0
+        first_row = 0
+
+        # min_row=1: o número da linha é o mesmo que aparece no Excel
+        for row_number, values in enumerate(workbook[sheet_name].iter_rows(min_row=1, values_only=True), start=1):
+            cells = [_format_cell(value) for value in values]
+            while cells and not cells[-1]:
+                cells.pop()
+            if not cells:
+                continue
+
+            if header is None:
+                header = " | ".join(cells)
+                columns = len(cells)
+                continue
+
+            line = " | ".join(cells)
+            if not group_rows:
+                first_row = row_number
+            group_rows.append(line)
+            group_chars += len(line) + 1
+            last_row = row_number
+            rows += 1
+
+            if len(group_rows) >= rows_per_group or group_chars >= max_chars:
+                groups.append((first_row, last_row, "\n".join(group_rows)))
+                group_rows = []
+                group_chars = 0
+
+        if group_rows:
+            groups.append((first_row, last_row, "\n".join(group_rows)))
+    finally:
+        workbook.close()
+
+    if not groups:
+        return None
+    return header, groups, rows, columns
+
+
+def format_row_group(group: Dict[str, Any]) -> str:
+    """Conteúdo do chunk de um grupo de linhas: sheet, intervalo, cabeçalho e linhas"""
+    return (
+        f"PLANILHA: {group['sheet']} (linhas {group['rowStart']}-{group['rowEnd']})\n"
+        f"{group['header']}\n{group['rows']}"
+    )
+
+
+# --- Processo principal ---
+
+class _ExtractionJob:
+    """
+    Pool de processos e orçamento de tempo de um arquivo
+
+    O orçamento (EXTRACT_TIMEOUT) é consumido só enquanto o chamador espera
+    por um worker: o tempo que o consumidor do gerador gasta entre um
+    resultado e outro (chunking, escrita no Firestore) não conta.
+    """
+
+    def __init__(self, extractor: 'DocumentExtractor'):
+        self.extractor = extractor
+        self.remaining = extractor.timeout
+        self.pool = ProcessPoolExecutor(max_workers=extractor.processes, mp_context=extractor._mp_context)
+
+    def submit(self, fn: Callable, args: tuple):
+        try:
+            return self.pool.submit(_run_limited, self.extractor.cpu_limit, fn, *args)
+        except BrokenProcessPool:
+            raise ExtractionError("pool de extração indisponível")
+
+    def wait(self, future) -> Any:
+        started = time.monotonic()
+        try:
+            return future.result(timeout=max(0.0, self.remaining))
+        except FuturesTimeoutError:
+            raise ExtractionError(f"tempo limite de {self.extractor.timeout:g}s excedido")
+        except BrokenProcessPool:
+            raise ExtractionError(f"limite de CPU ({self.extractor.cpu_limit}s) excedido ou worker encerrado")
+        finally:
+            self.remaining -= time.monotonic() - started
+
+    def close(self, terminate: bool = False):
+        # Workers travados não terminam sozinhos com shutdown(wait=False)
+        if terminate:
+            for process in list((getattr(self.pool, '_processes', None) or {}).values()):
+                process.terminate()
+        self.pool.shutdown(wait=False, cancel_futures=True)
+
+
+class DocumentExtractor:
+    """
+    Extrai texto de PDF/DOCX/XLSX em processos separados (fora do GIL do servidor)
+
+    - PDF: dividido em fatias de PDF_PAGES_PER_TASK páginas parseadas em
+      paralelo e remontadas na ordem original
+    - XLSX: uma tarefa por sheet, lida em streaming (openpyxl read-only)
+      em grupos de XLSX_ROWS_PER_CHUNK linhas, na ordem do arquivo
+    - Cada arquivo tem o seu pool de `processes` workers. Cada tarefa roda
+      com limite de CPU (EXTRACT_CPU_LIMIT) e o arquivo inteiro com limite de
+      tempo de extração (EXTRACT_TIMEOUT). Um documento malformado que estoure
+      o limite derruba só os workers do próprio arquivo; uploads extraídos ao
+      mesmo tempo não são afetados.
+
+    Os workers são criados com forkserver: fork a partir do processo do
+    servidor (com threads do gRPC/Firestore) pode travar, e spawn
+    reimportaria o main.py em cada worker. O forkserver só pré-carrega este
+    módulo e as bibliotecas de parsing; o servidor roda como `uvicorn
+    main:app` (também via `python main.py`), então os workers não
+    reexecutam o main.py.
+    """
+
+    def __init__(
+        self,
+        processes: Optional[int] = None,
+        pages_per_task: int = PDF_PAGES_PER_TASK,
+        cpu_limit: int = EXTRACT_CPU_LIMIT,
+        timeout: float = EXTRACT_TIMEOUT,
+        rows_per_chunk: int = XLSX_ROWS_PER_CHUNK,
+        chunk_chars: int = XLSX_CHUNK_CHARS
+    ):
+        self.processes = processes or int(os.getenv('KNOWLEDGE_EXTRACT_PROCESSES', str(max(1, (os.cpu_count() or 2) // 2))))
+        self.pages_per_task = max(1, pages_per_task)
+        self.cpu_limit = cpu_limit
+        self.timeout = timeout
+        self.rows_per_chunk = max(1, rows_per_chunk)
+        self.chunk_chars = max(1, chunk_chars)
+
+        start_method = os.getenv('KNOWLEDGE_EXTRACT_START_METHOD', 'forkserver' if sys.platform != 'win32' else 'spawn')
+        self._mp_context = multiprocessing.get_context(start_method)
+        if start_method == 'forkserver':
+            self._mp_context.set_forkserver_preload([__name__, 'PyPDF2', 'docx', 'openpyxl'])
+        self._jobs = set()
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def _job(self) -> Iterator[_ExtractionJob]:
+        """Pool dedicado a um arquivo; em caso de erro, os workers dele são encerrados"""
+        job = _ExtractionJob(self)
+        with self._lock:
+            self._jobs.add(job)
+        failed = False
+        try:
+            yield job
+        except BaseException:
+            failed = True
+            raise
+        finally:
+            with self._lock:
+                self._jobs.discard(job)
+            job.close(terminate=failed)
+
+    def _imap(self, job: _ExtractionJob, fn: Callable, args_list: List[tuple], window: Optional[int] = None) -> Iterator[Any]:
+        """
+        Executa fn(*args) no pool do arquivo e entrega os resultados na ordem
+
+        No máximo `window` tarefas ficam em voo (e com resultado em memória)
+        ao mesmo tempo; a próxima só é submetida quando a mais antiga é entregue.
+        """
+        window = window or self.processes
+        pending = deque()
+        next_args = iter(args_list)
+
+        try:
+            for args in next_args:
+                pending.append(job.submit(fn, args))
+                if len(pending) >= window:
+                    break
+
+            while pending:
+                result = job.wait(pending.popleft())
+
+                args = next(next_args, None)
+                if args is not None:
+                    pending.append(job.submit(fn, args))
+                yield result
+        finally:
+            for future in pending:
+                future.cancel()
+
+    def _map(self, job: _ExtractionJob, fn: Callable, args_list: List[tuple]) -> List[Any]:
+        """Executa todas as tarefas em paralelo, preservando a ordem"""
+        return list(self._imap(job, fn, args_list, window=len(args_list)))
+
+    def iter_pdf_pages(self, source: Source) -> Iterator[str]:
+        """Texto de cada página (com "\n" no final), na ordem, em streaming"""
+        with self._job() as job:
+            total_pages = self._map(job, read_pdf_page_count, [(source,)])[0]
+
+            ranges = [
+                (source, start, min(start + self.pages_per_task, total_pages))
+                for start in range(0, total_pages, self.pages_per_task)
+            ]
+            for pages in self._imap(job, read_pdf_pages, ranges):
+                for page_text in pages:
+                    yield page_text + "\n"
+
+        if len(ranges) > 1:
+            print(f"📑 PDF com {total_pages} páginas extraído em {len(ranges)} fatias paralelas")
+
+    def extract_pdf(self, source: Source) -> str:
+        return "".join(self.iter_pdf_pages(source))
+
+    def extract_docx(self, source: Source) -> str:
+        with self._job() as job:
+            return self._map(job, read_docx, [(source,)])[0]
+
+    def iter_xlsx_row_groups(self, source: Source) -> Iterator[Dict[str, Any]]:
+        """
+        Grupos de linhas das sheets, na ordem, em streaming
+
+        Cada grupo: sheet, header, rowStart/rowEnd (linhas do Excel) e rows
+        (texto das linhas, células separadas por " | ").
+        """
+        with self._job() as job:
+            sheet_names = self._map(job, read_xlsx_sheet_names, [(source,)])[0]
+
+            print(f"📊 XLSX contém {len(sheet_names)} sheet(s): {sheet_names}")
+
+            sheets = self._imap(
+                job,
+                read_xlsx_row_groups,
+                [(source, name, self.rows_per_chunk, self.chunk_chars) for name in sheet_names]
+            )
+            for sheet_name, sheet in zip(sheet_names, sheets):
+                # Pular sheets vazias
+                if sheet is None:
+                    print(f"⚠️ Sheet '{sheet_name}' está vazia, pulando...")
+                    continue
+
+                header, groups, rows, columns = sheet
+                for first_row, last_row, rows_text in groups:
+                    yield {'sheet': sheet_name, 'header': header, 'rowStart': first_row, 'rowEnd': last_row, 'rows': rows_text}
+
+                print(f"✅ Sheet '{sheet_name}': {rows} linhas, {columns} colunas, {len(groups)} grupo(s)")
+
+    def iter_xlsx(self, source: Source) -> Iterator[str]:
+        """Texto das sheets (título, cabeçalho e linhas), na ordem, em streaming"""
+        current_sheet = None
+        for group in self.iter_xlsx_row_groups(source):
+            if group['sheet'] != current_sheet:
+                current_sheet = group['sheet']
+                yield f"\n{'='*60}\nPLANILHA: {current_sheet}\n{'='*60}\n\n{group['header']}\n"
+            yield group['rows'] + "\n"
+
+    def extract_xlsx(self, source: Source) -> str:
+        return "".join(self.iter_xlsx(source))
+
+    def shutdown(self):
+        """Encerra os pools dos arquivos em extração (desligamento do serviço)"""
+        with self._lock:
+            jobs, self._jobs = list(self._jobs), set()
+        for job in jobs:
+            job.close(terminate=True)
+
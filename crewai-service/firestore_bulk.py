@@ -0,0 +1,198 @@
+# firestore_bulk.py - Escritas em massa no Firestore (lotes paralelos com retry)
+
+import os
+import time
+import random
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, Future
+from typing import Any, Dict, List, Optional, Tuple
+from google.api_core import exceptions as google_exceptions
+
+# Operações por batch (o Firestore aceita no máximo 500)
+BULK_BATCH_SIZE = min(500, int(os.getenv('KNOWLEDGE_WRITE_BATCH_SIZE', '400')))
+
+# Tentativas por batch e espera inicial do backoff exponencial (segundos)
+BULK_MAX_ATTEMPTS = int(os.getenv('KNOWLEDGE_WRITE_MAX_ATTEMPTS', '5'))
+BULK_BACKOFF = float(os.getenv('KNOWLEDGE_WRITE_BACKOFF', '0.5'))
+
+# Erros transitórios: o commit do batch é repetido (sets/deletes são idempotentes)
+RETRYABLE_ERRORS = (
+    google_exceptions.Aborted,
+    google_exceptions.DeadlineExceeded,
+    google_exceptions.InternalServerError,
+    google_exceptions.ResourceExhausted,
+    google_exceptions.ServiceUnavailable,
+    google_exceptions.TooManyRequests,
+)
+
+
+class BulkWriteStats:
+    """Totais de escrita de todos os bulk writers do serviço"""
+
+    def __init__(self):
+        self.operations = 0
+        self.batches = 0
+        self.retries = 0
+        self.failures = 0
+        self.seconds = 0.0
+        self._lock = threading.Lock()
+
+    def add(self, operations: int, batches: int, retries: int, failures: int, seconds: float):
+        with self._lock:
+            self.operations += operations
+            self.batches += batches
+            self.retries += retries
+            self.failures += failures
+            self.seconds += seconds
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'operations': self.operations,
+                'batches': self.batches,
+                'retries': self.retries,
+                'failures': self.failures,
+                'opsPerSecond': round(self.operations / self.seconds, 1) if self.seconds else 0.0,
+            }
+
+
+class FirestoreBulkWriter:
+    """
+    Acumula set/update/delete e grava em batches de até BULK_BATCH_SIZE
+
+    Os batches são commitados em paralelo no executor compartilhado, com
+    no máximo `max_in_flight` deste writer em voo (quem enfileira espera),
+    e repetidos com backoff exponencial em erros transitórios. O primeiro
+    erro definitivo é relançado na próxima operação ou no flush().
+
+    Não há ordem entre batches: operações que dependem de outras (ex.:
+    promover duplicados antes de apagar o canônico) precisam de um
+    flush() entre elas.
+    """
+
+    def __init__(
+        self,
+        db,
+        executor: ThreadPoolExecutor,
+        stats: Optional[BulkWriteStats] = None,
+        batch_size: int = BULK_BATCH_SIZE,
+        max_in_flight: int = 8,
+        max_attempts: int = BULK_MAX_ATTEMPTS,
+        backoff: float = BULK_BACKOFF,
+        label: str = 'escrita'
+    ):
+        self.db = db
+        self.batch_size = max(1, min(500, batch_size))
+        self.max_in_flight = max(1, max_in_flight)
+        self.max_attempts = max(1, max_attempts)
+        self.backoff = backoff
+        self.label = label
+        self._executor = executor
+        self._stats = stats
+
+        self._operations: List[Tuple[str, Any, Optional[Dict[str, Any]]]] = []
+        self._in_flight: deque = deque()
+        self._error: Optional[BaseException] = None
+
+        self.operations = 0
+        self.batches = 0
+        self.retries = 0
+        self._started: Optional[float] = None  # primeira operação
+
+    def set(self, reference, data: Dict[str, Any]):
+        self._add('set', reference, data)
+
+    def update(self, reference, data: Dict[str, Any]):
+        self._add('update', reference, data)
+
+    def delete(self, reference):
+        self._add('delete', reference, None)
+
+    def _add(self, kind: str, reference, data: Optional[Dict[str, Any]]):
+        self._raise_error()
+        if self._started is None:
+            self._started = time.monotonic()
+        self._operations.append((kind, reference, data))
+        if len(self._operations) >= self.batch_size:
+            self._submit()
+
+    def _submit(self):
+        operations, self._operations = self._operations, []
+        if not operations:
+            return
+
+        # Limita os batches em voo (e a memória) deste writer
+        while len(self._in_flight) >= self.max_in_flight:
+            self._wait(self._in_flight.popleft())
+
+        self._in_flight.append(self._executor.submit(self._commit, operations))
+        self.operations += len(operations)
+        self.batches += 1
+
+    def _commit(self, operations: List[Tuple[str, Any, Optional[Dict[str, Any]]]]) -> int:
+        """Commita um batch (roda no executor). Retorna quantas tentativas extras foram feitas"""
+        for attempt in range(1, self.max_attempts + 1):
+            batch = self.db.batch()
+            for kind, reference, data in operations:
+                if kind == 'set':
+                    batch.set(reference, data)
+                elif kind == 'update':
+                    batch.update(reference, data)
+                else:
+                    batch.delete(reference)
+            try:
+                batch.commit()
+                return attempt - 1
+            except RETRYABLE_ERRORS as e:
+                if attempt == self.max_attempts:
+                    raise
+                delay = self.backoff * (2 ** (attempt - 1)) * (1 + random.random())
+                print(f"⚠️ Batch de {len(operations)} operações falhou ({type(e).__name__}), nova tentativa em {delay:.1f}s")
+                time.sleep(delay)
+
+    def _wait(self, future: Future):
+        try:
+            self.retries += future.result()
+        except Exception as e:
+            if self._error is None:
+                self._error = e
+
+    def _raise_error(self):
+        if self._error is not None:
+            raise self._error
+
+    def flush(self):
+        """Grava o que está pendente e espera todos os batches terminarem"""
+        self._submit()
+        while self._in_flight:
+            self._wait(self._in_flight.popleft())
+        self._raise_error()
+
+    def close(self) -> Dict[str, Any]:
+        """flush() + contabiliza e loga a vazão deste writer"""
+        try:
+            self.flush()
+        finally:
+            stats = self.stats()
+            if self._stats is not None:
+                self._stats.add(
+                    self.operations, self.batches, self.retries,
+                    1 if self._error is not None else 0, stats['seconds']
+                )
+            if self.operations:
+                print(
+                    f"📝 {self.label}: {self.operations} operações em {self.batches} batch(es), "
+                    f"{stats['seconds']:.2f}s ({stats['opsPerSecond']} ops/s, {self.retries} retries)"
+                )
+        return stats
+
+    def stats(self) -> Dict[str, Any]:
+        seconds = time.monotonic() - self._started if self._started is not None else 0.0
+        return {
+            'operations': self.operations,
+            'batches': self.batches,
+            'retries': self.retries,
+            'seconds': round(seconds, 3),
+            'opsPerSecond': round(self.operations / seconds, 1) if seconds else 0.0,
+        }
@@ -0,0 +1,313 @@
+# ingestion_jobs.py - Fila de ingestão de documentos da Knowledge Base
+
+import asyncio
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import Executor, ThreadPoolExecutor, Future
+from typing import Callable, Dict, Any, Optional, List
+from upload_spool import SpooledUpload
+
+# Etapas na ordem em que acontecem (progress = posição / total).
+# Extração, chunking e dedup são feitos em streaming, juntos em 'extracting'
+# ('saving' a partir do primeiro lote gravado).
+STAGES = ['queued', 'extracting', 'saving', 'indexing', 'done']
+
+
+class IngestionQueueFull(Exception):
+    """Fila de ingestão cheia (muitos uploads pendentes)"""
+
+
+class IngestionJob:
+    """Estado de uma ingestão: etapa, progresso, contagens e erro"""
+
+    def __init__(
+        self,
+        team_id: str,
+        filename: str,
+        document_id: str,
+        file_size: int,
+        content_hash: Optional[str] = None,
+        mode: str = 'create',
+        chunker: Optional[str] = None,
+        update_index: bool = True
+    ):
+        self.job_id = uuid.uuid4().hex
+        self.team_id = str(team_id)
+        self.filename = filename
+        self.document_id = document_id
+        self.file_size = file_size
+        self.content_hash = content_hash
+        self.mode = mode  # create | replace (nova versão de um documento existente)
+        self.chunker = chunker
+        self.update_index = update_index  # False: índices atualizados pelo lote (upload em massa)
+
+        self.status = 'queued'  # queued | running | done | failed
+        self.stage = 'queued'
+        self.progress = 0.0
+        self.chunks_count: Optional[int] = None
+        self.word_count: Optional[int] = None
+        self.duplicate_chunks: Optional[int] = None
+        self.error: Optional[str] = None
+        self.result: Optional[Dict[str, Any]] = None
+
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        # Criado junto com o job: quem recebe um job ainda pendente (upload
+        # repetido) já pode esperar por ele antes de o worker começar
+        self.future: Future = Future()
+        self._lock = threading.Lock()
+
+    def set_stage(self, stage: str, **counts):
+        """Avança a etapa (chamado pelo worker)"""
+        with self._lock:
+            self.stage = stage
+            self.progress = STAGES.index(stage) / (len(STAGES) - 1)
+            for name, value in counts.items():
+                setattr(self, name, value)
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            finished_or_now = self.finished_at or time.time()
+            return {
+                'job_id': self.job_id,
+                'team_id': self.team_id,
+                'document_id': self.document_id,
+                'filename': self.filename,
+                'file_size': self.file_size,
+                'content_hash': self.content_hash,
+                'mode': self.mode,
+                'chunker': self.chunker,
+                'status': self.status,
+                'stage': self.stage,
+                'progress': round(self.progress, 2),
+                'chunks_count': self.chunks_count,
+                'word_count': self.word_count,
+                'duplicate_chunks': self.duplicate_chunks,
+                'error': self.error,
+                'created_at': self.created_at,
+                'started_at': self.started_at,
+                'finished_at': self.finished_at,
+                'elapsed_seconds': round(finished_or_now - (self.started_at or finished_or_now), 3),
+            }
+
+    async def wait(self) -> Dict[str, Any]:
+        """Aguarda o fim do job sem bloquear o event loop"""
+        return await asyncio.wrap_future(self.future)
+
+
+class IngestionBatch:
+    """
+    Arquivos de um upload em massa: um job por arquivo
+
+    Quando o último job termina, on_complete(batch) roda uma única vez no
+    pool de ingestão (nunca na thread de quem criou o lote, mesmo que todos
+    os jobs já estejam resolvidos) e então o lote é resolvido.
+    Arquivos recusados antes de virar job (tipo, tamanho, fila cheia) ficam
+    no lote só com o erro.
+    """
+
+    def __init__(self, team_id: str, items: List[Dict[str, Any]], on_complete: Callable[['IngestionBatch'], None]):
+        self.batch_id = uuid.uuid4().hex
+        self.team_id = str(team_id)
+        self.items = items  # [{'filename', 'job' (ou None), 'error' (ou None)}]
+        self.created_at = time.time()
+        self.finished_at: Optional[float] = None
+        self.future: Future = Future()
+        self._on_complete = on_complete
+        self._lock = threading.Lock()
+        self._executor: Optional[Executor] = None
+        self._remaining = 0
+
+    def start(self, executor: Executor):
+        """Passa a acompanhar os jobs; on_complete roda no executor"""
+        self._executor = executor
+        # O mesmo job pode aparecer duas vezes (arquivo repetido no lote)
+        futures = {id(job.future): job.future for job in self.jobs()}
+        self._remaining = len(futures)
+        if not futures:
+            executor.submit(self._finish)
+        # Jobs já resolvidos (upload repetido) chamam o callback na hora, nesta thread
+        for future in futures.values():
+            future.add_done_callback(self._job_done)
+
+    def jobs(self) -> List[IngestionJob]:
+        return [item['job'] for item in self.items if item['job'] is not None]
+
+    def _job_done(self, _future: Future):
+        with self._lock:
+            self._remaining -= 1
+            last = self._remaining == 0
+        if last:
+            self._executor.submit(self._finish)
+
+    def _finish(self):
+        try:
+            self._on_complete(self)
+        except Exception as e:
+            print(f"❌ Erro ao finalizar lote {self.batch_id}: {e}")
+            import traceback
+            traceback.print_exc()
+        finally:
+            self.finished_at = time.time()
+            self.future.set_result(self)
+
+    @property
+    def status(self) -> str:
+        return 'done' if self.finished_at else 'running'
+
+    def to_dict(self) -> Dict[str, Any]:
+        files = []
+        for item in self.items:
+            job = item['job']
+            if job is None:
+                files.append({'filename': item['filename'], 'status': 'failed', 'error': item['error']})
+            else:
+                # Arquivo repetido no lote aponta para o job do primeiro, mas mantém o próprio nome
+                files.append({
+                    **job.to_dict(),
+                    'filename': item['filename'],
+                    'already_exists': bool(job.result and job.result.get('alreadyExists'))
+                })
+        finished_or_now = self.finished_at or time.time()
+        return {
+            'batch_id': self.batch_id,
+            'team_id': self.team_id,
+            'status': self.status,
+            'files': files,
+            'succeeded': sum(1 for entry in files if entry['status'] == 'done'),
+            'failed': sum(1 for entry in files if entry['status'] == 'failed'),
+            'created_at': self.created_at,
+            'finished_at': self.finished_at,
+            'elapsed_seconds': round(finished_or_now - self.created_at, 3),
+        }
+
+    async def wait(self) -> 'IngestionBatch':
+        """Aguarda todos os arquivos e a atualização dos índices"""
+        return await asyncio.wrap_future(self.future)
+
+
+class IngestionQueue:
+    """
+    Pool limitado de workers que executa as ingestões fora do event loop
+
+    - max_workers: ingestões simultâneas
+    - max_pending: jobs na fila + em execução (submit acima disso falha)
+    - history: quantos jobs terminados ficam consultáveis
+    """
+
+    def __init__(
+        self,
+        worker: Callable[[IngestionJob, SpooledUpload], Dict[str, Any]],
+        max_workers: int = 2,
+        max_pending: int = 100,
+        history: int = 500
+    ):
+        self._worker = worker
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='kb-ingest')
+        self.max_pending = max_pending
+        self.history = history
+
+        self._jobs: 'OrderedDict[str, IngestionJob]' = OrderedDict()
+        self._batches: 'OrderedDict[str, IngestionBatch]' = OrderedDict()
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    def submit(self, job: IngestionJob, upload: SpooledUpload) -> IngestionJob:
+        """
+        Enfileira o job; job.future é resolvido quando o worker termina
+
+        Com a fila cheia o job é resolvido como falha (quem já esperava por
+        ele é liberado) e IngestionQueueFull é levantada.
+        """
+        with self._lock:
+            full = self._pending >= self.max_pending
+            if not full:
+                self._pending += 1
+                self._jobs[job.job_id] = job
+                self._trim()
+            pending = self._pending
+
+        if full:
+            error = f"Fila de ingestão cheia ({pending} documentos pendentes)"
+            job.status = 'failed'
+            job.error = error
+            job.result = {'success': False, 'error': error}
+            job.finished_at = time.time()
+            job.future.set_result(job.result)
+            raise IngestionQueueFull(error)
+
+        self._executor.submit(self._run, job, upload)
+        print(f"📥 Job {job.job_id} enfileirado: {job.filename} (team={job.team_id})")
+        return job
+
+    def complete(self, job: IngestionJob, result: Dict[str, Any]) -> IngestionJob:
+        """Registra um job já resolvido sem passar pelos workers (ex.: upload repetido)"""
+        job.status = 'done'
+        job.set_stage(
+            'done',
+            chunks_count=result.get('chunksCount'),
+            word_count=result.get('wordCount'),
+            duplicate_chunks=result.get('duplicateChunks')
+        )
+        job.result = result
+        job.started_at = job.finished_at = time.time()
+        job.future.set_result(result)
+
+        with self._lock:
+            self._jobs[job.job_id] = job
+            self._trim()
+        return job
+
+    def _run(self, job: IngestionJob, upload: SpooledUpload):
+        job.status = 'running'
+        job.started_at = time.time()
+        try:
+            result = self._worker(job, upload)
+            if result.get('success'):
+                job.status = 'done'
+                job.set_stage('done')
+            else:
+                job.status = 'failed'
+                job.error = result.get('error')
+            job.result = result
+        except Exception as e:
+            job.status = 'failed'
+            job.error = str(e)
+            job.result = {'success': False, 'error': str(e)}
+        finally:
+            job.finished_at = time.time()
+            with self._lock:
+                self._pending -= 1
+            print(f"📦 Job {job.job_id} {job.status} em {job.finished_at - job.started_at:.1f}s")
+        job.future.set_result(job.result)
+
+    def _trim(self):
+        """Descarta os jobs terminados mais antigos além do histórico"""
+        finished = [job_id for job_id, job in self._jobs.items() if job.finished_at]
+        for job_id in finished[:max(0, len(finished) - self.history)]:
+            del self._jobs[job_id]
+
+    def get(self, job_id: str) -> Optional[IngestionJob]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def add_batch(self, batch: IngestionBatch):
+        with self._lock:
+            self._batches[batch.batch_id] = batch
+            while len(self._batches) > self.history:
+                self._batches.popitem(last=False)
+        batch.start(self._executor)
+
+    def get_batch(self, batch_id: str) -> Optional[IngestionBatch]:
+        with self._lock:
+            return self._batches.get(batch_id)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            by_status: Dict[str, int] = {}
+            for job in self._jobs.values():
+                by_status[job.status] = by_status.get(job.status, 0) + 1
+            return {'pending': self._pending, 'maxPending': self.max_pending, 'jobs': by_status}
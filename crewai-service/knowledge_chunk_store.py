@@ -0,0 +1,413 @@
+# knowledge_chunk_store.py - Cópia local (SQLite) da coleção knowledge_chunks
+
+import os
+import json
+import sqlite3
+import threading
+import time
+from typing import List, Dict, Any, Optional, Iterable, Iterator
+import numpy as np
+from chunk_dedup import MINHASHER
+
+DEFAULT_STORE_PATH = os.path.join(os.path.dirname(__file__), 'data', 'knowledge_chunks.db')
+
+# Valores por `IN (...)`: o SQLite limita as variáveis por comando (999 em versões antigas)
+SQLITE_IN_BATCH = 500
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS chunks (
+    chunk_id TEXT PRIMARY KEY,
+    team_id TEXT NOT NULL,
+    document_id TEXT NOT NULL,
+    chunk_index INTEGER NOT NULL,
+    content TEXT NOT NULL,
+    metadata TEXT NOT NULL,
+    canonical_chunk_id TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_chunks_team ON chunks(team_id);
+CREATE INDEX IF NOT EXISTS idx_chunks_document ON chunks(document_id);
+
+CREATE TABLE IF NOT EXISTS chunk_signatures (
+    chunk_id TEXT PRIMARY KEY,
+    team_id TEXT NOT NULL,
+    signature BLOB NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS chunk_lsh (
+    team_id TEXT NOT NULL,
+    band_key TEXT NOT NULL,
+    chunk_id TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_lsh_bucket ON chunk_lsh(team_id, band_key);
+CREATE INDEX IF NOT EXISTS idx_lsh_chunk ON chunk_lsh(chunk_id);
+
+CREATE TABLE IF NOT EXISTS documents (
+    team_id TEXT NOT NULL,
+    document_id TEXT NOT NULL,
+    chunks_count INTEGER NOT NULL,
+    synced_at REAL NOT NULL,
+    PRIMARY KEY (team_id, document_id)
+);
+
+CREATE TABLE IF NOT EXISTS teams (
+    team_id TEXT PRIMARY KEY,
+    synced_at REAL NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS team_stamps (
+    team_id TEXT PRIMARY KEY,
+    stamp INTEGER NOT NULL
+);
+"""
+
+
+# Chunks duplicados guardam só o link: o conteúdo vem do chunk canônico
+CHUNK_COLUMNS = (
+    "c.chunk_id, c.document_id, c.chunk_index, c.metadata, c.canonical_chunk_id, "
+    "COALESCE(canonical.content, c.content) AS content"
+)
+CHUNK_FROM = "chunks c LEFT JOIN chunks canonical ON canonical.chunk_id = c.canonical_chunk_id"
+
+
+def _in_batches(values: List[Any]) -> Iterator[tuple]:
+    """Fatias de até SQLITE_IN_BATCH valores e os placeholders de cada uma"""
+    for i in range(0, len(values), SQLITE_IN_BATCH):
+        batch = tuple(values[i:i + SQLITE_IN_BATCH])
+        yield batch, ','.join('?' * len(batch))
+
+
+def _row_to_chunk(row: sqlite3.Row) -> Dict[str, Any]:
+    return {
+        'chunkId': row['chunk_id'],
+        'documentId': row['document_id'],
+        'chunkIndex': row['chunk_index'],
+        'content': row['content'],
+        'metadata': json.loads(row['metadata']),
+        'canonicalChunkId': row['canonical_chunk_id']
+    }
+
+
+def collapse_duplicates(chunks: List[Dict[str, Any]], present_chunk_ids: Iterable[str] = ()) -> List[Dict[str, Any]]:
+    """
+    Remove links redundantes: um chunk duplicado só entra se o canônico
+    não estiver no conjunto (nem outro link para o mesmo canônico)
+    """
+    present = set(present_chunk_ids) | {chunk['chunkId'] for chunk in chunks}
+    linked = set()
+    collapsed = []
+    for chunk in chunks:
+        canonical_id = chunk.get('canonicalChunkId')
+        if canonical_id:
+            if canonical_id in present or canonical_id in linked:
+                continue
+            linked.add(canonical_id)
+        if chunk['content']:
+            collapsed.append(chunk)
+    return collapsed
+
+
+class LocalChunkStore:
+    """
+    Armazena localmente os chunks da Knowledge Base
+
+    O Firestore continua sendo a fonte da verdade: process_document grava
+    nos dois (write-through) e delete_document remove dos dois. As buscas
+    leem daqui; documentos que ainda não existem localmente (nó novo,
+    upload feito em outro nó) são baixados do Firestore sob demanda.
+
+    Tabelas:
+    - chunks: conteúdo de cada chunk
+    - documents: documentos já sincronizados por equipe (inclusive vazios,
+      para não consultar o Firestore de novo a cada mensagem)
+    - teams: equipes sincronizadas por completo (busca sem document_ids)
+    - team_stamps: carimbo da equipe no Firestore que o store reflete
+      (diferente do atual = outro nó alterou a equipe)
+    - chunk_signatures / chunk_lsh: assinaturas MinHash e buckets LSH dos
+      chunks canônicos, para achar chunks repetidos na ingestão
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path or os.getenv('KNOWLEDGE_STORE_PATH', DEFAULT_STORE_PATH)
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._migrate()
+        self._conn.executescript(SCHEMA)
+        self._conn.commit()
+
+        print(f"💾 Chunk store local: {self.path}")
+
+    def _migrate(self):
+        """Bancos criados antes do dedup não têm a coluna canonical_chunk_id"""
+        columns = {row['name'] for row in self._conn.execute("PRAGMA table_info(chunks)")}
+        if columns and 'canonical_chunk_id' not in columns:
+            self._conn.execute("ALTER TABLE chunks ADD COLUMN canonical_chunk_id TEXT")
+
+    def _insert_chunks(self, team_id: str, chunks: List[Dict[str, Any]]):
+        self._conn.executemany(
+            "INSERT OR REPLACE INTO chunks "
+            "(chunk_id, team_id, document_id, chunk_index, content, metadata, canonical_chunk_id) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            [
+                (
+                    chunk['chunkId'],
+                    team_id,
+                    chunk['documentId'],
+                    chunk.get('chunkIndex', 0),
+                    chunk['content'],
+                    json.dumps(chunk.get('metadata', {}), ensure_ascii=False),
+                    chunk.get('canonicalChunkId')
+                )
+                for chunk in chunks
+            ]
+        )
+        self._register_signatures(team_id, [chunk for chunk in chunks if not chunk.get('canonicalChunkId')])
+
+    def _register_signatures(self, team_id: str, chunks: List[Dict[str, Any]]):
+        """Indexa os chunks canônicos no LSH"""
+        self._delete_signatures([chunk['chunkId'] for chunk in chunks])
+
+        signatures = []
+        buckets = []
+        for chunk in chunks:
+            signature = MINHASHER.signature(chunk['content'])
+            if signature is None:
+                continue
+            signatures.append((chunk['chunkId'], team_id, MINHASHER.to_bytes(signature)))
+            buckets.extend((team_id, key, chunk['chunkId']) for key in MINHASHER.band_keys(signature))
+
+        self._conn.executemany(
+            "INSERT OR REPLACE INTO chunk_signatures (chunk_id, team_id, signature) VALUES (?, ?, ?)",
+            signatures
+        )
+        self._conn.executemany(
+            "INSERT INTO chunk_lsh (team_id, band_key, chunk_id) VALUES (?, ?, ?)",
+            buckets
+        )
+
+    def _delete_signatures(self, chunk_ids: List[str]):
+        for batch, placeholders in _in_batches(chunk_ids):
+            self._conn.execute(f"DELETE FROM chunk_signatures WHERE chunk_id IN ({placeholders})", batch)
+            self._conn.execute(f"DELETE FROM chunk_lsh WHERE chunk_id IN ({placeholders})", batch)
+
+    def _delete_chunks(self, where: str, params: tuple):
+        chunk_ids = [row['chunk_id'] for row in self._conn.execute(f"SELECT chunk_id FROM chunks WHERE {where}", params)]
+        self._delete_signatures(chunk_ids)
+        self._conn.execute(f"DELETE FROM chunks WHERE {where}", params)
+
+    def put_document(self, team_id: str, document_id: str, chunks: List[Dict[str, Any]]):
+        """Grava (ou substitui) todos os chunks de um documento"""
+        team_id = str(team_id)
+        with self._lock, self._conn:
+            self._delete_chunks("document_id = ?", (document_id,))
+            self._insert_chunks(team_id, chunks)
+            self._conn.execute(
+                "INSERT OR REPLACE INTO documents (team_id, document_id, chunks_count, synced_at) "
+                "VALUES (?, ?, ?, ?)",
+                (team_id, document_id, len(chunks), time.time())
+            )
+
+    def append_chunks(self, team_id: str, chunks: List[Dict[str, Any]]):
+        """
+        Grava um lote de chunks de um documento em ingestão (streaming)
+
+        O documento só conta como sincronizado depois de finish_document.
+        """
+        with self._lock, self._conn:
+            self._insert_chunks(str(team_id), chunks)
+
+    def finish_document(self, team_id: str, document_id: str, chunks_count: int):
+        """Marca como sincronizado um documento gravado com append_chunks"""
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO documents (team_id, document_id, chunks_count, synced_at) "
+                "VALUES (?, ?, ?, ?)",
+                (str(team_id), document_id, chunks_count, time.time())
+            )
+
+    def set_chunk_indexes(self, chunk_indexes: Dict[str, int]):
+        """Atualiza a posição de chunks mantidos numa nova versão do documento"""
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "UPDATE chunks SET chunk_index = ? WHERE chunk_id = ?",
+                [(chunk_index, chunk_id) for chunk_id, chunk_index in chunk_indexes.items()]
+            )
+
+    def delete_chunks(self, chunk_ids: List[str]):
+        """Remove chunks avulsos (nova versão de um documento)"""
+        with self._lock, self._conn:
+            for batch, placeholders in _in_batches(chunk_ids):
+                self._delete_chunks(f"chunk_id IN ({placeholders})", batch)
+
+    def delete_document(self, document_id: str) -> Optional[str]:
+        """Remove documento e chunks. Retorna o team_id se o documento existia localmente"""
+        with self._lock, self._conn:
+            row = self._conn.execute(
+                "SELECT team_id FROM chunks WHERE document_id = ? LIMIT 1", (document_id,)
+            ).fetchone()
+            self._delete_chunks("document_id = ?", (document_id,))
+            self._conn.execute("DELETE FROM documents WHERE document_id = ?", (document_id,))
+        return row['team_id'] if row else None
+
+    def missing_documents(self, team_id: str, document_ids: List[str]) -> List[str]:
+        """Documentos que ainda não foram sincronizados para esta equipe"""
+        team_id = str(team_id)
+        known = set()
+        with self._lock:
+            for batch, placeholders in _in_batches(document_ids):
+                known.update(
+                    row['document_id']
+                    for row in self._conn.execute(
+                        f"SELECT document_id FROM documents WHERE team_id = ? AND document_id IN ({placeholders})",
+                        (team_id, *batch)
+                    )
+                )
+        return [doc_id for doc_id in document_ids if doc_id not in known]
+
+    def is_team_synced(self, team_id: str) -> bool:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT 1 FROM teams WHERE team_id = ?", (str(team_id),)
+            ).fetchone()
+        return row is not None
+
+    def load_chunks(self, team_id: str, document_ids: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+        """
+        Carrega chunks da equipe (opcionalmente filtrando por documentos)
+
+        Duplicados cujo canônico também está no conjunto ficam de fora.
+        """
+        sql = f"SELECT {CHUNK_COLUMNS} FROM {CHUNK_FROM} WHERE c.team_id = ?"
+        order = " ORDER BY c.document_id, c.chunk_index"
+
+        with self._lock:
+            if not document_ids:
+                rows = self._conn.execute(sql + order, (str(team_id),)).fetchall()
+            else:
+                rows = []
+                for batch, placeholders in _in_batches(sorted(set(document_ids))):
+                    rows.extend(self._conn.execute(
+                        sql + f" AND c.document_id IN ({placeholders})" + order, (str(team_id), *batch)
+                    ))
+
+        return collapse_duplicates([_row_to_chunk(row) for row in rows])
+
+    def get_chunks(self, chunk_ids: List[str]) -> List[Optional[Dict[str, Any]]]:
+        """Busca chunks por id, na mesma ordem (None se não existir mais)"""
+        if not chunk_ids:
+            return []
+
+        rows = []
+        with self._lock:
+            for batch, placeholders in _in_batches(chunk_ids):
+                rows.extend(self._conn.execute(
+                    f"SELECT {CHUNK_COLUMNS} FROM {CHUNK_FROM} WHERE c.chunk_id IN ({placeholders})", batch
+                ))
+
+        by_id = {row['chunk_id']: _row_to_chunk(row) for row in rows}
+        return [by_id.get(chunk_id) for chunk_id in chunk_ids]
+
+    def near_duplicate_candidates(self, team_id: str, band_keys: List[str]) -> Dict[str, np.ndarray]:
+        """Chunks canônicos da equipe que caem em algum dos buckets LSH"""
+        if not band_keys:
+            return {}
+
+        rows = []
+        with self._lock:
+            for batch, placeholders in _in_batches(band_keys):
+                rows.extend(self._conn.execute(
+                    f"SELECT DISTINCT s.chunk_id, s.signature FROM chunk_lsh l "
+                    f"JOIN chunk_signatures s ON s.chunk_id = l.chunk_id "
+                    f"WHERE l.team_id = ? AND l.band_key IN ({placeholders})",
+                    (str(team_id), *batch)
+                ))
+        return {row['chunk_id']: MINHASHER.from_bytes(row['signature']) for row in rows}
+
+    def relink_chunks(self, team_id: str, chunks: List[Dict[str, Any]]):
+        """Atualiza conteúdo/canônico de chunks existentes (promoção de duplicados)"""
+        team_id = str(team_id)
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "UPDATE chunks SET content = ?, canonical_chunk_id = ? WHERE chunk_id = ?",
+                [(chunk['content'], chunk.get('canonicalChunkId'), chunk['chunkId']) for chunk in chunks]
+            )
+            self._register_signatures(team_id, [chunk for chunk in chunks if not chunk.get('canonicalChunkId')])
+
+    def replace_team(self, team_id: str, documents: Dict[str, List[Dict[str, Any]]], stamp: Optional[int] = None):
+        """
+        Reconciliação: substitui tudo o que existe localmente para a equipe
+        pelo estado atual do Firestore (stamp: carimbo lido antes da busca)
+        """
+        team_id = str(team_id)
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM chunks WHERE team_id = ?", (team_id,))
+            self._conn.execute("DELETE FROM chunk_signatures WHERE team_id = ?", (team_id,))
+            self._conn.execute("DELETE FROM chunk_lsh WHERE team_id = ?", (team_id,))
+            self._conn.execute("DELETE FROM documents WHERE team_id = ?", (team_id,))
+            for document_id, chunks in documents.items():
+                self._insert_chunks(team_id, chunks)
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO documents (team_id, document_id, chunks_count, synced_at) "
+                    "VALUES (?, ?, ?, ?)",
+                    (team_id, document_id, len(chunks), now)
+                )
+            self._conn.execute(
+                "INSERT OR REPLACE INTO teams (team_id, synced_at) VALUES (?, ?)",
+                (team_id, now)
+            )
+            if stamp is not None:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO team_stamps (team_id, stamp) VALUES (?, ?)", (team_id, stamp)
+                )
+
+    def team_stamp(self, team_id: str) -> Optional[int]:
+        with self._lock:
+            row = self._conn.execute("SELECT stamp FROM team_stamps WHERE team_id = ?", (str(team_id),)).fetchone()
+        return row['stamp'] if row else None
+
+    def mark_team_stale(self, team_id: str, stamp: int):
+        """
+        A equipe mudou fora deste nó: documentos e equipe deixam de contar
+        como sincronizados (são buscados de novo no Firestore sob demanda)
+        """
+        team_id = str(team_id)
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM documents WHERE team_id = ?", (team_id,))
+            self._conn.execute("DELETE FROM teams WHERE team_id = ?", (team_id,))
+            self._conn.execute("INSERT OR REPLACE INTO team_stamps (team_id, stamp) VALUES (?, ?)", (team_id, stamp))
+
+    def advance_team_stamp(self, team_id: str, stamp: int) -> bool:
+        """Aceita o carimbo novo só se for o seguinte ao conhecido (a única mudança foi a deste nó)"""
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                "UPDATE team_stamps SET stamp = ? WHERE team_id = ? AND stamp = ?",
+                (stamp, str(team_id), stamp - 1)
+            )
+        return cursor.rowcount == 1
+
+    def data_version(self) -> int:
+        """Muda quando outra conexão (ex.: CLI de sync) grava no arquivo"""
+        with self._lock:
+            return self._conn.execute("PRAGMA data_version").fetchone()[0]
+
+    def teams_synced_since(self, since: float) -> List[str]:
+        """Equipes com documentos (ou a equipe inteira) sincronizados a partir de `since`"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT team_id FROM teams WHERE synced_at >= ? "
+                "UNION SELECT team_id FROM documents WHERE synced_at >= ?",
+                (since, since)
+            ).fetchall()
+        return [row['team_id'] for row in rows]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            chunks = self._conn.execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+            documents = self._conn.execute("SELECT COUNT(*) FROM documents").fetchone()[0]
+            teams = self._conn.execute("SELECT COUNT(*) FROM teams").fetchone()[0]
+        return {'path': self.path, 'chunks': chunks, 'documents': documents, 'teams': teams}
@@ -0,0 +1,505 @@
+# knowledge_index.py - Índices pré-calculados por equipe (TF-IDF ou BM25)
+
+import os
+import re
+import json
+import shutil
+import hashlib
+import threading
+from collections import Counter, OrderedDict
+from typing import List, Dict, Any, Optional, Tuple, Union
+from sklearn.feature_extraction.text import TfidfVectorizer
+import numpy as np
+from bm25_index import BM25Index
+from sparse_index_files import (
+    META_FILENAME,
+    PostingsIndex,
+    save_index_files,
+    load_index_files,
+    lookup_term_rows,
+    estimate_nbytes,
+    postings_arrays,
+    select_top_k,
+    split_rows,
+)
+from scipy.sparse import hstack
+
+
+def _new_vectorizer() -> TfidfVectorizer:
+    """Cria o vectorizer com os mesmos parâmetros usados desde a v1 da KB"""
+    return TfidfVectorizer(
+        max_features=1000,  # Top 1000 palavras
+        ngram_range=(1, 2),  # Uni e bigramas
+        stop_words=None,  # Vamos manter stopwords em português
+        max_df=0.85,
+        min_df=2
+    )
+
+
+# Tokenização idêntica à do vectorizer (não depende de fit)
+_TFIDF_ANALYZER = _new_vectorizer().build_analyzer()
+
+
+class TfidfIndex(PostingsIndex):
+    """
+    Índice TF-IDF já ajustado (fit) para um conjunto de chunks
+
+    O fit acontece uma única vez na construção. A matriz é guardada
+    transposta (termo x chunk, CSR), então cada busca só soma as linhas
+    dos termos da query - os vetores já saem normalizados em L2, então o
+    resultado é o cosseno. Nenhum objeto do sklearn fica em memória: só
+    arrays, que podem ser abertos direto do disco via mmap.
+
+    Se o corpus for pequeno demais para os parâmetros do vectorizer
+    (ex: min_df=2 com poucos chunks), cai na busca keyword (Jaccard);
+    esses índices são minúsculos e não vão para o disco.
+    """
+
+    ranker = 'tfidf'
+    ARRAYS = PostingsIndex.ARRAYS + ('idf',)
+    pad_results = True
+
+    def __init__(
+        self,
+        chunk_ids: List[str],
+        arrays: Dict[str, np.ndarray],
+        params: Dict[str, Any],
+        chunk_words: Optional[List[set]] = None
+    ):
+        self.chunk_words = chunk_words
+        if chunk_words is not None:
+            self.chunk_ids = chunk_ids
+            self.arrays = {}
+            self.params = params
+            self.persistent = False
+            return
+
+        super().__init__(chunk_ids, arrays, params)
+        self.idf = arrays['idf']
+
+    @classmethod
+    def build(cls, chunk_data: List[Dict[str, Any]]) -> 'TfidfIndex':
+        chunk_ids = [chunk['chunkId'] for chunk in chunk_data]
+        contents = [chunk['content'] for chunk in chunk_data]
+
+        try:
+            vectorizer = _new_vectorizer()
+            matrix = vectorizer.fit_transform(contents)
+        except Exception as e:
+            print(f"⚠️ Erro no TF-IDF, índice usará busca keyword: {e}")
+            return cls(chunk_ids, {}, {}, chunk_words=[set(content.lower().split()) for content in contents])
+
+        postings = matrix.T.tocsr()
+        postings.sort_indices()
+
+        arrays = {
+            'terms': np.asarray(vectorizer.get_feature_names_out(), dtype=str),
+            'postings_indptr': postings.indptr.astype(np.int64),
+            'postings_docs': postings.indices.astype(np.int32),
+            'postings_weights': postings.data.astype(np.float32),
+            'idf': vectorizer.idf_.astype(np.float32),
+        }
+        return cls(chunk_ids, arrays, {})
+
+    def query_vector(self, query: str) -> Tuple[List[int], List[float]]:
+        """Vetor TF-IDF (L2) da query, igual ao vectorizer.transform"""
+        return self._transform(query)
+
+    def _transform(self, text: str) -> Tuple[List[int], List[float]]:
+        counts = Counter(_TFIDF_ANALYZER(text))
+        tokens = sorted(counts)
+
+        rows: List[int] = []
+        weights: List[float] = []
+        for token, row in zip(tokens, lookup_term_rows(self.terms, tokens)):
+            if row >= 0:
+                rows.append(row)
+                weights.append(counts[token] * float(self.idf[row]))
+
+        norm = float(np.linalg.norm(weights)) if weights else 0.0
+        if norm > 0:
+            weights = [weight / norm for weight in weights]
+        return rows, weights
+
+    def build_segment(self, chunk_data: List[Dict[str, Any]], segments: List['TfidfIndex']) -> 'TfidfIndex':
+        """
+        Segmento incremental com o vocabulário e o IDF deste índice (estáveis)
+
+        Os chunks novos são transformados como no vectorizer.transform, sem
+        refit; termos fora do vocabulário só passam a contar na compactação.
+        """
+        term_rows: List[int] = []
+        positions: List[int] = []
+        weights: List[float] = []
+        for position, chunk in enumerate(chunk_data):
+            rows, row_weights = self._transform(chunk['content'])
+            term_rows.extend(rows)
+            positions.extend([position] * len(rows))
+            weights.extend(row_weights)
+
+        arrays = {'terms': self.terms, 'idf': self.idf}
+        arrays.update(postings_arrays(term_rows, positions, weights, len(self.terms), len(chunk_data)))
+        return TfidfIndex([chunk['chunkId'] for chunk in chunk_data], arrays, {})
+
+    def search_batch(self, queries: List[str], top_k: int) -> List[List[Tuple[int, float]]]:
+        if self.persistent:
+            return super().search_batch(queries, top_k)
+
+        # Fallback: busca keyword simples (Jaccard similarity)
+        results = []
+        for query in queries:
+            query_words = set(query.lower().split())
+            similarities = []
+            for content_words in self.chunk_words:
+                intersection = len(query_words & content_words)
+                union = len(query_words | content_words)
+                similarities.append(intersection / union if union > 0 else 0)
+            similarities = np.array(similarities)
+            top_indices = np.argsort(similarities)[::-1][:top_k]
+            results.append([(int(idx), float(similarities[idx])) for idx in top_indices])
+        return results
+
+
+# Compactação: reconstruir do zero quando os chunks removidos ou os chunks
+# adicionados depois do fit passam dessas frações do índice
+COMPACT_TOMBSTONE_RATIO = float(os.getenv('KNOWLEDGE_COMPACT_TOMBSTONE_RATIO', '0.2'))
+COMPACT_DRIFT_RATIO = float(os.getenv('KNOWLEDGE_COMPACT_DRIFT_RATIO', '0.2'))
+
+
+class SegmentedIndex:
+    """
+    Índice incremental: segmento base + segmentos adicionados + tombstones
+
+    - Documentos novos viram um segmento construído só com os chunks novos
+      (build_segment do segmento base), sem refit do corpus.
+    - Chunks removidos são marcados em `tombstones` e filtrados da busca.
+    - Cada atualização gera um novo SegmentedIndex (snapshot imutável); os
+      segmentos antigos são compartilhados e, em disco, reaproveitados via
+      hard link.
+
+    Os scores de cada segmento usam as estatísticas do segmento base, então
+    ficam comparáveis; quando a fração de tombstones ou de chunks fora do
+    fit (drift de vocabulário/IDF) fica grande, needs_compaction() pede um
+    rebuild completo.
+    """
+
+    persistent = True
+
+    def __init__(self, segments: List[PostingsIndex], tombstones: np.ndarray):
+        self.segments = segments
+        self.tombstones = tombstones
+        self.ranker = segments[0].ranker
+        self.pad_results = segments[0].pad_results
+
+        self.chunk_ids = [chunk_id for segment in segments for chunk_id in segment.chunk_ids]
+        self.params = {
+            'segments': [
+                {'size': len(segment), 'params': segment.params}
+                for segment in segments
+            ]
+        }
+        self.arrays = {'tombstones': tombstones}
+        for i, segment in enumerate(segments):
+            for name, array in segment.arrays.items():
+                self.arrays[f"s{i}.{name}"] = array
+
+        self._alive = np.ones(len(self.chunk_ids), dtype=bool)
+        self._alive[tombstones] = False
+
+    @classmethod
+    def from_index(cls, index: Union[PostingsIndex, 'SegmentedIndex']) -> 'SegmentedIndex':
+        if isinstance(index, SegmentedIndex):
+            return index
+        return cls([index], np.array([], dtype=np.int64))
+
+    def __len__(self) -> int:
+        return int(self._alive.sum())
+
+    def live_chunk_ids(self) -> set:
+        return {chunk_id for chunk_id, alive in zip(self.chunk_ids, self._alive.tolist()) if alive}
+
+    def nbytes(self) -> int:
+        return estimate_nbytes(self.arrays, self.chunk_ids)
+
+    def apply(
+        self,
+        chunk_data: List[Dict[str, Any]],
+        removed_chunk_ids: List[str]
+    ) -> 'SegmentedIndex':
+        """Novo snapshot com os chunks adicionados e os removidos marcados"""
+        segments = list(self.segments)
+        if chunk_data:
+            segments.append(segments[0].build_segment(chunk_data, segments))
+
+        positions = {chunk_id: position for position, chunk_id in enumerate(self.chunk_ids)}
+        removed = [positions[chunk_id] for chunk_id in removed_chunk_ids if chunk_id in positions]
+        tombstones = np.union1d(np.asarray(self.tombstones), np.array(removed, dtype=np.int64))
+        return SegmentedIndex(segments, tombstones.astype(np.int64))
+
+    def tombstone_ratio(self) -> float:
+        return len(self.tombstones) / len(self.chunk_ids) if self.chunk_ids else 0.0
+
+    def drift_ratio(self) -> float:
+        appended = len(self.chunk_ids) - len(self.segments[0])
+        return appended / len(self.chunk_ids) if self.chunk_ids else 0.0
+
+    def needs_compaction(self) -> bool:
+        return (
+            self.tombstone_ratio() > COMPACT_TOMBSTONE_RATIO
+            or self.drift_ratio() > COMPACT_DRIFT_RATIO
+        )
+
+    def search(self, query: str, top_k: int) -> List[Tuple[int, float]]:
+        return self.search_batch([query], top_k)[0]
+
+    def search_batch(self, queries: List[str], top_k: int) -> List[List[Tuple[int, float]]]:
+        """Scores de todos os segmentos lado a lado, sem os chunks removidos"""
+        scores = hstack([segment.score_matrix(queries) for segment in self.segments], format='csr')
+        if len(self.tombstones):
+            scores.data[~self._alive[scores.indices]] = 0
+            scores.eliminate_zeros()
+
+        pad_candidates = np.flatnonzero(self._alive).tolist() if self.pad_results else None
+        return [
+            select_top_k(docs, row_scores, top_k, pad_candidates)
+            for docs, row_scores in split_rows(scores)
+        ]
+
+
+KnowledgeIndex = Union[TfidfIndex, BM25Index, SegmentedIndex]
+
+# Rankers disponíveis (selecionável por equipe via teamData.knowledgeRanker)
+RANKERS = {
+    'tfidf': TfidfIndex,
+    'bm25': BM25Index,
+}
+
+DEFAULT_RANKER = os.getenv('KNOWLEDGE_RANKER', 'tfidf')
+
+
+def resolve_ranker(ranker: Optional[str]) -> str:
+    """Normaliza o nome do ranker, caindo no padrão se for desconhecido"""
+    ranker = (ranker or DEFAULT_RANKER).lower()
+    if ranker not in RANKERS:
+        print(f"⚠️ Ranker desconhecido '{ranker}', usando '{DEFAULT_RANKER}'")
+        return DEFAULT_RANKER
+    return ranker
+
+
+def build_index(chunk_data: List[Dict[str, Any]], ranker: str) -> KnowledgeIndex:
+    return RANKERS[ranker].build(chunk_data)
+
+
+def update_index(
+    index: KnowledgeIndex,
+    chunk_data: List[Dict[str, Any]],
+    removed_chunk_ids: List[str]
+) -> Optional[SegmentedIndex]:
+    """
+    Aplica documentos novos/removidos sem refit (None se o índice não
+    suporta atualização incremental, ex: fallback keyword do TF-IDF)
+    """
+    if not index.persistent:
+        return None
+    return SegmentedIndex.from_index(index).apply(chunk_data, removed_chunk_ids)
+
+
+def reconcile_index(index: KnowledgeIndex, chunk_data: List[Dict[str, Any]]) -> Optional[SegmentedIndex]:
+    """
+    Atualiza o índice para conter exatamente chunk_data: chunks novos viram
+    segmento, os que saíram viram tombstones (None se não for incremental)
+    """
+    live = index.live_chunk_ids() if isinstance(index, SegmentedIndex) else set(index.chunk_ids)
+    wanted = {chunk['chunkId'] for chunk in chunk_data}
+    added = [chunk for chunk in chunk_data if chunk['chunkId'] not in live]
+    removed = [chunk_id for chunk_id in index.chunk_ids if chunk_id in live and chunk_id not in wanted]
+    return update_index(index, added, removed)
+
+
+def load_index(path: str, ranker: str) -> KnowledgeIndex:
+    """Abre um índice salvo em disco (arrays via mmap)"""
+    index_cls = RANKERS[ranker]
+    with open(os.path.join(path, META_FILENAME), 'r', encoding='utf-8') as f:
+        params = json.load(f)['params']
+
+    if 'segments' not in params:
+        arrays, meta = load_index_files(path, index_cls.ARRAYS)
+        return index_cls(meta['chunkIds'], arrays, meta['params'])
+
+    names = ('tombstones',) + tuple(
+        f"s{i}.{name}" for i in range(len(params['segments'])) for name in index_cls.ARRAYS
+    )
+    arrays, meta = load_index_files(path, names)
+
+    segments = []
+    offset = 0
+    for i, segment_meta in enumerate(meta['params']['segments']):
+        size = segment_meta['size']
+        segment_arrays = {name: arrays[f"s{i}.{name}"] for name in index_cls.ARRAYS}
+        segments.append(index_cls(meta['chunkIds'][offset:offset + size], segment_arrays, segment_meta['params']))
+        offset += size
+    return SegmentedIndex(segments, arrays['tombstones'])
+
+
+IndexKey = Tuple[str, Optional[Tuple[str, ...]], str]
+
+DEFAULT_INDEX_DIR = os.path.join(os.path.dirname(__file__), 'data', 'indexes')
+
+
+class KnowledgeIndexCache:
+    """
+    Cache de índices por (team_id, conjunto de documentos, ranker)
+
+    - Índices construídos são gravados em disco (KNOWLEDGE_INDEX_DIR) e
+      reabertos via mmap, então o processo não precisa manter a matriz de
+      cada equipe na heap.
+    - Em memória fica um LRU limitado por bytes (KNOWLEDGE_INDEX_CACHE_MB);
+      equipes frias são despejadas e reabertas do disco quando voltarem.
+    - Invalidado por equipe sempre que um documento é processado ou deletado.
+    - Thread-safe: o LRU é protegido por lock; os índices em si são
+      imutáveis e podem ser lidos por várias threads ao mesmo tempo.
+    """
+
+    def __init__(self, index_dir: Optional[str] = None, max_bytes: Optional[int] = None):
+        self.index_dir = index_dir or os.getenv('KNOWLEDGE_INDEX_DIR', DEFAULT_INDEX_DIR)
+        if max_bytes is None:
+            max_bytes = int(float(os.getenv('KNOWLEDGE_INDEX_CACHE_MB', '256')) * 1024 * 1024)
+        self.max_bytes = max_bytes
+
+        self._indexes: 'OrderedDict[IndexKey, KnowledgeIndex]' = OrderedDict()
+        self._sizes: Dict[IndexKey, int] = {}
+        self.resident_bytes = 0
+        self.hits = 0
+        self.disk_loads = 0
+        self.evictions = 0
+        self._lock = threading.RLock()
+
+    @staticmethod
+    def make_key(team_id: str, document_ids: Optional[List[str]], ranker: str) -> IndexKey:
+        docs_key = tuple(sorted(set(document_ids))) if document_ids else None
+        return (str(team_id), docs_key, ranker)
+
+    def _team_dir(self, team_id: str) -> str:
+        return os.path.join(self.index_dir, re.sub(r'[^A-Za-z0-9_.-]', '_', str(team_id)))
+
+    def _index_path(self, key: IndexKey) -> str:
+        team_id, docs_key, ranker = key
+        docs_hash = hashlib.sha1("\n".join(docs_key or ('__all__',)).encode()).hexdigest()[:16]
+        return os.path.join(self._team_dir(team_id), f"{docs_hash}-{ranker}")
+
+    def get(self, team_id: str, document_ids: Optional[List[str]], ranker: str) -> Optional[KnowledgeIndex]:
+        key = self.make_key(team_id, document_ids, ranker)
+
+        with self._lock:
+            index = self._indexes.get(key)
+            if index is not None:
+                self._indexes.move_to_end(key)
+                self.hits += 1
+                return index
+
+        path = self._index_path(key)
+        if not os.path.exists(os.path.join(path, META_FILENAME)):
+            return None
+
+        try:
+            index = load_index(path, ranker)
+        except Exception as e:
+            print(f"⚠️ Índice em disco ilegível ({path}), será reconstruído: {e}")
+            shutil.rmtree(path, ignore_errors=True)
+            return None
+
+        with self._lock:
+            self.disk_loads += 1
+            self._admit(key, index)
+        return index
+
+    def put(self, team_id: str, document_ids: Optional[List[str]], ranker: str, index: KnowledgeIndex) -> KnowledgeIndex:
+        """Guarda o índice (disco + LRU). Retorna a versão mmap quando persistido"""
+        key = self.make_key(team_id, document_ids, ranker)
+
+        if index.persistent:
+            path = self._index_path(key)
+            try:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                save_index_files(path, index.arrays, {
+                    'ranker': ranker,
+                    'teamId': key[0],
+                    'documentIds': list(key[1]) if key[1] else None,
+                    'chunkIds': index.chunk_ids,
+                    'params': index.params,
+                })
+                index = load_index(path, ranker)
+            except Exception as e:
+                print(f"⚠️ Erro ao gravar índice em disco, mantendo em memória: {e}")
+
+        with self._lock:
+            self._admit(key, index)
+        return index
+
+    def _admit(self, key: IndexKey, index: KnowledgeIndex):
+        self._drop(key)
+        size = index.nbytes()
+        self._indexes[key] = index
+        self._sizes[key] = size
+        self.resident_bytes += size
+
+        # Despejar os menos usados até caber no orçamento (sempre mantém o atual)
+        while self.resident_bytes > self.max_bytes and len(self._indexes) > 1:
+            oldest_key = next(iter(self._indexes))
+            self._drop(oldest_key)
+            self.evictions += 1
+
+    def _drop(self, key: IndexKey):
+        if key in self._indexes:
+            del self._indexes[key]
+            self.resident_bytes -= self._sizes.pop(key)
+
+    def team_keys(self, team_id: str) -> List[IndexKey]:
+        """Chaves de todos os índices da equipe (memória e disco)"""
+        team_id = str(team_id)
+        with self._lock:
+            keys = {key for key in self._indexes if key[0] == team_id}
+
+            team_dir = self._team_dir(team_id)
+            for name in (os.listdir(team_dir) if os.path.isdir(team_dir) else []):
+                meta_path = os.path.join(team_dir, name, META_FILENAME)
+                if not os.path.exists(meta_path):
+                    continue
+                try:
+                    with open(meta_path, 'r', encoding='utf-8') as f:
+                        meta = json.load(f)
+                    keys.add(self.make_key(team_id, meta['documentIds'], meta['ranker']))
+                except Exception:
+                    shutil.rmtree(os.path.join(team_dir, name), ignore_errors=True)
+        return sorted(keys, key=lambda key: (key[1] is not None, key[1] or (), key[2]))
+
+    def discard(self, team_id: str, document_ids: Optional[List[str]], ranker: str):
+        """Remove um índice (memória e disco)"""
+        key = self.make_key(team_id, document_ids, ranker)
+        with self._lock:
+            self._drop(key)
+            shutil.rmtree(self._index_path(key), ignore_errors=True)
+
+    def invalidate_team(self, team_id: str) -> int:
+        """Remove todos os índices da equipe (memória e disco). Retorna quantos estavam em memória"""
+        team_id = str(team_id)
+        with self._lock:
+            keys = [key for key in self._indexes if key[0] == team_id]
+            for key in keys:
+                self._drop(key)
+            # Buscas em andamento seguem com o mmap aberto (o arquivo só some de fato ao fechar)
+            shutil.rmtree(self._team_dir(team_id), ignore_errors=True)
+        if keys:
+            print(f"♻️ {len(keys)} índice(s) invalidado(s) para team={team_id}")
+        return len(keys)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'indexes': len(self._indexes),
+                'residentBytes': self.resident_bytes,
+                'maxBytes': self.max_bytes,
+                'hits': self.hits,
+                'diskLoads': self.disk_loads,
+                'evictions': self.evictions,
+            }
@@ -1,49 +1,117 @@
 # knowledge_service_router.py - Router para Knowledge Base
 
-from fastapi import APIRouter, UploadFile, File, Form, HTTPException
+import asyncio
+import functools
+import zipfile
+from fastapi import APIRouter, UploadFile, File, Form, HTTPException, Body
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel
+from typing import List, Optional
 from simple_knowledge_service import get_knowledge_service
+from ingestion_jobs import IngestionQueueFull
+from upload_spool import spool_upload, expand_zip, UploadTooLarge, MAX_BULK_UPLOAD_BYTES, BULK_MAX_FILES
 
 router = APIRouter()
 
+# Tipos aceitos na knowledge base
+SUPPORTED_EXTENSIONS = ['pdf', 'docx', 'xlsx', 'xls', 'txt']
+
+class SearchBatchRequest(BaseModel):
+    team_id: str
+    document_ids: Optional[List[str]] = None
+    queries: List[str]
+    top_k: int = 3
+    ranker: Optional[str] = None
+
 @router.post("/knowledge/upload")
 async def upload_knowledge_document(
     file: UploadFile = File(...),
     team_id: str = Form(...),
-    company_id: str = Form(...)
+    company_id: str = Form(...),
+    background: bool = Form(False),
+    force: bool = Form(False),
+    replace_document_id: Optional[str] = Form(None),
+    chunker: Optional[str] = Form(None)
 ):
     """
     Upload e processamento de documento para knowledge base
 
     Args:
-        file: Arquivo (PDF, DOCX, XLSX, TXT)
+        file: Arquivo (PDF, DOCX, XLSX, TXT), até KNOWLEDGE_MAX_UPLOAD_MB (413 acima disso)
         team_id: ID da equipe
         company_id: ID da empresa
+        background: True = retorna 202 com job_id na hora (acompanhar em
+            GET /knowledge/jobs/{job_id}); False = aguarda o job terminar
+        force: True = processa mesmo que a equipe já tenha um documento com
+            o mesmo conteúdo (por padrão retorna o documento existente)
+        replace_document_id: o arquivo é uma nova versão deste documento;
+            só os chunks que mudaram são gravados/removidos
+        chunker: chunker configurado na equipe (Team.knowledgeChunker, enviado
+            pelo backend): "chars" (janelas de 1000 caracteres) ou "sentences"
+            (frases inteiras com orçamento de tokens); sem valor, KNOWLEDGE_CHUNKER
 
     Returns:
         {
             "document_id": str,
             "chunks_count": int,
-            "word_count": int
+            "word_count": int,
+            "duplicate_chunks": int,
+            "dedup_ratio": float,
+            "already_exists": bool,
+            "added_chunks": int,
+            "removed_chunks": int
         }
     """
     try:
-        # Ler conteúdo do arquivo
-        file_content = await file.read()
-
         # Obter extensão
         filename = file.filename
         extension = filename.split('.')[-1].lower() if filename else 'txt'
 
         # Validar tipo
-        if extension not in ['pdf', 'docx', 'xlsx', 'xls', 'txt']:
+        if extension not in SUPPORTED_EXTENSIONS:
             raise HTTPException(status_code=400, detail="Tipo de arquivo não suportado. Use PDF, DOCX, XLSX ou TXT.")
 
-        # Processar documento
         knowledge_service = get_knowledge_service()
+        loop = asyncio.get_running_loop()
+
+        # Nova versão: o documento precisa existir e ser da equipe
+        if replace_document_id:
+            document = await loop.run_in_executor(None, knowledge_service.get_document, replace_document_id)
+            if not document or str(document.get('teamId')) != str(team_id):
+                raise HTTPException(status_code=404, detail="Documento não encontrado")
+
+        # Copiar o arquivo para disco em blocos (limite de tamanho verificado durante a cópia).
+        # A partir daqui o serviço é dono do arquivo e o apaga quando o job termina.
+        try:
+            file_content = await spool_upload(file, suffix=f'.{extension}')
+        except UploadTooLarge as e:
+            raise HTTPException(status_code=413, detail=str(e))
+
+        # Enfileirar e retornar na hora
+        if background:
+            try:
+                job = await knowledge_service.submit_document_async(
+                    team_id, file_content, filename,
+                    force=force, replace_document_id=replace_document_id, chunker=chunker
+                )
+            except IngestionQueueFull as e:
+                raise HTTPException(status_code=503, detail=str(e))
+
+            return JSONResponse(status_code=202, content={
+                "job_id": job.job_id,
+                "document_id": job.document_id,
+                "status": job.status,
+                "already_exists": bool(job.result and job.result.get('alreadyExists'))
+            })
+
+        # Processar documento (o job roda no pool de ingestão)
         result = await knowledge_service.process_document(
             team_id=team_id,
             file_content=file_content,
-            filename=filename
+            filename=filename,
+            force=force,
+            replace_document_id=replace_document_id,
+            chunker=chunker
         )
 
         if not result['success']:
@@ -52,7 +120,12 @@ async def upload_knowledge_document(
         return {
             "document_id": result['documentId'],
             "chunks_count": result['chunksCount'],
-            "word_count": result['wordCount']
+            "word_count": result['wordCount'],
+            "duplicate_chunks": result['duplicateChunks'],
+            "dedup_ratio": result['dedupRatio'],
+            "already_exists": result.get('alreadyExists', False),
+            "added_chunks": result.get('addedChunks', 0),
+            "removed_chunks": result.get('removedChunks', 0)
         }
 
     except HTTPException:
@@ -64,6 +137,125 @@ async def upload_knowledge_document(
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@router.post("/knowledge/upload/bulk")
+async def upload_knowledge_documents_bulk(
+    files: List[UploadFile] = File(...),
+    team_id: str = Form(...),
+    company_id: str = Form(...),
+    background: bool = Form(False),
+    force: bool = Form(False),
+    chunker: Optional[str] = Form(None)
+):
+    """
+    Upload em massa: vários arquivos e/ou arquivos ZIP (onboarding de uma equipe)
+
+    Os arquivos são processados em paralelo no pool de ingestão e os
+    índices da equipe são atualizados uma única vez, no fim do lote.
+    Arquivos com problema (tipo, tamanho, ZIP inválido) aparecem no
+    resultado com o erro, sem impedir os demais.
+
+    Args:
+        files: PDF, DOCX, XLSX, TXT ou ZIP com esses tipos (até
+            KNOWLEDGE_BULK_MAX_FILES arquivos, cada um até KNOWLEDGE_MAX_UPLOAD_MB)
+        team_id: ID da equipe
+        company_id: ID da empresa
+        background: True = retorna 202 com batch_id na hora (acompanhar em
+            GET /knowledge/batches/{batch_id}); False = aguarda o lote terminar
+        force: processa mesmo arquivos com conteúdo já existente na equipe
+        chunker: chunker configurado na equipe (como no upload individual)
+
+    Returns:
+        {
+            "batch_id": str,
+            "status": "running" | "done",
+            "files": [{filename, job_id, document_id, status, chunks_count, already_exists, error, ...}],
+            "succeeded": int,
+            "failed": int,
+            "elapsed_seconds": float
+        }
+    """
+    spooled = []
+    try:
+        loop = asyncio.get_running_loop()
+        entries = []
+
+        # Copiar cada arquivo para disco (ZIPs são abertos e cada arquivo de dentro vira um upload)
+        for file in files:
+            filename = file.filename or 'arquivo.txt'
+            extension = filename.split('.')[-1].lower() if '.' in filename else ''
+
+            if extension == 'zip':
+                try:
+                    archive = await spool_upload(file, suffix='.zip', max_bytes=MAX_BULK_UPLOAD_BYTES)
+                except UploadTooLarge as e:
+                    entries.append((filename, None, str(e)))
+                    continue
+                try:
+                    remaining = max(0, BULK_MAX_FILES - sum(1 for _, upload, _ in entries if upload is not None))
+                    extracted = await loop.run_in_executor(
+                        None, functools.partial(expand_zip, archive, SUPPORTED_EXTENSIONS, max_files=remaining)
+                    )
+                    spooled.extend(upload for _, upload, _ in extracted if upload is not None)
+                    entries.extend(extracted)
+                except zipfile.BadZipFile:
+                    entries.append((filename, None, "ZIP inválido"))
+                finally:
+                    archive.cleanup()
+                continue
+
+            if extension not in SUPPORTED_EXTENSIONS:
+                entries.append((filename, None, "Tipo de arquivo não suportado"))
+                continue
+            if sum(1 for _, upload, _ in entries if upload is not None) >= BULK_MAX_FILES:
+                entries.append((filename, None, f"Limite de {BULK_MAX_FILES} arquivos por upload"))
+                continue
+            try:
+                upload = await spool_upload(file, suffix=f'.{extension}')
+            except UploadTooLarge as e:
+                entries.append((filename, None, str(e)))
+                continue
+            spooled.append(upload)
+            entries.append((filename, upload, None))
+
+        if not entries:
+            raise HTTPException(status_code=400, detail="Nenhum arquivo enviado")
+
+        # A partir daqui o serviço é dono dos arquivos (apaga quando cada job termina),
+        # mesmo que a requisição seja cancelada enquanto o lote é enfileirado
+        knowledge_service = get_knowledge_service()
+        spooled = []
+        batch = await knowledge_service.submit_documents_async(team_id, entries, force=force, chunker=chunker)
+
+        if background:
+            return JSONResponse(status_code=202, content=batch.to_dict())
+
+        await batch.wait()
+        return batch.to_dict()
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"❌ Erro no upload em massa: {e}")
+        import traceback
+        traceback.print_exc()
+        raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        for upload in spooled:
+            upload.cleanup()
+
+
+@router.get("/knowledge/batches/{batch_id}")
+async def get_ingestion_batch(batch_id: str):
+    """Status de um upload em massa (mesmo formato da resposta de /knowledge/upload/bulk)"""
+    knowledge_service = get_knowledge_service()
+    batch = knowledge_service.get_batch(batch_id)
+
+    if batch is None:
+        raise HTTPException(status_code=404, detail="Lote não encontrado")
+
+    return batch.to_dict()
+
+
 @router.delete("/knowledge/documents/{document_id}")
 async def delete_knowledge_document(document_id: str):
     """
@@ -89,3 +281,78 @@ async def delete_knowledge_document(document_id: str):
     except Exception as e:
         print(f"❌ Erro ao deletar: {e}")
         raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.get("/knowledge/jobs/{job_id}")
+async def get_ingestion_job(job_id: str):
+    """
+    Status de um job de ingestão
+
+    Returns:
+        {
+            "job_id": str,
+            "document_id": str,
+            "status": "queued" | "running" | "done" | "failed",
+            "stage": str,
+            "progress": float,
+            "chunks_count": int,
+            "word_count": int,
+            "duplicate_chunks": int,
+            "error": str | None,
+            ...
+        }
+    """
+    knowledge_service = get_knowledge_service()
+    job = knowledge_service.get_job(job_id)
+
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job não encontrado")
+
+    return job.to_dict()
+
+
+@router.post("/knowledge/search-batch")
+async def search_knowledge_batch(request: SearchBatchRequest = Body(...)):
+    """
+    Busca várias queries de uma vez na knowledge base da equipe
+
+    Usado pelo modo hierárquico, playground e scripts de avaliação.
+
+    Returns:
+        {
+            "results": [[{content, similarity, metadata, documentId, chunkId}, ...], ...],
+            "total_queries": int
+        }
+    """
+    try:
+        if not request.queries:
+            raise HTTPException(status_code=400, detail="Informe pelo menos uma query")
+
+        knowledge_service = get_knowledge_service()
+        results = await knowledge_service.search_knowledge_batch_async(
+            team_id=request.team_id,
+            document_ids=request.document_ids,
+            queries=request.queries,
+            top_k=request.top_k,
+            ranker=request.ranker
+        )
+
+        return {
+            "results": results,
+            "total_queries": len(request.queries)
+        }
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"❌ Erro na busca em lote: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.get("/knowledge/cache/stats")
+async def knowledge_cache_stats():
+    """
+    Estatísticas dos caches da knowledge base (resultados, índices, chunk store)
+    """
+    knowledge_service = get_knowledge_service()
+    return knowledge_service.cache_stats()
@@ -0,0 +1,199 @@
+# llm_client_pool.py - Clientes ChatVertexAI reutilizados entre mensagens (LRU)
+
+import os
+import time
+import asyncio
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, Optional, Tuple
+
+# Clientes mantidos abertos (combinações de modelo/temperatura/tokens/região)
+LLM_CLIENT_POOL_SIZE = int(os.getenv('LLM_CLIENT_POOL_SIZE', '16'))
+
+ClientKey = Tuple[str, float, int, Optional[str], Optional[str]]
+
+
+def _create_vertex_client(model: str, temperature: float, max_output_tokens: int, location: Optional[str], project: Optional[str]):
+    from langchain_google_vertexai import ChatVertexAI
+    return ChatVertexAI(
+        model=model,
+        project=project,
+        location=location,
+        temperature=temperature,
+        max_output_tokens=max_output_tokens,
+    )
+
+
+class LLMClientPool:
+    """
+    Registro de clientes LLM compartilhados, chaveado por
+    (modelo, temperatura, max_output_tokens, região, projeto)
+
+    Criar um ChatVertexAI resolve credenciais e abre o canal com o Vertex
+    AI; reutilizando o cliente, as mensagens seguintes aproveitam a conexão
+    já aberta. Os clientes não guardam estado de conversa, então o mesmo
+    objeto atende chamadas simultâneas. Acima de `max_size` combinações, a
+    menos usada recentemente é descartada.
+
+    A criação roda fora do lock: cada chave em criação tem um Future, então
+    pedidos simultâneos da mesma combinação esperam o mesmo cliente e as
+    demais combinações não ficam bloqueadas. No código async, use `aget`.
+    """
+
+    def __init__(self, max_size: int = LLM_CLIENT_POOL_SIZE, factory: Callable[..., Any] = _create_vertex_client):
+        self.max_size = max(1, max_size)
+        self._factory = factory
+        self._clients: 'OrderedDict[ClientKey, Dict[str, Any]]' = OrderedDict()
+        self._pending: Dict[ClientKey, Future] = {}
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.create_seconds = 0.0
+
+    def make_key(
+        self,
+        model: str,
+        temperature: float,
+        max_output_tokens: int = 1024,
+        location: Optional[str] = None,
+        project: Optional[str] = None
+    ) -> ClientKey:
+        # Temperaturas vindas da configuração da equipe (0.7, "0.70", 0.7000001) viram a mesma chave
+        return (model, round(float(temperature), 2), int(max_output_tokens), location, project)
+
+    def _resolve_key(
+        self,
+        model: str,
+        temperature: float,
+        max_output_tokens: int,
+        location: Optional[str],
+        project: Optional[str]
+    ) -> ClientKey:
+        location = location if location is not None else os.getenv("GOOGLE_CLOUD_LOCATION")
+        project = project if project is not None else os.getenv("GOOGLE_CLOUD_PROJECT")
+        return self.make_key(model, temperature, max_output_tokens, location, project)
+
+    def _cached(self, key: ClientKey):
+        """Cliente já criado (conta como hit) ou None. Chamar com o lock"""
+        entry = self._clients.get(key)
+        if entry is None:
+            return None
+        self._clients.move_to_end(key)
+        entry['uses'] += 1
+        entry['lastUsedAt'] = time.time()
+        self.hits += 1
+        return entry['client']
+
+    def get(
+        self,
+        model: str,
+        temperature: float = 0.7,
+        max_output_tokens: int = 1024,
+        location: Optional[str] = None,
+        project: Optional[str] = None
+    ):
+        """
+        Cliente para a combinação pedida (criado na primeira vez)
+
+        Raises:
+            Exception: erro do construtor do cliente (credenciais, modelo inválido)
+        """
+        key = self._resolve_key(model, temperature, max_output_tokens, location, project)
+
+        with self._lock:
+            client = self._cached(key)
+            if client is not None:
+                return client
+            # Outra thread já está criando este cliente: esperar o mesmo (sem duplicar)
+            pending = self._pending.get(key)
+            creating = pending is None
+            if creating:
+                pending = self._pending[key] = Future()
+            else:
+                self.hits += 1
+
+        if not creating:
+            return pending.result()
+
+        started = time.monotonic()
+        try:
+            client = self._factory(key[0], key[1], key[2], key[3], key[4])
+        except BaseException as e:
+            with self._lock:
+                del self._pending[key]
+            pending.set_exception(e)
+            raise
+        elapsed = time.monotonic() - started
+
+        with self._lock:
+            del self._pending[key]
+            self.misses += 1
+            self.create_seconds += elapsed
+            self._clients[key] = {'client': client, 'uses': 1, 'createdAt': time.time(), 'lastUsedAt': time.time()}
+            while len(self._clients) > self.max_size:
+                evicted_key, _ = self._clients.popitem(last=False)
+                self.evictions += 1
+                print(f"♻️ Cliente LLM descartado (LRU): {evicted_key[0]}, temperature={evicted_key[1]}")
+        pending.set_result(client)
+
+        print(f"✅ Cliente LLM criado: {model}, temperature={key[1]} ({elapsed * 1000:.0f} ms)")
+        return client
+
+    async def aget(
+        self,
+        model: str,
+        temperature: float = 0.7,
+        max_output_tokens: int = 1024,
+        location: Optional[str] = None,
+        project: Optional[str] = None
+    ):
+        """get() para código async: só a criação (ou a espera por ela) vai para uma thread"""
+        key = self._resolve_key(model, temperature, max_output_tokens, location, project)
+        with self._lock:
+            client = self._cached(key)
+        if client is not None:
+            return client
+        return await asyncio.to_thread(self.get, model, temperature, max_output_tokens, location, project)
+
+    def clear(self):
+        with self._lock:
+            self._clients.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            requests = self.hits + self.misses
+            return {
+                'size': len(self._clients),
+                'maxSize': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hitRate': round(self.hits / requests, 3) if requests else 0.0,
+                'avgCreateMs': round(self.create_seconds / self.misses * 1000, 1) if self.misses else 0.0,
+                'clients': [
+                    {
+                        'model': key[0],
+                        'temperature': key[1],
+                        'maxOutputTokens': key[2],
+                        'location': key[3],
+                        'uses': entry['uses'],
+                        'lastUsedAt': entry['lastUsedAt'],
+                    }
+                    # Mais recente primeiro
+                    for key, entry in reversed(self._clients.items())
+                ],
+            }
+
+
+# Instância global (singleton)
+_llm_client_pool = None
+
+def get_llm_client_pool() -> LLMClientPool:
+    """Retorna instância singleton do pool de clientes LLM"""
+    global _llm_client_pool
+    if _llm_client_pool is None:
+        _llm_client_pool = LLMClientPool()
+    return _llm_client_pool
@@ -0,0 +1,151 @@
+# llm_concurrency.py - Chamadas ao LLM sem bloquear o event loop, com limite global e por tenant
+
+import os
+import time
+import asyncio
+import weakref
+import threading
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+# Chamadas simultâneas ao LLM no processo inteiro e por tenant (empresa)
+LLM_MAX_CONCURRENCY = int(os.getenv('LLM_MAX_CONCURRENCY', '32'))
+LLM_MAX_CONCURRENCY_PER_TENANT = int(os.getenv('LLM_MAX_CONCURRENCY_PER_TENANT', '4'))
+
+
+class LLMConcurrencyLimiter:
+    """
+    Limita as chamadas simultâneas ao LLM (Vertex AI)
+
+    Um tenant com muitas conversas ao mesmo tempo ocupa no máximo
+    `per_tenant` vagas; o total do processo fica em `max_concurrency`
+    (cota do Vertex AI). O slot do tenant é obtido antes do global, então
+    quem espera pelo próprio limite não segura vaga dos outros tenants.
+
+    Os semáforos são asyncio: criados sob demanda e usados só no event
+    loop do servidor. O de cada tenant só vive enquanto alguma chamada o
+    usa (WeakValueDictionary): parado, ele está com todas as vagas livres,
+    então recriá-lo depois é equivalente e tenants inativos não acumulam.
+    """
+
+    def __init__(self, max_concurrency: int = LLM_MAX_CONCURRENCY, per_tenant: int = LLM_MAX_CONCURRENCY_PER_TENANT):
+        self.max_concurrency = max(1, max_concurrency)
+        self.per_tenant = max(1, min(per_tenant, self.max_concurrency))
+        self._global: Optional[asyncio.Semaphore] = None
+        self._tenants: 'weakref.WeakValueDictionary[str, asyncio.Semaphore]' = weakref.WeakValueDictionary()
+        self._lock = threading.Lock()
+
+        # Estatísticas
+        self.in_flight = 0
+        self.waiting = 0
+        self.peak_in_flight = 0
+        self.calls = 0
+        self.errors = 0
+        self.wait_seconds = 0.0
+        self.call_seconds = 0.0
+        self._tenant_in_flight: Dict[str, int] = {}
+
+    def _semaphores(self, tenant_id: str) -> List[asyncio.Semaphore]:
+        with self._lock:
+            if self._global is None:
+                self._global = asyncio.Semaphore(self.max_concurrency)
+            tenant = self._tenants.get(tenant_id)
+            if tenant is None:
+                tenant = self._tenants[tenant_id] = asyncio.Semaphore(self.per_tenant)
+            return [tenant, self._global]
+
+    @asynccontextmanager
+    async def slot(self, tenant_id: Optional[str]):
+        """Vaga para uma chamada ao LLM (tenant primeiro, depois global)"""
+        tenant_id = str(tenant_id or 'default')
+        tenant, global_semaphore = self._semaphores(tenant_id)
+
+        self.waiting += 1
+        started = time.monotonic()
+        try:
+            await tenant.acquire()
+            try:
+                await global_semaphore.acquire()
+            except BaseException:
+                tenant.release()
+                raise
+        finally:
+            self.waiting -= 1
+        self.wait_seconds += time.monotonic() - started
+
+        self.in_flight += 1
+        self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        self._tenant_in_flight[tenant_id] = self._tenant_in_flight.get(tenant_id, 0) + 1
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+            self._tenant_in_flight[tenant_id] -= 1
+            if not self._tenant_in_flight[tenant_id]:
+                del self._tenant_in_flight[tenant_id]
+            global_semaphore.release()
+            tenant.release()
+
+    async def ainvoke(self, llm, messages: List[Any], tenant_id: Optional[str] = None) -> Any:
+        """
+        llm.ainvoke(messages) dentro do limite de concorrência
+
+        ChatVertexAI implementa a chamada assíncrona nativamente; um LLM sem
+        versão async cai no executor padrão do LangChain. Em nenhum caso o
+        event loop fica parado esperando o Gemini.
+        """
+        async with self.slot(tenant_id):
+            started = time.monotonic()
+            self.calls += 1
+            try:
+                return await llm.ainvoke(messages)
+            except Exception:
+                self.errors += 1
+                raise
+            finally:
+                self.call_seconds += time.monotonic() - started
+
+    async def astream(self, llm, messages: List[Any], tenant_id: Optional[str] = None) -> AsyncIterator[Any]:
+        """
+        llm.astream(messages) dentro do limite de concorrência
+
+        A vaga fica ocupada até o último chunk (ou até o consumidor parar de
+        ler, por exemplo quando o cliente do SSE desconecta).
+        """
+        async with self.slot(tenant_id):
+            started = time.monotonic()
+            self.calls += 1
+            try:
+                async for chunk in llm.astream(messages):
+                    yield chunk
+            except Exception:
+                self.errors += 1
+                raise
+            finally:
+                self.call_seconds += time.monotonic() - started
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'maxConcurrency': self.max_concurrency,
+            'maxConcurrencyPerTenant': self.per_tenant,
+            'inFlight': self.in_flight,
+            'waiting': self.waiting,
+            'peakInFlight': self.peak_in_flight,
+            'calls': self.calls,
+            'errors': self.errors,
+            'avgCallSeconds': round(self.call_seconds / self.calls, 3) if self.calls else 0.0,
+            'avgWaitSeconds': round(self.wait_seconds / self.calls, 3) if self.calls else 0.0,
+            'tenantsInFlight': dict(self._tenant_in_flight),
+            'tenantSemaphores': len(self._tenants),
+        }
+
+
+# Instância global (singleton)
+_llm_limiter = None
+
+def get_llm_limiter() -> LLMConcurrencyLimiter:
+    """Retorna instância singleton do limitador de chamadas ao LLM"""
+    global _llm_limiter
+    if _llm_limiter is None:
+        _llm_limiter = LLMConcurrencyLimiter()
+    return _llm_limiter
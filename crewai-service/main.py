@@ -1,6 +1,32 @@
 # api/src/atendimento_crewai/main.py - Ponto de entrada principal da nova API CrewAI
 
 import os
+import sys
+
+# `python main.py` sobe o servidor como `python -m uvicorn main:app`, antes de qualquer
+# inicialização: o app é importado como o módulo `main`, e os workers de extração
+# (forkserver) não reexecutam este arquivo, o que fariam com ele como script principal
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+    load_dotenv()
+
+    port = int(os.environ.get("PORT", 8000))
+    host = os.environ.get("HOST", "0.0.0.0")
+
+    print(f"🚀 Iniciando servidor em {host}:{port}")
+    print(f"📚 Documentação disponível em: http://{host}:{port}/docs")
+
+    args = [
+        sys.executable, "-m", "uvicorn", "main:app",
+        "--app-dir", os.path.dirname(os.path.abspath(__file__)),
+        "--host", host,
+        "--port", str(port),
+        "--log-level", "info"
+    ]
+    if os.environ.get("NODE_ENV") != "production":
+        args.append("--reload")
+    os.execv(sys.executable, args)
+
 from dotenv import load_dotenv
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
@@ -32,6 +58,7 @@ except Exception as e:
 # Imports dos routers
 from main_service import router as main_router
 from architect_service import router as architect_router
+from upload_spool import UploadSizeLimitMiddleware, MAX_BULK_UPLOAD_BYTES, MULTIPART_OVERHEAD
 
 # Criar aplicação FastAPI
 app = FastAPI(
@@ -42,6 +69,15 @@ app = FastAPI(
     redoc_url="/redoc"
 )
 
+# Uploads acima do limite são recusados enquanto o corpo chega, não depois de lido.
+# Adicionados antes do CORS (o último adicionado é o mais externo): o 413 sai com os headers de CORS
+app.add_middleware(UploadSizeLimitMiddleware, paths=["/api/v2/knowledge/upload"])
+app.add_middleware(
+    UploadSizeLimitMiddleware,
+    paths=["/api/v2/knowledge/upload/bulk"],
+    max_bytes=MAX_BULK_UPLOAD_BYTES + MULTIPART_OVERHEAD
+)
+
 # Configurar CORS
 app.add_middleware(
     CORSMiddleware,
@@ -156,22 +192,6 @@ async def global_exception_handler(request, exc):
         }
     )
 
-if __name__ == "__main__":
-    import uvicorn
-
-    port = int(os.environ.get("PORT", 8000))
-    host = os.environ.get("HOST", "0.0.0.0")
-
-    print(f"🚀 Iniciando servidor em {host}:{port}")
-    print(f"📚 Documentação disponível em: http://{host}:{port}/docs")
-
-    uvicorn.run(
-        "main:app",
-        host=host,
-        port=port,
-        reload=os.environ.get("NODE_ENV") != "production",
-        log_level="info"
-    )
 # Incluir router de knowledge base
 from knowledge_service_router import router as knowledge_router
 app.include_router(knowledge_router, prefix="/api/v2")
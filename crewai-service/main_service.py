@@ -1,8 +1,11 @@
 # api/src/atendimento_crewai/main_service.py - Serviço Principal da Nova API CrewAI
 
 from fastapi import APIRouter, HTTPException, Body
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 from typing import Dict, Any, List, Optional
+import asyncio
+import os
 import json
 import time
 from datetime import datetime
@@ -15,6 +18,9 @@ router = APIRouter()
 # Instância do motor CrewAI REAL (framework completo)
 crew_engine = RealCrewEngine()
 
+# Intervalo do comentário keep-alive no streaming (proxies fecham conexões paradas)
+SSE_KEEPALIVE_SECONDS = float(os.getenv('SSE_KEEPALIVE_SECONDS', '15'))
+
 class ProcessMessageRequest(BaseModel):
     tenantId: str
     crewId: str
@@ -42,9 +48,32 @@ async def health_check():
         "status": "healthy",
         "service": "CrewAI API",
         "timestamp": datetime.now().isoformat(),
-        "version": "2.0.0"
+        "version": "2.0.0",
+        "llm": crew_engine.llm_limiter.stats()
+    }
+
+@router.get("/llm/stats")
+async def llm_stats():
+    """Pool de clientes LLM, chamadas simultâneas, cache de respostas e roteador local de delegação"""
+    return {
+        "clients": crew_engine.llm_pool.stats(),
+        "concurrency": crew_engine.llm_limiter.stats(),
+        "responseCache": crew_engine.response_cache.stats(),
+        "delegationRouter": crew_engine.delegation_router.stats()
     }
 
+@router.delete("/cache/responses/{crew_id}")
+async def invalidate_response_cache(crew_id: str):
+    """
+    Descarta as respostas guardadas de uma equipe
+
+    Mudanças na configuração da equipe/agentes, na knowledge base, nos
+    exemplos de treinamento e nos arquivos dos agentes já geram chaves
+    novas; este endpoint libera a memória das respostas antigas na hora.
+    """
+    removed = crew_engine.response_cache.invalidate_team(crew_id)
+    return {"success": True, "removed": removed}
+
 @router.post("/process-message")
 async def process_message(request: ProcessMessageRequest = Body(...)):
     """
@@ -83,6 +112,86 @@ async def process_message(request: ProcessMessageRequest = Body(...)):
         print(f"Erro ao processar mensagem: {e}")
         raise HTTPException(status_code=500, detail=f"Erro interno: {str(e)}")
 
+def _format_sse(event: str, data: Dict[str, Any]) -> str:
+    """Evento no formato Server-Sent Events (data em JSON, uma linha)"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False, default=str)}\n\n"
+
+@router.post("/process-message/stream")
+async def process_message_stream(request: ProcessMessageRequest = Body(...)):
+    """
+    Processa uma mensagem respondendo em streaming (Server-Sent Events)
+
+    Mesmo corpo de /process-message. Eventos, na ordem:
+        agent: {agent, agent_id, process_type[, manager]} - agente escolhido
+        token: {text} - trechos da resposta conforme o LLM gera
+        done:  mesmo JSON de /process-message + time_to_first_token
+        error: {error} - falha inesperada (a conexão é encerrada em seguida)
+
+    O texto final é o `response` do evento done. Se o LLM falhar antes do
+    primeiro token, done traz a resposta padrão; se falhar depois que
+    tokens já foram enviados, o stream termina com error (sem done).
+    Se o cliente desconectar, o processamento é cancelado.
+    """
+    if not request.message or len(request.message.strip()) < 1:
+        raise HTTPException(status_code=400, detail="Mensagem é obrigatória")
+
+    if not request.tenantId or not request.crewId:
+        raise HTTPException(status_code=400, detail="TenantId e CrewId são obrigatórios")
+
+    start_time = time.time()
+    queue: asyncio.Queue = asyncio.Queue()
+    first_token = {}
+
+    def on_event(event: str, data: Dict[str, Any]):
+        if event == "token" and not first_token:
+            first_token['at'] = time.time()
+        queue.put_nowait((event, data))
+
+    async def run():
+        try:
+            result = await crew_engine.process_message(
+                tenant_id=request.tenantId,
+                crew_id=request.crewId,
+                message=request.message,
+                conversation_history=request.conversationHistory,
+                team_data=request.teamData,
+                agent_override=request.agentOverride,
+                contact_id=request.contactId,
+                on_event=on_event
+            )
+            result["processing_time"] = round(time.time() - start_time, 2)
+            result["time_to_first_token"] = round(first_token['at'] - start_time, 3) if first_token else None
+            result["timestamp"] = datetime.now().isoformat()
+            queue.put_nowait(("done", result))
+        except Exception as e:
+            print(f"Erro ao processar mensagem (stream): {e}")
+            queue.put_nowait(("error", {"error": f"Erro interno: {str(e)}"}))
+        finally:
+            queue.put_nowait(None)
+
+    async def events():
+        task = asyncio.create_task(run())
+        try:
+            while True:
+                try:
+                    item = await asyncio.wait_for(queue.get(), timeout=SSE_KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+                    continue
+                if item is None:
+                    break
+                yield _format_sse(*item)
+        finally:
+            # Cliente desconectou antes do fim: não gastar mais cota do LLM
+            if not task.done():
+                task.cancel()
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @router.get("/crews/{tenant_id}/{crew_id}/agents")
 async def get_crew_agents(tenant_id: str, crew_id: str):
     """
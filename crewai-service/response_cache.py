@@ -0,0 +1,303 @@
+# response_cache.py - Cache de respostas para perguntas repetidas (opt-in por equipe)
+
+import os
+import re
+import json
+import time
+import hashlib
+import threading
+import unicodedata
+from collections import OrderedDict
+from difflib import SequenceMatcher
+from typing import Any, Dict, List, Optional, Tuple
+
+# Padrões (cada equipe pode sobrescrever TTL e similaridade na configuração)
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv('RESPONSE_CACHE_MAX_ENTRIES', '5000'))
+RESPONSE_CACHE_TTL_SECONDS = float(os.getenv('RESPONSE_CACHE_TTL_SECONDS', '1800'))
+RESPONSE_CACHE_SIMILARITY = float(os.getenv('RESPONSE_CACHE_SIMILARITY', '0.92'))
+# Conversas com mais mensagens que isso não usam o cache (o histórico inteiro entra na chave)
+RESPONSE_CACHE_MAX_HISTORY = int(os.getenv('RESPONSE_CACHE_MAX_HISTORY', '4'))
+
+# Palavras que não mudam o sentido da pergunta ("qual é o horário?" = "qual o horario")
+_STOPWORDS = {
+    'o', 'a', 'os', 'as', 'um', 'uma', 'uns', 'umas', 'e', 'de', 'do', 'da', 'dos', 'das',
+    'em', 'no', 'na', 'nos', 'nas', 'por', 'para', 'pra', 'pro', 'com', 'que', 'se', 'me', 'te',
+    'voce', 'voces', 'vc', 'vcs', 'ai', 'ola', 'oi', 'favor', 'obrigado', 'obrigada', 'ok',
+    'entao', 'sera', 'poderia', 'pode', 'gostaria',
+}
+
+# Saudação no começo da mensagem ("boa tarde, qual o horário?")
+_GREETING_PATTERN = re.compile(r'^\W*(?:(?:bom dia|boa tarde|boa noite|ola|oi)\b\W*)+')
+
+# Referências ao que já foi dito: a resposta depende do histórico, não só da mensagem
+_CONTEXT_REFERENCES = {
+    'ele', 'ela', 'eles', 'elas', 'dele', 'dela', 'deles', 'delas', 'nele', 'nela',
+    'isso', 'isto', 'disso', 'disto', 'nisso', 'nisto', 'esse', 'essa', 'esses', 'essas',
+    'este', 'esta', 'estes', 'estas', 'desse', 'dessa', 'deste', 'desta', 'nesse', 'nessa',
+    'aquele', 'aquela', 'aquilo', 'daquele', 'daquela', 'daquilo', 'mesmo', 'mesma',
+    'anterior', 'acima', 'sim', 'nao', 'tambem', 'outro', 'outra', 'mais',
+}
+
+_TOKEN_PATTERN = re.compile(r'\w+')
+_DIGITS_PATTERN = re.compile(r'\d')
+
+
+def _strip_accents(text: str) -> str:
+    nfd = unicodedata.normalize('NFD', text)
+    return ''.join(char for char in nfd if unicodedata.category(char) != 'Mn').lower()
+
+
+def tokenize_message(message: str) -> List[str]:
+    """Palavras da mensagem sem acentos, pontuação e palavras de cortesia"""
+    tokens = _TOKEN_PATTERN.findall(_GREETING_PATTERN.sub('', _strip_accents(message or '')))
+    return [token for token in tokens if token not in _STOPWORDS]
+
+
+def _digest(value: Any) -> str:
+    payload = json.dumps(value, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+
+def _history_text(msg: Dict[str, Any]) -> Tuple[str, str]:
+    role = str(msg.get('role') or msg.get('sender') or '')
+    body = msg.get('content') if msg.get('content') is not None else msg.get('body', '')
+    return role, ' '.join(tokenize_message(str(body or '')))
+
+
+class ResponseCache:
+    """
+    Respostas já geradas, reaproveitadas para a mesma pergunta no mesmo contexto
+
+    A chave de contexto junta tudo que entra no prompt e muda a resposta:
+    configuração do agente e da equipe (modelo/temperatura), versão da
+    knowledge base da equipe, chunks recuperados para a mensagem, exemplos
+    de treinamento e arquivos do agente (buscados no backend) e o
+    histórico da conversa (curto, por causa de RESPONSE_CACHE_MAX_HISTORY).
+    Alterar a equipe, a KB, os exemplos ou os arquivos gera outra chave,
+    então as respostas antigas deixam de ser usadas sem precisar de aviso;
+    elas saem por TTL/LRU.
+
+    Dentro de um contexto, a mensagem normalizada (sem acentos, pontuação e
+    palavras de cortesia) é comparada primeiro por igualdade e depois por
+    similaridade (`similarity`), exigindo que cada palavra tenha par
+    parecido na outra mensagem e que os números sejam os mesmos - "preço
+    do produto X" não reaproveita a resposta do produto Y.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = RESPONSE_CACHE_MAX_ENTRIES,
+        ttl_seconds: float = RESPONSE_CACHE_TTL_SECONDS,
+        similarity: float = RESPONSE_CACHE_SIMILARITY,
+        max_history: int = RESPONSE_CACHE_MAX_HISTORY
+    ):
+        self.max_entries = max(1, max_entries)
+        self.ttl_seconds = ttl_seconds
+        self.similarity = similarity
+        self.max_history = max_history
+
+        # (team_id, context_key, mensagem normalizada) -> entrada; contextos -> mensagens (busca por similaridade)
+        self._entries: 'OrderedDict[Tuple[str, str, str], Dict[str, Any]]' = OrderedDict()
+        self._contexts: Dict[Tuple[str, str], set] = {}
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.similar_hits = 0
+        self.misses = 0
+        self.bypassed = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.saved_seconds = 0.0
+
+    def is_cacheable(self, message: str, conversation_history: Optional[List[Dict[str, Any]]]) -> bool:
+        """
+        False quando a resposta depende da conversa: histórico longo ou
+        mensagem que se refere ao que já foi dito ("e ele atende sábado?")
+        """
+        history = conversation_history or []
+        cacheable = bool(tokenize_message(message)) and len(history) <= self.max_history
+        if cacheable and history:
+            cacheable = not any(token in _CONTEXT_REFERENCES for token in _TOKEN_PATTERN.findall(_strip_accents(message)))
+        if not cacheable:
+            self.bypassed += 1
+        return cacheable
+
+    def context_key(
+        self,
+        agent_data: Dict[str, Any],
+        team_settings: Dict[str, Any],
+        knowledge_version: int,
+        knowledge_context: Optional[str],
+        conversation_history: Optional[List[Dict[str, Any]]],
+        resources: Optional[Dict[str, List[Dict[str, Any]]]] = None
+    ) -> str:
+        """
+        Hash de tudo que, além da mensagem, determina a resposta
+
+        resources: {'trainingExamples', 'agentFiles'} usados no prompt
+        """
+        history = [_history_text(msg) for msg in (conversation_history or [])[-self.max_history:]] if self.max_history else []
+        return _digest([
+            agent_data,
+            team_settings,
+            knowledge_version,
+            hashlib.sha1((knowledge_context or '').encode('utf-8')).hexdigest(),
+            history,
+            resources or {},
+        ])
+
+    def _similarity(self, tokens: List[str], candidate: List[str]) -> float:
+        if not tokens or not candidate:
+            return 0.0
+        if _DIGITS_PATTERN.findall(' '.join(tokens)) != _DIGITS_PATTERN.findall(' '.join(candidate)):
+            return 0.0
+        # Cada palavra precisa de par parecido (erro de digitação passa, palavra trocada não)
+        for left, right in ((tokens, candidate), (candidate, tokens)):
+            for token in left:
+                if token not in right and max(SequenceMatcher(None, token, other).ratio() for other in right) < 0.75:
+                    return 0.0
+        return SequenceMatcher(None, ' '.join(tokens), ' '.join(candidate)).ratio()
+
+    def get(self, team_id: str, context_key: str, message: str, similarity: Optional[float] = None) -> Optional[Dict[str, Any]]:
+        """
+        Resposta guardada para a mensagem (ou uma quase idêntica) neste contexto
+
+        Returns:
+            {'response', 'agentName', 'similarity', 'ageSeconds'} ou None
+        """
+        team_id = str(team_id)
+        tokens = tokenize_message(message)
+        normalized = ' '.join(tokens)
+        threshold = self.similarity if similarity is None else similarity
+        now = time.monotonic()
+
+        with self._lock:
+            key = (team_id, context_key, normalized)
+            entry = self._entries.get(key)
+            score = 1.0
+
+            if entry is None and threshold < 1.0:
+                best = None
+                for candidate in self._contexts.get((team_id, context_key), ()):
+                    candidate_score = self._similarity(tokens, candidate.split())
+                    if candidate_score >= threshold and (best is None or candidate_score > best[0]):
+                        best = (candidate_score, candidate)
+                if best is not None:
+                    score, key = best[0], (team_id, context_key, best[1])
+                    entry = self._entries[key]
+
+            if entry is not None and entry['expiresAt'] < now:
+                self._remove(key)
+                entry = None
+
+            if entry is None:
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            if score < 1.0:
+                self.similar_hits += 1
+            self.saved_seconds += entry['generationSeconds']
+            entry['hits'] += 1
+
+            return {
+                'response': entry['response'],
+                'agentName': entry['agentName'],
+                'similarity': round(score, 3),
+                'ageSeconds': round(now - entry['createdAt'], 1),
+            }
+
+    def set(
+        self,
+        team_id: str,
+        context_key: str,
+        message: str,
+        response: str,
+        agent_name: Optional[str] = None,
+        generation_seconds: float = 0.0,
+        ttl_seconds: Optional[float] = None
+    ):
+        normalized = ' '.join(tokenize_message(message))
+        if not normalized or not response:
+            return
+
+        team_id = str(team_id)
+        now = time.monotonic()
+        ttl = self.ttl_seconds if ttl_seconds is None else ttl_seconds
+        key = (team_id, context_key, normalized)
+
+        with self._lock:
+            self._entries[key] = {
+                'response': response,
+                'agentName': agent_name,
+                'createdAt': now,
+                'expiresAt': now + ttl,
+                'generationSeconds': generation_seconds,
+                'hits': 0,
+            }
+            self._entries.move_to_end(key)
+            self._contexts.setdefault((team_id, context_key), set()).add(normalized)
+
+            while len(self._entries) > self.max_entries:
+                evicted_key = next(iter(self._entries))
+                self._remove(evicted_key)
+                self.evictions += 1
+
+    def _remove(self, key: Tuple[str, str, str]):
+        del self._entries[key]
+        messages = self._contexts.get(key[:2])
+        if messages is not None:
+            messages.discard(key[2])
+            if not messages:
+                del self._contexts[key[:2]]
+
+    def invalidate_team(self, team_id: str) -> int:
+        """Descarta todas as respostas guardadas da equipe"""
+        team_id = str(team_id)
+        with self._lock:
+            keys = [key for key in self._entries if key[0] == team_id]
+            for key in keys:
+                self._remove(key)
+            self.invalidations += 1
+        if keys:
+            print(f"🧹 Cache de respostas da equipe {team_id} descartado ({len(keys)} respostas)")
+        return len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._contexts.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            teams: Dict[str, int] = {}
+            for team_id, _, _ in self._entries:
+                teams[team_id] = teams.get(team_id, 0) + 1
+            return {
+                'entries': len(self._entries),
+                'maxEntries': self.max_entries,
+                'ttlSeconds': self.ttl_seconds,
+                'similarity': self.similarity,
+                'hits': self.hits,
+                'similarHits': self.similar_hits,
+                'misses': self.misses,
+                'bypassed': self.bypassed,
+                'hitRate': round(self.hits / lookups, 3) if lookups else 0.0,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+                'savedLLMSeconds': round(self.saved_seconds, 1),
+                'teams': teams,
+            }
+
+
+# Instância global (singleton)
+_response_cache = None
+
+def get_response_cache() -> ResponseCache:
+    """Retorna instância singleton do cache de respostas"""
+    global _response_cache
+    if _response_cache is None:
+        _response_cache = ResponseCache()
+    return _response_cache
@@ -1,17 +1,82 @@
 # simple_knowledge_service.py - Knowledge Base com TF-IDF (sem PyTorch, GRATUITO)
 
 import os
+import codecs
+import asyncio
+import functools
 import hashlib
-from typing import List, Dict, Any, Optional
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed, TimeoutError as FuturesTimeoutError
+from typing import List, Dict, Any, Optional, Iterator, Iterable, Tuple, Union
 from datetime import datetime
 from google.cloud import firestore
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
-import numpy as np
-import PyPDF2
-import docx
-import pandas as pd
-import io
+from knowledge_index import KnowledgeIndex, KnowledgeIndexCache, build_index, reconcile_index, resolve_ranker
+from knowledge_chunk_store import LocalChunkStore
+from chunk_dedup import NearDuplicateLinker
+from bm25_index import tokenize
+from ttl_cache import TTLCache
+from ingestion_jobs import IngestionJob, IngestionBatch, IngestionQueue, IngestionQueueFull
+from document_extraction import DocumentExtractor, format_row_group
+from firestore_bulk import FirestoreBulkWriter, BulkWriteStats
+from text_chunker import iter_char_chunks, get_chunker, resolve_chunker
+from upload_spool import SpooledUpload
+
+
+def normalize_query(query: str) -> str:
+    """Normaliza a query para o cache: sem acentos, minúsculas, sem pontuação"""
+    return " ".join(tokenize(query))
+
+
+# Firestore limita o operador 'in' a 30 valores
+FIRESTORE_IN_LIMIT = 30
+
+# Campos que a busca realmente usa (projeção no Firestore)
+CHUNK_FIELDS = ['chunkId', 'documentId', 'chunkIndex', 'content', 'metadata', 'canonicalChunkId']
+
+# Chunks por lote gravado durante a ingestão (Firestore + store local)
+WRITE_BATCH_SIZE = int(os.getenv('KNOWLEDGE_WRITE_BATCH_SIZE', '400'))
+
+# Carimbo por equipe (versão incrementada a cada alteração da KB, por qualquer nó)
+TEAM_STATE_COLLECTION = 'knowledge_team_state'
+
+# Bytes de TXT decodificados por vez
+TXT_BLOCK_SIZE = 64 * 1024
+
+def _chunk_from_firestore(data: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        'chunkId': data['chunkId'],
+        'documentId': data['documentId'],
+        'chunkIndex': data.get('chunkIndex', 0),
+        'content': data['content'],
+        'metadata': data.get('metadata', {}),
+        'canonicalChunkId': data.get('canonicalChunkId')
+    }
+
+
+class _TextStats:
+    """Conta caracteres e palavras dos fragmentos conforme passam pelo pipeline"""
+
+    def __init__(self):
+        self.chars = 0
+        self.words = 0
+        self._ends_in_word = False
+
+    def add(self, fragment: str):
+        if fragment:
+            words = len(fragment.split())
+            # Palavra partida entre dois fragmentos conta uma vez só
+            if words and self._ends_in_word and not fragment[0].isspace():
+                words -= 1
+            self.chars += len(fragment)
+            self.words += words
+            self._ends_in_word = not fragment[-1].isspace()
+
+    def count(self, fragments: Iterable[str]) -> Iterator[str]:
+        for fragment in fragments:
+            self.add(fragment)
+            yield fragment
+
 
 class SimpleKnowledgeService:
     """
@@ -19,9 +84,12 @@ class SimpleKnowledgeService:
 
     Features:
     - Sem PyTorch (economia de disk space)
-    - TF-IDF para busca (entende relevância de termos)
+    - TF-IDF para busca (entende relevância de termos) ou BM25 com índice invertido
+    - Índice pré-calculado por equipe/conjunto de documentos (em disco, aberto via mmap, LRU por memória)
+    - Uploads/remoções atualizam os índices de forma incremental (segmentos + tombstones, compactação em segundo plano)
+    - Cache de resultados (LRU + TTL) para perguntas repetidas
     - Suporta PDF, DOCX, TXT, XLSX
-    - Armazena no Firestore
+    - Armazena no Firestore (fonte da verdade) + cópia local em SQLite para as buscas
     - 100% gratuito
     """
 
@@ -32,25 +100,78 @@ class SimpleKnowledgeService:
         credentials_path = os.path.join(os.path.dirname(__file__), 'atendechat-credentials.json')
         self.db = firestore.Client.from_service_account_json(credentials_path)
 
-        # TF-IDF Vectorizer (leve e rápido)
-        self.vectorizer = TfidfVectorizer(
-            max_features=1000,  # Top 1000 palavras
-            ngram_range=(1, 2),  # Uni e bigramas
-            stop_words=None,  # Vamos manter stopwords em português
-            max_df=0.85,
-            min_df=2
+        # Cópia local dos chunks (buscas não fazem stream do Firestore)
+        self.chunk_store = LocalChunkStore()
+
+        # Pool para buscar shards de document_ids no Firestore em paralelo
+        self.fetch_shard_timeout = float(os.getenv('KNOWLEDGE_FETCH_SHARD_TIMEOUT', '10'))
+        self.fetch_workers = int(os.getenv('KNOWLEDGE_FETCH_WORKERS', '8'))
+        self._fetch_executor = ThreadPoolExecutor(
+            max_workers=self.fetch_workers,
+            thread_name_prefix='kb-fetch'
+        )
+
+        # Escritas em massa no Firestore: batches de até 500 commitados em paralelo
+        self._write_executor = ThreadPoolExecutor(
+            max_workers=int(os.getenv('KNOWLEDGE_WRITE_WORKERS', '8')),
+            thread_name_prefix='kb-write'
         )
+        self.write_stats = BulkWriteStats()
+
+        # Extração de PDF/DOCX/XLSX em processos separados
+        self.extractor = DocumentExtractor()
+
+        # Ingestão de documentos em background (pool limitado)
+        self.ingestion_queue = IngestionQueue(
+            self._ingest_document,
+            max_workers=int(os.getenv('KNOWLEDGE_INGEST_WORKERS', '2')),
+            max_pending=int(os.getenv('KNOWLEDGE_INGEST_MAX_PENDING', '100'))
+        )
+
+        # Documentos com chunks sendo gravados (ainda não sincronizáveis)
+        self._ingesting: set = set()
+        # Uploads na fila/em execução por (team_id, hash do conteúdo)
+        self._pending_uploads: Dict[Tuple[str, str], IngestionJob] = {}
+        self._pending_uploads_lock = threading.Lock()
+
+        # Índices já construídos, por (team_id, documentos, ranker)
+        self.index_cache = KnowledgeIndexCache()
+
+        # Compactação dos índices incrementais roda em segundo plano
+        self._compact_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='kb-compact')
+        self._pending_compactions: set = set()
+
+        # Buscas rodam fora do event loop, num pool limitado
+        self._search_executor = ThreadPoolExecutor(
+            max_workers=int(os.getenv('KNOWLEDGE_SEARCH_WORKERS', '4')),
+            thread_name_prefix='kb-search'
+        )
+        # Um build por índice de cada vez (as outras threads esperam e reutilizam)
+        self._build_locks: Dict[tuple, threading.Lock] = {}
+        self._build_locks_guard = threading.Lock()
+
+        # Resultados de busca por (equipe, documentos, query normalizada, versão do índice)
+        self.result_cache = TTLCache(
+            max_entries=int(os.getenv('KNOWLEDGE_RESULT_CACHE_SIZE', '2048')),
+            ttl_seconds=float(os.getenv('KNOWLEDGE_RESULT_CACHE_TTL', '600'))
+        )
+        # Versão por equipe: incrementada a cada ingestão/remoção
+        self._team_versions: Dict[str, int] = {}
+        self._versions_lock = threading.Lock()
+
+        # Mudanças feitas fora deste processo: outros nós (carimbo da equipe no Firestore,
+        # conferido no máximo a cada KNOWLEDGE_REVALIDATE_SECONDS) e CLI de sync (store local)
+        self.revalidate_seconds = float(os.getenv('KNOWLEDGE_REVALIDATE_SECONDS', '30'))
+        self._revalidated = TTLCache(max_entries=10000, ttl_seconds=max(self.revalidate_seconds, 0.001))
+        self._store_data_version = self.chunk_store.data_version()
+        self._store_checked_at = time.time()
 
         print("✅ SimpleKnowledgeService inicializado!")
 
     def extract_text_from_pdf(self, file_content: bytes) -> str:
-        """Extrai texto de PDF"""
+        """Extrai texto de PDF (fatias de páginas em paralelo no pool de processos)"""
         try:
-            pdf_reader = PyPDF2.PdfReader(io.BytesIO(file_content))
-            text = ""
-            for page in pdf_reader.pages:
-                text += page.extract_text() + "\n"
-            return text
+            return self.extractor.extract_pdf(file_content)
         except Exception as e:
             print(f"❌ Erro ao extrair PDF: {e}")
             return ""
@@ -58,9 +179,7 @@ class SimpleKnowledgeService:
     def extract_text_from_docx(self, file_content: bytes) -> str:
         """Extrai texto de DOCX"""
         try:
-            doc = docx.Document(io.BytesIO(file_content))
-            text = "\n".join([paragraph.text for paragraph in doc.paragraphs])
-            return text
+            return self.extractor.extract_docx(file_content)
         except Exception as e:
             print(f"❌ Erro ao extrair DOCX: {e}")
             return ""
@@ -77,40 +196,12 @@ class SimpleKnowledgeService:
         """
         Extrai texto de XLSX preservando estrutura tabular
 
-        Processa todas as sheets do arquivo e preserva formato de tabela
-        para facilitar compreensão dos agentes.
+        Processa todas as sheets do arquivo (em paralelo, no pool de
+        processos, lidas linha a linha) e mantém o cabeçalho e as colunas
+        separadas por " | " para facilitar compreensão dos agentes.
         """
         try:
-            # Ler arquivo Excel
-            excel_file = pd.ExcelFile(io.BytesIO(file_content))
-            text_parts = []
-
-            print(f"📊 XLSX contém {len(excel_file.sheet_names)} sheet(s): {excel_file.sheet_names}")
-
-            # Processar cada sheet
-            for sheet_name in excel_file.sheet_names:
-                # Ler sheet como DataFrame
-                df = pd.read_excel(excel_file, sheet_name=sheet_name)
-
-                # Pular sheets vazias
-                if df.empty:
-                    print(f"⚠️ Sheet '{sheet_name}' está vazia, pulando...")
-                    continue
-
-                # Adicionar cabeçalho da sheet
-                text_parts.append(f"\n{'='*60}")
-                text_parts.append(f"PLANILHA: {sheet_name}")
-                text_parts.append(f"{'='*60}\n")
-
-                # Converter DataFrame para string preservando estrutura tabular
-                # to_string() mantém colunas alinhadas, melhor para agentes entenderem
-                table_text = df.to_string(index=False, na_rep='')
-                text_parts.append(table_text)
-                text_parts.append("\n")
-
-                print(f"✅ Sheet '{sheet_name}': {len(df)} linhas, {len(df.columns)} colunas")
-
-            result = "\n".join(text_parts)
+            result = self.extractor.extract_xlsx(file_content)
             print(f"📄 XLSX processado: {len(result)} caracteres")
 
             return result
@@ -137,244 +228,1297 @@ class SimpleKnowledgeService:
             print(f"⚠️ Tipo de arquivo não suportado: {extension}")
             return ""
 
-    def create_chunks(self, text: str, chunk_size: int = 1000, overlap: int = 200) -> List[str]:
-        """Divide texto em chunks com overlap"""
-        if not text:
-            return []
+    def iter_text(self, file_content: Union[bytes, SpooledUpload], filename: str) -> Iterator[str]:
+        """
+        Texto do documento em fragmentos, na ordem (concatenados = extract_text)
 
-        chunks = []
-        start = 0
-        text_length = len(text)
+        PDF sai página a página e XLSX sheet a sheet, sem montar o texto
+        inteiro; erros de extração são propagados. Um upload em disco é
+        aberto pelos workers pelo caminho (TXT é lido via mmap).
+        """
+        extension = filename.lower().split('.')[-1]
+        source = file_content.path if isinstance(file_content, SpooledUpload) else file_content
+
+        if extension == 'pdf':
+            yield from self.extractor.iter_pdf_pages(source)
+        elif extension in ['docx', 'doc']:
+            yield self.extractor.extract_docx(source)
+        elif extension == 'txt':
+            yield from self._iter_txt(file_content)
+        elif extension in ['xlsx', 'xls']:
+            yield from self.extractor.iter_xlsx(source)
+        else:
+            print(f"⚠️ Tipo de arquivo não suportado: {extension}")
 
-        while start < text_length:
-            end = start + chunk_size
-            chunk = text[start:end]
+    def _iter_txt(self, file_content: Union[bytes, SpooledUpload]) -> Iterator[str]:
+        if isinstance(file_content, SpooledUpload):
+            with file_content.mmap() as mapped:
+                yield from self._decode_blocks(mapped, file_content.size)
+        else:
+            yield from self._decode_blocks(file_content, len(file_content))
+
+    def _decode_blocks(self, content, size: int) -> Iterator[str]:
+        """UTF-8 decodificado de TXT_BLOCK_SIZE em TXT_BLOCK_SIZE bytes"""
+        decoder = codecs.getincrementaldecoder('utf-8')(errors='ignore')
+        for start in range(0, size, TXT_BLOCK_SIZE):
+            yield decoder.decode(content[start:start + TXT_BLOCK_SIZE])
+        yield decoder.decode(b'', final=True)
 
-            # Tentar quebrar no final de frase
-            if end < text_length:
-                last_period = chunk.rfind('.')
-                last_newline = chunk.rfind('\n')
-                break_point = max(last_period, last_newline)
+    def iter_chunks(self, fragments: Iterable[str], chunk_size: int = 1000, overlap: int = 200) -> Iterator[str]:
+        """Divide texto em chunks com overlap, lendo os fragmentos sob demanda"""
+        return iter_char_chunks(fragments, chunk_size, overlap)
+
+    def create_chunks(self, text: str, chunk_size: int = 1000, overlap: int = 200) -> List[str]:
+        """Divide texto em chunks com overlap"""
+        return list(self.iter_chunks([text], chunk_size, overlap))
 
-                if break_point > chunk_size * 0.7:  # Pelo menos 70% do chunk
-                    chunk = chunk[:break_point + 1]
-                    end = start + break_point + 1
+    def iter_document_chunks(
+        self,
+        file_content: Union[bytes, SpooledUpload],
+        filename: str,
+        chunker: Optional[str],
+        text_stats: _TextStats
+    ) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        """
+        (conteúdo, metadata) de cada chunk do documento, em streaming
 
-            chunks.append(chunk.strip())
-            start = end - overlap
+        XLSX vira grupos de linhas com o cabeçalho repetido (sheet e
+        intervalo de linhas na metadata), sem passar pelo chunker de texto;
+        os demais formatos usam o chunker da equipe.
+        """
+        extension = filename.lower().split('.')[-1]
 
-        return [c for c in chunks if len(c) > 50]  # Mínimo 50 chars
+        if extension in ['xlsx', 'xls']:
+            current_sheet = None
+            source = file_content.path if isinstance(file_content, SpooledUpload) else file_content
+            for group in self.extractor.iter_xlsx_row_groups(source):
+                # Estatísticas contam o cabeçalho uma vez por sheet, não por chunk
+                if group['sheet'] != current_sheet:
+                    current_sheet = group['sheet']
+                    text_stats.add(group['header'] + "\n")
+                text_stats.add(group['rows'] + "\n")
+                yield format_row_group(group), {
+                    'filename': filename,
+                    'sheet': group['sheet'],
+                    'rowStart': group['rowStart'],
+                    'rowEnd': group['rowEnd']
+                }
+            return
+
+        metadata = {'filename': filename}
+        for content in get_chunker(chunker)(text_stats.count(self.iter_text(file_content, filename))):
+            yield content, dict(metadata)
 
     def generate_document_id(self, team_id: str, filename: str) -> str:
         """Gera ID único para o documento"""
         hash_input = f"{team_id}_{filename}_{datetime.now().isoformat()}"
         return hashlib.md5(hash_input.encode()).hexdigest()
 
+    def get_document(self, document_id: str) -> Optional[Dict[str, Any]]:
+        """Registro do documento em knowledge_documents (None se não existir)"""
+        snapshot = self.db.collection('knowledge_documents').document(document_id).get()
+        return snapshot.to_dict() if snapshot.exists else None
+
+    def find_document_by_hash(self, team_id: str, content_hash: str) -> Optional[Dict[str, Any]]:
+        """Documento da equipe com o mesmo conteúdo (SHA-256 dos bytes), se existir"""
+        query = self.db.collection('knowledge_documents')\
+            .where('teamId', '==', str(team_id))\
+            .where('contentHash', '==', content_hash)\
+            .limit(1)
+        for doc in query.stream():
+            return doc.to_dict()
+        return None
+
+    def submit_document(
+        self,
+        team_id: str,
+        file_content: Union[bytes, SpooledUpload],
+        filename: str,
+        force: bool = False,
+        replace_document_id: Optional[str] = None,
+        chunker: Optional[str] = None,
+        update_index: bool = True
+    ) -> IngestionJob:
+        """
+        Enfileira a ingestão e retorna o job na hora (document_id já definido)
+
+        Se a equipe já tem um documento com o mesmo conteúdo (ou ele está na
+        fila), retorna esse documento sem reprocessar; force=True ingere de
+        novo como um documento novo.
+
+        Com replace_document_id, o arquivo é uma nova versão desse documento:
+        só os chunks que mudaram são gravados/removidos (ver _ingest_document).
+        O chunker (chars ou sentences) vem da configuração da equipe
+        (Team.knowledgeChunker, enviado pelo backend); sem configuração, uma
+        nova versão usa o mesmo chunker do documento e um documento novo usa
+        KNOWLEDGE_CHUNKER.
+
+        O arquivo vai para a fila em disco (SpooledUpload): bytes são
+        gravados num arquivo temporário. O serviço passa a ser dono do
+        upload e o apaga quando o job termina (ou na hora, se não enfileirar).
+
+        update_index=False deixa a atualização dos índices da equipe para
+        quem enfileirou (upload em massa: uma vez para o lote inteiro).
+
+        Raises:
+            IngestionQueueFull: muitos documentos pendentes
+        """
+        upload = file_content if isinstance(file_content, SpooledUpload) else SpooledUpload.from_bytes(
+            file_content, suffix='.' + filename.lower().split('.')[-1]
+        )
+        queued = False
+        try:
+            job, is_new = self._resolve_upload(str(team_id), upload, filename, force, replace_document_id, chunker, update_index)
+            # Job já resolvido ou já na fila (upload repetido): só espera por ele
+            if not is_new:
+                return job
+
+            try:
+                job = self.ingestion_queue.submit(job, upload)
+                queued = True
+                return job
+            except IngestionQueueFull:
+                self._release_upload(job)
+                raise
+        finally:
+            if not queued:
+                upload.cleanup()
+
+    async def submit_document_async(
+        self,
+        team_id: str,
+        file_content: Union[bytes, SpooledUpload],
+        filename: str,
+        force: bool = False,
+        replace_document_id: Optional[str] = None,
+        chunker: Optional[str] = None
+    ) -> IngestionJob:
+        """submit_document fora do event loop (a checagem de duplicado e a nova versão consultam o Firestore)"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            None,
+            functools.partial(
+                self.submit_document, team_id, file_content, filename,
+                force=force, replace_document_id=replace_document_id, chunker=chunker
+            )
+        )
+
+    def _resolve_upload(
+        self,
+        team_id: str,
+        upload: SpooledUpload,
+        filename: str,
+        force: bool,
+        replace_document_id: Optional[str],
+        chunker: Optional[str],
+        update_index: bool = True
+    ) -> Tuple[IngestionJob, bool]:
+        """
+        (job, True) para um job novo, que quem chamou deve enfileirar, ou
+        (job, False) para conteúdo repetido: o job pendente ou o documento
+        que já existe. Um job pendente nunca é enfileirado de novo.
+        """
+        content_hash = upload.content_hash
+        upload_key = (team_id, content_hash)
+
+        if replace_document_id:
+            existing = self.get_document(replace_document_id)
+            chunker = resolve_chunker(chunker or (existing or {}).get('chunker'))
+            if not force and existing and existing.get('contentHash') == content_hash:
+                print(f"♻️ {filename}: conteúdo igual à versão atual de {replace_document_id}")
+                job = IngestionJob(team_id, filename, replace_document_id, upload.size, content_hash, 'replace', chunker)
+                return self.ingestion_queue.complete(job, self._existing_result(existing, filename)), False
+
+            job = IngestionJob(team_id, filename, replace_document_id, upload.size, content_hash, 'replace', chunker, update_index)
+
+        else:
+            chunker = resolve_chunker(chunker)
+            if not force:
+                with self._pending_uploads_lock:
+                    pending = self._pending_uploads.get(upload_key)
+                if pending is not None:
+                    print(f"♻️ Upload repetido de {filename}: aguardando job {pending.job_id}")
+                    return pending, False
+
+                existing = self.find_document_by_hash(team_id, content_hash)
+                if existing:
+                    print(f"♻️ Upload repetido de {filename}: documento {existing['documentId']} já existe")
+                    job = IngestionJob(team_id, filename, existing['documentId'], upload.size, content_hash, chunker=chunker)
+                    return self.ingestion_queue.complete(job, self._existing_result(existing, filename)), False
+
+            job = IngestionJob(
+                team_id, filename, self.generate_document_id(team_id, filename),
+                upload.size, content_hash, chunker=chunker, update_index=update_index
+            )
+
+        with self._pending_uploads_lock:
+            pending = None if force or replace_document_id else self._pending_uploads.get(upload_key)
+            if pending is not None:
+                print(f"♻️ Upload repetido de {filename}: aguardando job {pending.job_id}")
+                return pending, False
+            self._pending_uploads.setdefault(upload_key, job)
+        return job, True
+
+    def submit_documents(
+        self,
+        team_id: str,
+        files: List[Tuple[str, Optional[SpooledUpload], Optional[str]]],
+        force: bool = False,
+        chunker: Optional[str] = None
+    ) -> IngestionBatch:
+        """
+        Enfileira vários arquivos de uma vez (upload em massa / ZIP)
+
+        Cada arquivo vira um job no pool de ingestão, que limita quantos
+        rodam ao mesmo tempo (KNOWLEDGE_INGEST_WORKERS). Os jobs não mexem
+        nos índices da equipe: quando o último termina, os índices são
+        atualizados uma única vez com todos os documentos novos.
+
+        Args:
+            files: [(nome, upload, erro)]; entradas com erro (upload None)
+                entram no resultado do lote sem virar job
+        """
+        team_id = str(team_id)
+        items = []
+        for filename, upload, error in files:
+            if upload is None:
+                items.append({'filename': filename, 'job': None, 'error': error})
+                continue
+            try:
+                job = self.submit_document(team_id, upload, filename, force=force, chunker=chunker, update_index=False)
+                items.append({'filename': filename, 'job': job, 'error': None})
+            except IngestionQueueFull as e:
+                items.append({'filename': filename, 'job': None, 'error': str(e)})
+
+        batch = IngestionBatch(team_id, items, self._finish_batch)
+        self.ingestion_queue.add_batch(batch)
+        print(f"📦 Upload em massa {batch.batch_id}: {len(batch.jobs())}/{len(items)} arquivo(s) enfileirado(s) (team={team_id})")
+        return batch
+
+    async def submit_documents_async(
+        self,
+        team_id: str,
+        files: List[Tuple[str, Optional[SpooledUpload], Optional[str]]],
+        force: bool = False,
+        chunker: Optional[str] = None
+    ) -> IngestionBatch:
+        """submit_documents fora do event loop (uma consulta ao Firestore por arquivo)"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            None, functools.partial(self.submit_documents, team_id, files, force=force, chunker=chunker)
+        )
+
+    def _finish_batch(self, batch: IngestionBatch):
+        """Último arquivo do lote terminou: uma atualização dos índices para todos"""
+        document_ids = list({
+            job.document_id for job in batch.jobs()
+            if job.result and job.result.get('success') and not job.result.get('alreadyExists')
+        })
+        if document_ids:
+            self._update_team_indexes(batch.team_id, document_ids)
+        print(f"✅ Upload em massa {batch.batch_id}: {len(document_ids)} documento(s) novo(s), índices atualizados uma vez")
+
+    def get_batch(self, batch_id: str) -> Optional[IngestionBatch]:
+        return self.ingestion_queue.get_batch(batch_id)
+
+    def _existing_result(self, existing: Dict[str, Any], filename: str) -> Dict[str, Any]:
+        return {
+            'success': True,
+            'documentId': existing['documentId'],
+            'filename': existing.get('filename', filename),
+            'chunksCount': existing.get('chunksCount', 0),
+            'wordCount': existing.get('wordCount', 0),
+            'duplicateChunks': existing.get('duplicateChunks', 0),
+            'dedupRatio': existing.get('dedupRatio', 0.0),
+            'alreadyExists': True
+        }
+
+    def _release_upload(self, job: IngestionJob):
+        with self._pending_uploads_lock:
+            if self._pending_uploads.get((job.team_id, job.content_hash)) is job:
+                del self._pending_uploads[(job.team_id, job.content_hash)]
+
+    def get_job(self, job_id: str) -> Optional[IngestionJob]:
+        return self.ingestion_queue.get(job_id)
+
     async def process_document(
         self,
         team_id: str,
-        file_content: bytes,
-        filename: str
+        file_content: Union[bytes, SpooledUpload],
+        filename: str,
+        force: bool = False,
+        replace_document_id: Optional[str] = None,
+        chunker: Optional[str] = None
     ) -> Dict[str, Any]:
         """
         Processa documento e salva no Firestore
 
+        A consulta de duplicados e a ingestão rodam fora do event loop;
+        aqui só aguardamos o job, então ele continua livre para as mensagens.
+
         Returns:
             {
                 'success': True,
                 'documentId': 'abc123',
                 'chunks': 15,
-                'wordCount': 1234
+                'wordCount': 1234,
+                'alreadyExists': False
             }
         """
         try:
-            print(f"📄 Processando documento: {filename}")
-
-            # 1. Extrair texto
-            text = self.extract_text(file_content, filename)
-            if not text:
-                return {'success': False, 'error': 'Não foi possível extrair texto'}
+            job = await self.submit_document_async(
+                team_id, file_content, filename,
+                force=force, replace_document_id=replace_document_id, chunker=chunker
+            )
+        except IngestionQueueFull as e:
+            return {'success': False, 'error': str(e)}
+        return await job.wait()
 
-            word_count = len(text.split())
-            print(f"📊 Texto extraído: {len(text)} chars, {word_count} palavras")
+    def _ingest_document(self, job: IngestionJob, file_content: SpooledUpload) -> Dict[str, Any]:
+        """
+        Worker da fila: extração, chunking, dedup, gravação e índices
+
+        Tudo em streaming: páginas viram fragmentos de texto, o chunker
+        consome os fragmentos (planilhas já saem em grupos de linhas) e os
+        chunks são gravados em lotes de
+        WRITE_BATCH_SIZE (Firestore + store local). Em memória ficam só as
+        páginas em extração e o lote atual, não o documento inteiro.
+
+        No modo replace (nova versão de um documento), cada chunk novo é
+        comparado pelo hash do conteúdo com os chunks atuais: os iguais são
+        mantidos (só o chunkIndex é atualizado se a posição mudou), só os
+        novos são gravados e os que sobraram são removidos. Os índices
+        recebem apenas essa diferença.
+        """
+        team_id = job.team_id
+        filename = job.filename
+        doc_id = job.document_id
+        replace = job.mode == 'replace'
+        written_batches = []
+        added_ids = []
+        previous: List[Dict[str, Any]] = []
+        # Chunks mantidos que mudaram de posição na nova versão: chunk_id -> novo chunkIndex
+        reindexed: Dict[str, int] = {}
+        writing = False
+        writer = self.bulk_writer(f"chunks de {filename}")
+        self._ingesting.add(doc_id)
+        try:
+            print(f"📄 Processando documento: {filename}" + (f" (nova versão de {doc_id})" if replace else ""))
+
+            # Chunks atuais por hash (modo replace)
+            revision = 0
+            if replace:
+                record = self.get_document(doc_id)
+                if not record or str(record.get('teamId')) != team_id:
+                    return {'success': False, 'error': 'Documento não encontrado'}
+                revision = record.get('revision', 0) + 1
+                previous = self._document_chunk_hashes(team_id, doc_id)
+
+            previous_by_hash: Dict[str, List[Dict[str, Any]]] = {}
+            for chunk in previous:
+                if chunk['contentHash']:
+                    previous_by_hash.setdefault(chunk['contentHash'], []).append(chunk)
+            previous_ids = {chunk['chunkId'] for chunk in previous}
+            kept_ids = set()
+
+            job.set_stage('extracting')
+            writing = True
+            text_stats = _TextStats()
+            chunks = self.iter_document_chunks(file_content, filename, job.chunker, text_stats)
+
+            # Chunks repetidos (mesmo texto normalizado: PDFs reenviados, trechos fixos) viram links.
+            # Chunks da versão anterior não servem de canônico: podem ser removidos no fim.
+            linker = NearDuplicateLinker(
+                lambda band_keys: {
+                    chunk_id: signature
+                    for chunk_id, signature in self.chunk_store.near_duplicate_candidates(team_id, band_keys).items()
+                    if chunk_id not in previous_ids
+                },
+                lambda chunk_ids: {
+                    chunk['chunkId']: chunk['content']
+                    for chunk in self.chunk_store.get_chunks(chunk_ids)
+                    if chunk is not None
+                }
+            )
+            chunks_count = 0
+            duplicates = 0
+            batch_chunks = []
+
+            for i, (chunk_content, chunk_metadata) in enumerate(chunks):
+                chunks_count += 1
+                content_hash = hashlib.sha256(chunk_content.encode('utf-8')).hexdigest()
+
+                # Chunk igual na versão anterior: mantido (conteúdo não é regravado)
+                same = previous_by_hash.get(content_hash)
+                if same:
+                    kept = same.pop(0)
+                    kept_ids.add(kept['chunkId'])
+                    if kept['chunkIndex'] != i:
+                        reindexed[kept['chunkId']] = i
+                    if kept['canonicalChunkId']:
+                        duplicates += 1
+                    continue
 
-            # 2. Criar chunks
-            chunks = self.create_chunks(text)
-            print(f"✂️ {len(chunks)} chunks criados")
+                chunk_id = f"{doc_id}_chunk_{i}_r{revision}" if replace else f"{doc_id}_chunk_{i}"
+                canonical_id = linker.link(chunk_id, chunk_content)
+                if canonical_id:
+                    duplicates += 1
 
-            # 3. Gerar document ID
-            doc_id = self.generate_document_id(team_id, filename)
+                batch_chunks.append({
+                    'chunkId': chunk_id,
+                    'documentId': doc_id,
+                    'chunkIndex': i,
+                    'content': '' if canonical_id else chunk_content,
+                    'metadata': chunk_metadata,
+                    'canonicalChunkId': canonical_id,
+                    'contentHash': content_hash,
+                    'wordCount': len(chunk_content.split())
+                })
+                if replace:
+                    added_ids.append(chunk_id)
+
+                if len(batch_chunks) >= WRITE_BATCH_SIZE:
+                    job.set_stage('saving', chunks_count=chunks_count, duplicate_chunks=duplicates, word_count=text_stats.words)
+                    written_batches.append(self._write_chunks(team_id, batch_chunks, writer))
+                    linker.forget_pending()
+                    batch_chunks = []
+
+            if batch_chunks:
+                job.set_stage('saving', chunks_count=chunks_count, duplicate_chunks=duplicates, word_count=text_stats.words)
+                written_batches.append(self._write_chunks(team_id, batch_chunks, writer))
+            if reindexed:
+                self._reindex_chunks(reindexed, writer)
+            writer.close()
+
+            if not text_stats.chars:
+                return {'success': False, 'error': 'Não foi possível extrair texto'}
 
-            # 4. Salvar metadados do documento
+            # Chunks da versão anterior que não existem mais
+            removed = [chunk for chunk in previous if chunk['chunkId'] not in kept_ids]
+            if removed:
+                relinked = self._remove_chunks(team_id, removed)
+                # Duplicados mantidos cujo canônico saiu viraram canônicos
+                duplicates -= sum(
+                    1 for chunk in relinked
+                    if chunk['chunkId'] in kept_ids and not chunk['canonicalChunkId']
+                )
+
+            word_count = text_stats.words
+            dedup_ratio = duplicates / chunks_count if chunks_count else 0.0
+            print(f"📊 Texto extraído: {text_stats.chars} chars, {word_count} palavras")
+            print(f"✂️ {chunks_count} chunks criados em {len(written_batches)} lote(s)")
+            if replace:
+                print(
+                    f"🔁 Nova versão: {len(kept_ids)} chunks mantidos ({len(reindexed)} mudaram de posição), "
+                    f"{sum(written_batches)} gravados, {len(removed)} removidos"
+                )
+            if duplicates:
+                print(f"🧬 {duplicates}/{chunks_count} chunks repetidos ({dedup_ratio:.0%}) ligados ao canônico")
+
+            # Metadados do documento (por último: contagens só existem no fim do stream)
+            job.set_stage('saving', chunks_count=chunks_count, word_count=word_count, duplicate_chunks=duplicates)
             doc_ref = self.db.collection('knowledge_documents').document(doc_id)
-            doc_ref.set({
-                'documentId': doc_id,
-                'teamId': team_id,
+            document_fields = {
                 'filename': filename,
                 'fileType': filename.split('.')[-1],
-                'fileSize': len(file_content),
-                'chunksCount': len(chunks),
+                'fileSize': file_content.size,
+                'contentHash': job.content_hash,
+                'chunksCount': chunks_count,
                 'wordCount': word_count,
-                'status': 'processed',
-                'uploadedAt': firestore.SERVER_TIMESTAMP,
+                'duplicateChunks': duplicates,
+                'dedupRatio': dedup_ratio,
+                'revision': revision,
+                'chunker': job.chunker,
                 'processedAt': firestore.SERVER_TIMESTAMP
-            })
-
-            # 5. Salvar chunks no Firestore
-            batch = self.db.batch()
-            for i, chunk_content in enumerate(chunks):
-                chunk_id = f"{doc_id}_chunk_{i}"
-                chunk_ref = self.db.collection('knowledge_chunks').document(chunk_id)
-
-                batch.set(chunk_ref, {
-                    'chunkId': chunk_id,
-                    'teamId': team_id,
+            }
+            if replace:
+                doc_ref.update(document_fields)
+            else:
+                doc_ref.set({
                     'documentId': doc_id,
-                    'chunkIndex': i,
-                    'content': chunk_content,
-                    'wordCount': len(chunk_content.split()),
-                    'metadata': {
-                        'filename': filename,
-                        'totalChunks': len(chunks)
-                    },
-                    'createdAt': firestore.SERVER_TIMESTAMP
+                    'teamId': team_id,
+                    'status': 'processed',
+                    'uploadedAt': firestore.SERVER_TIMESTAMP,
+                    **document_fields
                 })
+            self.chunk_store.finish_document(team_id, doc_id, chunks_count)
+            self._touch_team(team_id)
 
-            batch.commit()
+            # Índices da equipe recebem só os chunks novos/removidos (sem refit)
+            job.set_stage('indexing')
+            if job.update_index:
+                self._update_team_indexes(team_id, [doc_id])
             print(f"✅ Documento processado: {doc_id}")
 
             return {
                 'success': True,
                 'documentId': doc_id,
                 'filename': filename,
-                'chunksCount': len(chunks),
-                'wordCount': word_count
+                'chunksCount': chunks_count,
+                'wordCount': word_count,
+                'duplicateChunks': duplicates,
+                'dedupRatio': dedup_ratio,
+                'addedChunks': sum(written_batches),
+                'removedChunks': len(removed),
+                'alreadyExists': False
             }
 
         except Exception as e:
             print(f"❌ Erro ao processar documento: {e}")
             import traceback
             traceback.print_exc()
+            # Lotes já gravados não podem ficar órfãos (inclusive os que o Firestore
+            # confirmou antes de o erro chegar aqui, por isso a busca pelo documentId)
+            try:
+                writer.close()
+            except Exception:
+                pass
+            if writing and writer.operations:
+                try:
+                    if replace:
+                        self._rollback_new_version(team_id, doc_id, previous, added_ids, reindexed)
+                    else:
+                        self._delete_document(doc_id)
+                except Exception as cleanup_error:
+                    print(f"❌ Erro ao desfazer a ingestão de {doc_id}: {cleanup_error}")
+                    traceback.print_exc()
             return {'success': False, 'error': str(e)}
 
+        finally:
+            self._ingesting.discard(doc_id)
+            self._release_upload(job)
+            file_content.cleanup()
+
+    def _rollback_new_version(
+        self,
+        team_id: str,
+        document_id: str,
+        previous: List[Dict[str, Any]],
+        added_ids: List[str],
+        reindexed: Dict[str, int]
+    ):
+        """
+        Nova versão que falhou: remove os chunks novos já gravados e devolve
+        aos chunks mantidos a posição antiga (a versão anterior continua valendo)
+
+        Os chunks novos são procurados no store local e no Firestore: um
+        lote pode ter sido confirmado lá sem chegar ao store local.
+        """
+        previous_ids = {chunk['chunkId'] for chunk in previous}
+        new_chunks = {chunk['chunkId']: chunk for chunk in self.chunk_store.get_chunks(added_ids) if chunk}
+        for chunk in self._document_chunk_hashes(team_id, document_id):
+            if chunk['chunkId'] not in previous_ids:
+                new_chunks[chunk['chunkId']] = chunk
+        if new_chunks:
+            self._remove_chunks(team_id, list(new_chunks.values()))
+
+        if reindexed:
+            writer = self.bulk_writer(f"posições de {document_id}")
+            try:
+                self._reindex_chunks(
+                    {chunk['chunkId']: chunk['chunkIndex'] for chunk in previous if chunk['chunkId'] in reindexed},
+                    writer
+                )
+            finally:
+                writer.close()
+        print(f"↩️ Nova versão de {document_id} desfeita: {len(new_chunks)} chunk(s) removido(s)")
+
+    def _document_chunk_hashes(self, team_id: str, document_id: str) -> List[Dict[str, Any]]:
+        """
+        Chunks atuais do documento com o hash do conteúdo
+
+        Chunks gravados antes do contentHash usam o hash do próprio conteúdo
+        (duplicados antigos não têm conteúdo: ficam sem hash e são regravados).
+        """
+        query = self.db.collection('knowledge_chunks')\
+            .where('teamId', '==', team_id)\
+            .where('documentId', '==', document_id)\
+            .select(['chunkId', 'chunkIndex', 'content', 'canonicalChunkId', 'contentHash'])
+
+        chunks = []
+        for doc in query.stream():
+            data = doc.to_dict()
+            content_hash = data.get('contentHash')
+            if not content_hash and not data.get('canonicalChunkId'):
+                content_hash = hashlib.sha256(data.get('content', '').encode('utf-8')).hexdigest()
+            chunks.append({
+                'chunkId': data['chunkId'],
+                'chunkIndex': data.get('chunkIndex', 0),
+                'content': data.get('content', ''),
+                'canonicalChunkId': data.get('canonicalChunkId'),
+                'contentHash': content_hash
+            })
+        return chunks
+
+    def bulk_writer(self, label: str = 'escrita') -> FirestoreBulkWriter:
+        """Writer em massa no Firestore (batches paralelos com retry)"""
+        return FirestoreBulkWriter(self.db, self._write_executor, self.write_stats, label=label)
+
+    def _write_chunks(self, team_id: str, chunks: List[Dict[str, Any]], writer: FirestoreBulkWriter) -> int:
+        """Grava um lote de chunks no Firestore (duplicados guardam só o link) e no store local"""
+        for chunk in chunks:
+            chunk_ref = self.db.collection('knowledge_chunks').document(chunk['chunkId'])
+            writer.set(chunk_ref, {
+                'chunkId': chunk['chunkId'],
+                'teamId': team_id,
+                'documentId': chunk['documentId'],
+                'chunkIndex': chunk['chunkIndex'],
+                'content': chunk['content'],
+                'canonicalChunkId': chunk['canonicalChunkId'],
+                'contentHash': chunk['contentHash'],
+                'wordCount': chunk['wordCount'],
+                'metadata': chunk['metadata'],
+                'createdAt': firestore.SERVER_TIMESTAMP
+            })
+
+        # Write-through no chunk store local
+        self.chunk_store.append_chunks(team_id, chunks)
+        return len(chunks)
+
+    def _reindex_chunks(self, chunk_indexes: Dict[str, int], writer: FirestoreBulkWriter):
+        """Posição nova de chunks mantidos numa nova versão (Firestore + store local)"""
+        for chunk_id, chunk_index in chunk_indexes.items():
+            writer.update(self.db.collection('knowledge_chunks').document(chunk_id), {'chunkIndex': chunk_index})
+        self.chunk_store.set_chunk_indexes(chunk_indexes)
+
+    def _remove_chunks(self, team_id: str, chunks: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Remove chunks (Firestore + store local), promovendo antes os
+        duplicados que apontavam para eles
+
+        Returns:
+            Chunks religados/promovidos
+        """
+        removed_ids = {chunk['chunkId'] for chunk in chunks}
+        canonical_contents = {
+            chunk['chunkId']: chunk['content']
+            for chunk in chunks
+            if not chunk.get('canonicalChunkId')
+        }
+
+        writer = self.bulk_writer(f"remoção de {len(chunks)} chunks")
+        try:
+            # Promoções gravadas antes de apagar os canônicos
+            relinked = self._promote_duplicates(canonical_contents, removed_ids, writer)
+            writer.flush()
+
+            for chunk in chunks:
+                writer.delete(self.db.collection('knowledge_chunks').document(chunk['chunkId']))
+        finally:
+            writer.close()
+
+        self.chunk_store.delete_chunks(list(removed_ids))
+        if relinked:
+            self.chunk_store.relink_chunks(team_id, relinked)
+        return relinked
+
     def search_knowledge(
         self,
         team_id: str,
         document_ids: Optional[List[str]],
         query: str,
-        top_k: int = 3
+        top_k: int = 3,
+        ranker: Optional[str] = None
     ) -> List[Dict[str, Any]]:
         """
-        Busca chunks relevantes usando TF-IDF
+        Busca chunks relevantes usando TF-IDF (padrão) ou BM25
 
         Args:
             team_id: ID da equipe
             document_ids: IDs dos documentos para buscar (None = todos)
             query: Query de busca
             top_k: Número de resultados
+            ranker: 'tfidf' ou 'bm25' (None = KNOWLEDGE_RANKER)
 
         Returns:
             Lista de chunks relevantes com score
         """
         try:
-            print(f"🔍 Buscando knowledge: team={team_id}, docs={document_ids}, query='{query[:50]}'")
+            ranker = resolve_ranker(ranker)
+            self._revalidate(team_id)
+            print(f"🔍 Buscando knowledge: team={team_id}, docs={document_ids}, ranker={ranker}, query='{query[:50]}'")
+
+            # 0. Cache de resultados (perguntas repetidas: "qual o horário?", "onde fica?")
+            cache_key = (
+                str(team_id),
+                tuple(sorted(set(document_ids))) if document_ids else None,
+                normalize_query(query),
+                top_k,
+                ranker,
+                self.team_version(team_id)
+            )
+            cached = self.result_cache.get(cache_key)
+            if cached is not None:
+                print(f"⚡ Cache hit: {len(cached)} chunks")
+                return [dict(result) for result in cached]
+
+            # 1. Índice pré-calculado (ou construído agora a partir do chunk store)
+            index = self._get_index(team_id, document_ids, ranker)
+
+            if index is None:
+                self.result_cache.set(cache_key, [])
+                return []
 
-            # 1. Buscar chunks no Firestore
-            chunks_query = self.db.collection('knowledge_chunks').where('teamId', '==', team_id)
+            # 2. Ranking (TF-IDF: transform + produto esparso; BM25: posting lists + argpartition)
+            ranked = index.search(query, top_k)
 
-            if document_ids:
-                chunks_query = chunks_query.where('documentId', 'in', document_ids)
+            # 3. Preparar resultados (conteúdo vem do chunk store, o índice só guarda ids)
+            results = self._build_results(index, [ranked])[0]
+            self.result_cache.set(cache_key, results)
+
+            print(f"✅ {len(results)} chunks relevantes encontrados")
+            for i, r in enumerate(results[:3]):
+                print(f"  [{i+1}] Score: {r['similarity']:.3f} - {r['content'][:80]}...")
+
+            return results
 
-            chunks = list(chunks_query.stream())
+        except Exception as e:
+            print(f"❌ Erro na busca: {e}")
+            import traceback
+            traceback.print_exc()
+            return []
 
-            if not chunks:
-                print("📭 Nenhum chunk encontrado")
+    async def search_knowledge_async(
+        self,
+        team_id: str,
+        document_ids: Optional[List[str]],
+        query: str,
+        top_k: int = 3,
+        ranker: Optional[str] = None
+    ) -> List[Dict[str, Any]]:
+        """search_knowledge executado no pool de busca (não bloqueia o event loop)"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._search_executor,
+            functools.partial(self.search_knowledge, team_id, document_ids, query, top_k, ranker)
+        )
+
+    async def search_knowledge_batch_async(
+        self,
+        team_id: str,
+        document_ids: Optional[List[str]],
+        queries: List[str],
+        top_k: int = 3,
+        ranker: Optional[str] = None
+    ) -> List[List[Dict[str, Any]]]:
+        """search_knowledge_batch executado no pool de busca"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._search_executor,
+            functools.partial(self.search_knowledge_batch, team_id, document_ids, queries, top_k, ranker)
+        )
+
+    def search_knowledge_batch(
+        self,
+        team_id: str,
+        document_ids: Optional[List[str]],
+        queries: List[str],
+        top_k: int = 3,
+        ranker: Optional[str] = None
+    ) -> List[List[Dict[str, Any]]]:
+        """
+        Busca várias queries de uma vez no mesmo conjunto de documentos
+
+        Todas as queries são pontuadas num único produto esparso
+        (queries x termos) @ (termos x chunks) e os chunks de todos os
+        resultados são lidos do store numa única consulta.
+
+        Returns:
+            Uma lista de resultados (mesmo formato de search_knowledge) por query
+        """
+        try:
+            ranker = resolve_ranker(ranker)
+            self._revalidate(team_id)
+            print(f"🔍 Busca em lote: team={team_id}, docs={document_ids}, ranker={ranker}, queries={len(queries)}")
+
+            if not queries:
                 return []
 
-            print(f"📦 {len(chunks)} chunks encontrados")
+            index = self._get_index(team_id, document_ids, ranker)
 
-            # 2. Extrair conteúdo dos chunks
-            chunk_contents = []
-            chunk_data = []
+            if index is None:
+                return [[] for _ in queries]
 
-            for doc in chunks:
-                data = doc.to_dict()
-                chunk_contents.append(data['content'])
-                chunk_data.append({
-                    'chunkId': data['chunkId'],
-                    'documentId': data['documentId'],
-                    'content': data['content'],
-                    'metadata': data.get('metadata', {})
-                })
+            ranked_lists = index.search_batch(queries, top_k)
+            results = self._build_results(index, ranked_lists)
 
-            # 3. TF-IDF: Criar matriz de features
-            try:
-                # Fit vectorizer nos chunks + query
-                tfidf_matrix = self.vectorizer.fit_transform(chunk_contents + [query])
-
-                # Separar query vector
-                query_vector = tfidf_matrix[-1]
-                chunk_vectors = tfidf_matrix[:-1]
-
-                # Calcular similaridade coseno
-                similarities = cosine_similarity(query_vector, chunk_vectors)[0]
-
-            except Exception as e:
-                print(f"⚠️ Erro no TF-IDF, usando busca keyword: {e}")
-                # Fallback: busca keyword simples
-                query_words = set(query.lower().split())
-                similarities = []
-                for content in chunk_contents:
-                    content_words = set(content.lower().split())
-                    # Jaccard similarity
-                    intersection = len(query_words & content_words)
-                    union = len(query_words | content_words)
-                    sim = intersection / union if union > 0 else 0
-                    similarities.append(sim)
-                similarities = np.array(similarities)
-
-            # 4. Ordenar por similaridade
-            top_indices = np.argsort(similarities)[::-1][:top_k]
-
-            # 5. Preparar resultados
-            results = []
-            for idx in top_indices:
-                if True:  # Sempre incluir, ordenado por relevância
-                    results.append({
-                        'content': chunk_data[idx]['content'],
-                        'similarity': float(similarities[idx]),
-                        'metadata': chunk_data[idx]['metadata'],
-                        'documentId': chunk_data[idx]['documentId'],
-                        'chunkId': chunk_data[idx]['chunkId']
+            print(f"✅ Lote concluído: {sum(len(r) for r in results)} chunks em {len(queries)} queries")
+            return results
+
+        except Exception as e:
+            print(f"❌ Erro na busca em lote: {e}")
+            import traceback
+            traceback.print_exc()
+            return [[] for _ in queries]
+
+    def _build_results(self, index: KnowledgeIndex, ranked_lists: List[List[tuple]]) -> List[List[Dict[str, Any]]]:
+        """Converte [(posição, score)] em resultados, lendo cada chunk do store uma única vez"""
+        chunk_ids = list({
+            index.chunk_ids[idx]
+            for ranked in ranked_lists
+            for idx, _ in ranked
+        })
+        chunks_by_id = dict(zip(chunk_ids, self.chunk_store.get_chunks(chunk_ids)))
+
+        results = []
+        for ranked in ranked_lists:
+            query_results = []
+            for idx, score in ranked:
+                chunk = chunks_by_id.get(index.chunk_ids[idx])
+                if chunk:  # Sempre incluir, ordenado por relevância
+                    query_results.append({
+                        'content': chunk['content'],
+                        'similarity': score,
+                        'metadata': chunk['metadata'],
+                        'documentId': chunk['documentId'],
+                        'chunkId': chunk['chunkId']
                     })
+            results.append(query_results)
+        return results
 
-            print(f"✅ {len(results)} chunks relevantes encontrados")
-            for i, r in enumerate(results[:3]):
-                print(f"  [{i+1}] Score: {r['similarity']:.3f} - {r['content'][:80]}...")
+    def _get_index(self, team_id: str, document_ids: Optional[List[str]], ranker: str) -> Optional[KnowledgeIndex]:
+        """
+        Retorna o índice em cache ou constrói a partir do chunk store local
 
-            return results
+        Índices são imutáveis depois de construídos: uma busca em andamento
+        continua usando o snapshot que pegou, mesmo que a equipe seja
+        invalidada no meio. Um índice construído a partir de uma versão que
+        ficou velha durante o build é usado nesta busca mas não entra no cache.
+        """
+        index = self.index_cache.get(team_id, document_ids, ranker)
+        if index is not None:
+            print(f"⚡ Índice em cache: {len(index)} chunks")
+            return index
+
+        with self._build_lock(team_id, document_ids, ranker):
+            # Outra thread pode ter construído enquanto esperávamos
+            index = self.index_cache.get(team_id, document_ids, ranker)
+            if index is not None:
+                print(f"⚡ Índice em cache: {len(index)} chunks")
+                return index
+
+            self._sync_missing(team_id, document_ids)
+            version = self.team_version(team_id)
+            if document_ids:
+                index = self._derive_index(team_id, document_ids, ranker)
+
+            if index is None:
+                chunk_data = self.chunk_store.load_chunks(team_id, document_ids)
+
+                if not chunk_data:
+                    print("📭 Nenhum chunk encontrado")
+                    return None
+
+                print(f"📦 {len(chunk_data)} chunks encontrados, construindo índice...")
+
+                index = build_index(chunk_data, ranker)
+
+            with self._versions_lock:
+                if self.team_version(team_id) != version:
+                    print(f"⚠️ team={team_id} mudou durante o build, índice não será guardado")
+                    return index
+                return self.index_cache.put(team_id, document_ids, ranker, index)
 
+    def _derive_index(self, team_id: str, document_ids: List[str], ranker: str) -> Optional[KnowledgeIndex]:
+        """
+        Deriva o índice de um conjunto de documentos parecido já indexado
+        (ex: agente ganhou a lista de preços nova): os chunks que faltam
+        viram segmento e os que sobram viram tombstones.
+        Retorna None se não houver base boa o suficiente.
+        """
+        requested = set(document_ids)
+        best_key = None
+        best_overlap = 0
+        for key in self.index_cache.team_keys(team_id):
+            if key[2] != ranker or key[1] is None:
+                continue
+            overlap = len(requested & set(key[1]))
+            if overlap > best_overlap:
+                best_key, best_overlap = key, overlap
+
+        if best_key is None:
+            return None
+
+        base_documents = set(best_key[1])
+        base = self.index_cache.get(team_id, list(base_documents), ranker)
+        if base is None:
+            return None
+
+        index = reconcile_index(base, self.chunk_store.load_chunks(team_id, document_ids))
+        if index is None or index.needs_compaction():
+            return None
+
+        print(
+            f"🧩 Índice derivado de outro conjunto: +{len(requested - base_documents)} "
+            f"/ -{len(base_documents - requested)} documento(s)"
+        )
+        return index
+
+    def _build_lock(self, team_id: str, document_ids: Optional[List[str]], ranker: str) -> threading.Lock:
+        key = self.index_cache.make_key(team_id, document_ids, ranker)
+        with self._build_locks_guard:
+            return self._build_locks.setdefault(key, threading.Lock())
+
+    def _sync_missing(self, team_id: str, document_ids: Optional[List[str]]):
+        """Busca no Firestore apenas o que ainda não foi sincronizado neste nó"""
+        if document_ids:
+            # Documentos em ingestão ainda estão sendo gravados por este nó
+            missing = [
+                document_id for document_id in self.chunk_store.missing_documents(team_id, document_ids)
+                if document_id not in self._ingesting
+            ]
+            # Duplicados apontam para chunks de outros documentos: esses também são trazidos
+            while missing:
+                print(f"☁️ {len(missing)} documento(s) ausentes no store local, buscando no Firestore...")
+                fetched, failed = self._fetch_chunks_from_firestore(team_id, missing)
+                for document_id in missing:
+                    # Shards que falharam não são gravados (senão ficariam marcados como vazios)
+                    if document_id not in failed:
+                        self.chunk_store.put_document(team_id, document_id, fetched.get(document_id, []))
+
+                canonical_documents = {
+                    chunk['canonicalChunkId'].rsplit('_chunk_', 1)[0]
+                    for chunks in fetched.values()
+                    for chunk in chunks
+                    if chunk.get('canonicalChunkId')
+                }
+                missing = self.chunk_store.missing_documents(team_id, sorted(canonical_documents - failed))
+        elif not self.chunk_store.is_team_synced(team_id):
+            self.sync_team(team_id)
+
+    def _fetch_chunks_from_firestore(
+        self,
+        team_id: str,
+        document_ids: Optional[List[str]] = None
+    ) -> Tuple[Dict[str, List[Dict[str, Any]]], set]:
+        """
+        Busca chunks no Firestore agrupados por documentId
+
+        Returns:
+            (documentos, document_ids cujos shards falharam)
+        """
+        documents: Dict[str, List[Dict[str, Any]]] = {}
+        failed: set = set()
+
+        for chunk in self._stream_chunks_from_firestore(team_id, document_ids, failed):
+            documents.setdefault(chunk['documentId'], []).append(chunk)
+
+        return documents, failed
+
+    def _chunks_query(self, team_id: str, document_ids: Optional[List[str]] = None):
+        chunks_query = self.db.collection('knowledge_chunks').where('teamId', '==', team_id)
+
+        if document_ids:
+            chunks_query = chunks_query.where('documentId', 'in', document_ids)
+
+        return chunks_query.select(CHUNK_FIELDS)
+
+    def _stream_chunks_from_firestore(
+        self,
+        team_id: str,
+        document_ids: Optional[List[str]],
+        failed: set
+    ) -> Iterator[Dict[str, Any]]:
+        """
+        Stream dos chunks com projeção dos campos usados
+
+        Com document_ids, divide em shards de até 30 ids (limite do 'in'),
+        executa os shards em paralelo e entrega os chunks na ordem em que
+        cada shard termina. Shards com erro/timeout entram em `failed`.
+        """
+        if not document_ids:
+            for doc in self._chunks_query(team_id).stream():
+                yield _chunk_from_firestore(doc.to_dict())
+            return
+
+        shards = [
+            document_ids[i:i + FIRESTORE_IN_LIMIT]
+            for i in range(0, len(document_ids), FIRESTORE_IN_LIMIT)
+        ]
+
+        def fetch_shard(shard: List[str]) -> List[Dict[str, Any]]:
+            query = self._chunks_query(team_id, shard)
+            return [
+                _chunk_from_firestore(doc.to_dict())
+                for doc in query.stream(timeout=self.fetch_shard_timeout)
+            ]
+
+        futures = {self._fetch_executor.submit(fetch_shard, shard): shard for shard in shards}
+        waves = -(-len(shards) // self.fetch_workers)
+        pending = set(futures)
+
+        try:
+            for future in as_completed(futures, timeout=self.fetch_shard_timeout * waves + 1):
+                pending.discard(future)
+                shard = futures[future]
+                try:
+                    yield from future.result()
+                except Exception as e:
+                    print(f"⚠️ Erro ao buscar shard de {len(shard)} documento(s) no Firestore: {e}")
+                    failed.update(shard)
+        except FuturesTimeoutError:
+            for future in pending:
+                future.cancel()
+                failed.update(futures[future])
+            print(f"⚠️ Timeout em {len(pending)} shard(s) do Firestore")
+
+        if len(shards) > 1:
+            print(f"☁️ {len(shards)} shards buscados em paralelo ({len(failed)} documento(s) com falha)")
+
+    def sync_team(self, team_id: str) -> Dict[str, Any]:
+        """Reconcilia o store local de uma equipe com o Firestore"""
+        print(f"🔄 Sincronizando chunk store local: team={team_id}")
+        # Carimbo lido antes: mudanças durante a busca geram outro e a equipe é conferida de novo
+        stamp = self._read_team_stamp(team_id)
+        documents, _ = self._fetch_chunks_from_firestore(team_id)
+        self.chunk_store.replace_team(team_id, documents, stamp)
+        self._invalidate_team(team_id)
+
+        chunks_count = sum(len(chunks) for chunks in documents.values())
+        print(f"✅ team={team_id}: {len(documents)} documentos, {chunks_count} chunks sincronizados")
+        return {'teamId': str(team_id), 'documents': len(documents), 'chunks': chunks_count}
+
+    def sync_all_teams(self) -> List[Dict[str, Any]]:
+        """Reconcilia todas as equipes que têm documentos no Firestore (nós frios)"""
+        team_ids = {
+            doc.to_dict().get('teamId')
+            for doc in self.db.collection('knowledge_documents').select(['teamId']).stream()
+        }
+        return [self.sync_team(team_id) for team_id in sorted(t for t in team_ids if t)]
+
+    def team_version(self, team_id: str) -> int:
+        return self._team_versions.get(str(team_id), 0)
+
+    def _team_state_ref(self, team_id: str):
+        return self.db.collection(TEAM_STATE_COLLECTION).document(str(team_id))
+
+    def _read_team_stamp(self, team_id: str) -> Optional[int]:
+        """Carimbo atual da equipe no Firestore (0 = nunca alterada; None = erro na leitura)"""
+        try:
+            snapshot = self._team_state_ref(team_id).get()
         except Exception as e:
-            print(f"❌ Erro na busca: {e}")
+            print(f"⚠️ Erro ao ler o carimbo de team={team_id}: {e}")
+            return None
+        return (snapshot.to_dict() or {}).get('version', 0) if snapshot.exists else 0
+
+    def _touch_team(self, team_id: str):
+        """KB da equipe alterada por este nó: incrementa o carimbo para os outros nós revalidarem"""
+        team_id = str(team_id)
+        try:
+            self._team_state_ref(team_id).set({
+                'teamId': team_id,
+                'version': firestore.Increment(1),
+                'updatedAt': firestore.SERVER_TIMESTAMP
+            }, merge=True)
+        except Exception as e:
+            print(f"⚠️ Erro ao atualizar o carimbo de team={team_id}: {e}")
+            return
+        # Sem outra mudança no meio, o store local já reflete o carimbo novo (não precisa ressincronizar)
+        stamp = self._read_team_stamp(team_id)
+        if stamp is not None:
+            self.chunk_store.advance_team_stamp(team_id, stamp)
+
+    def _revalidate(self, team_id: str):
+        """
+        Descarta o que este processo sabe da equipe quando a KB mudou fora dele
+
+        - Outro processo no mesmo store local (CLI de sync): o SQLite avisa
+          (data_version) e as equipes que ele gravou são invalidadas.
+        - Outro nó: o carimbo da equipe no Firestore (uma leitura, no máximo
+          a cada KNOWLEDGE_REVALIDATE_SECONDS) difere do que o store local
+          reflete; os documentos da equipe voltam a ser buscados sob demanda.
+        """
+        team_id = str(team_id)
+        data_version = self.chunk_store.data_version()
+        now = time.time()
+        with self._versions_lock:
+            changed = data_version != self._store_data_version
+            since = self._store_checked_at - 1
+            self._store_data_version = data_version
+            self._store_checked_at = now
+        if changed:
+            for changed_team in self.chunk_store.teams_synced_since(since):
+                print(f"🔄 Store local de team={changed_team} alterado por outro processo")
+                self._invalidate_team(changed_team)
+
+        if self.revalidate_seconds <= 0 or self._revalidated.get(team_id):
+            return
+        self._revalidated.set(team_id, True)
+
+        stamp = self._read_team_stamp(team_id)
+        if stamp is None or self.chunk_store.team_stamp(team_id) == stamp:
+            return
+        print(f"🔄 team={team_id} alterada fora deste nó (carimbo {stamp}), store local será ressincronizado")
+        self.chunk_store.mark_team_stale(team_id, stamp)
+        self._invalidate_team(team_id)
+
+    def _update_team_indexes(self, team_id: str, document_ids: List[str]):
+        """
+        Documentos adicionados/removidos: atualiza os índices da equipe de
+        forma incremental (segmento novo / tombstones) em vez de descartá-los
+
+        Cada índice afetado é reconciliado com o chunk store (que já reflete
+        a mudança, inclusive duplicados promovidos) uma vez, qualquer que
+        seja a quantidade de documentos. Índices de um conjunto fixo de
+        documentos que não inclui nenhum deles continuam válidos.
+        Quando um índice acumula tombstones ou chunks fora do fit demais, a
+        compactação (rebuild) é agendada em segundo plano.
+        """
+        team_id = str(team_id)
+        to_compact = []
+
+        with self._versions_lock:
+            self._team_versions[team_id] = self.team_version(team_id) + 1
+
+            for _, docs_key, ranker in self.index_cache.team_keys(team_id):
+                if docs_key is not None and not any(document_id in docs_key for document_id in document_ids):
+                    continue
+
+                index_documents = list(docs_key) if docs_key else None
+                try:
+                    index = self.index_cache.get(team_id, index_documents, ranker)
+                    updated = reconcile_index(index, self.chunk_store.load_chunks(team_id, index_documents)) if index is not None else None
+                except Exception as e:
+                    print(f"⚠️ Erro na atualização incremental do índice, será reconstruído: {e}")
+                    updated = None
+
+                if updated is None:
+                    self.index_cache.discard(team_id, index_documents, ranker)
+                    continue
+
+                self.index_cache.put(team_id, index_documents, ranker, updated)
+                if updated.needs_compaction():
+                    to_compact.append((index_documents, ranker))
+
+        self.result_cache.invalidate(lambda key: key[0] == team_id)
+
+        for document_ids, ranker in to_compact:
+            self._schedule_compaction(team_id, document_ids, ranker)
+
+    def _schedule_compaction(self, team_id: str, document_ids: Optional[List[str]], ranker: str):
+        key = self.index_cache.make_key(team_id, document_ids, ranker)
+        with self._build_locks_guard:
+            if key in self._pending_compactions:
+                return
+            self._pending_compactions.add(key)
+        self._compact_executor.submit(self._compact_index, team_id, document_ids, ranker)
+
+    def _compact_index(self, team_id: str, document_ids: Optional[List[str]], ranker: str, max_attempts: int = 3):
+        """Reconstrói do zero um índice incremental (refit do vocabulário/IDF)"""
+        key = self.index_cache.make_key(team_id, document_ids, ranker)
+        try:
+            for _ in range(max_attempts):
+                with self._build_lock(team_id, document_ids, ranker):
+                    version = self.team_version(team_id)
+                    chunk_data = self.chunk_store.load_chunks(team_id, document_ids)
+                    index = build_index(chunk_data, ranker) if chunk_data else None
+
+                    with self._versions_lock:
+                        if self.team_version(team_id) != version:
+                            continue  # equipe mudou durante o rebuild, tentar de novo
+                        if index is None:
+                            self.index_cache.discard(team_id, document_ids, ranker)
+                        else:
+                            self.index_cache.put(team_id, document_ids, ranker, index)
+
+                print(f"🧹 Índice compactado: team={team_id}, ranker={ranker}, {len(chunk_data)} chunks")
+                return
+        except Exception as e:
+            print(f"❌ Erro na compactação do índice: {e}")
             import traceback
             traceback.print_exc()
-            return []
+        finally:
+            with self._build_locks_guard:
+                self._pending_compactions.discard(key)
+
+    def _invalidate_team(self, team_id: str):
+        """Conteúdo da equipe mudou: nova versão, índices e resultados antigos descartados"""
+        team_id = str(team_id)
+        with self._versions_lock:
+            self._team_versions[team_id] = self.team_version(team_id) + 1
+            self.index_cache.invalidate_team(team_id)
+        self.result_cache.invalidate(lambda key: key[0] == team_id)
+        with self._build_locks_guard:
+            for key in [key for key, lock in self._build_locks.items() if key[0] == team_id and not lock.locked()]:
+                del self._build_locks[key]
+
+    def cache_stats(self) -> Dict[str, Any]:
+        return {
+            'results': self.result_cache.stats(),
+            'indexes': self.index_cache.stats(),
+            'chunkStore': self.chunk_store.stats(),
+            'ingestion': self.ingestion_queue.stats(),
+            'writes': self.write_stats.to_dict(),
+        }
+
+    def _promote_duplicates(self, canonical_contents: Dict[str, str], removed_ids: set, writer: FirestoreBulkWriter) -> List[Dict[str, Any]]:
+        """
+        Antes de remover chunks canônicos, o primeiro duplicado de cada um
+        (que não esteja sendo removido junto) recebe o conteúdo e vira o novo
+        canônico; os demais passam a apontar para ele. As alterações entram
+        no writer.
+
+        Returns:
+            Chunks alterados ({chunkId, content, canonicalChunkId}) para o store local
+        """
+        canonical_ids = list(canonical_contents)
+        links: Dict[str, List[Any]] = {}
+        for i in range(0, len(canonical_ids), FIRESTORE_IN_LIMIT):
+            query = self.db.collection('knowledge_chunks')\
+                .where('canonicalChunkId', 'in', canonical_ids[i:i + FIRESTORE_IN_LIMIT])
+            for link in query.stream():
+                data = link.to_dict()
+                if data['chunkId'] not in removed_ids:
+                    links.setdefault(data['canonicalChunkId'], []).append((link, data))
+
+        relinked = []
+        for canonical_id, group in links.items():
+            group.sort(key=lambda item: (item[1]['documentId'], item[1].get('chunkIndex', 0)))
+            (promoted, promoted_data), others = group[0], group[1:]
+            content = canonical_contents[canonical_id]
+
+            writer.update(promoted.reference, {'content': content, 'canonicalChunkId': None})
+            relinked.append({'chunkId': promoted_data['chunkId'], 'content': content, 'canonicalChunkId': None})
+
+            for link, data in others:
+                writer.update(link.reference, {'canonicalChunkId': promoted_data['chunkId']})
+                relinked.append({'chunkId': data['chunkId'], 'content': '', 'canonicalChunkId': promoted_data['chunkId']})
+
+        if links:
+            print(f"🧬 {len(links)} chunk(s) duplicado(s) promovido(s) a canônico")
+        return relinked
 
     async def delete_document(self, document_id: str) -> bool:
-        """Deleta documento e todos seus chunks"""
+        """Deleta documento e todos seus chunks (fora do event loop)"""
+        return await asyncio.get_running_loop().run_in_executor(None, self._delete_document, document_id)
+
+    def _delete_document(self, document_id: str) -> bool:
         try:
+            doc_ref = self.db.collection('knowledge_documents').document(document_id)
+            doc_snapshot = doc_ref.get()
+            team_id = doc_snapshot.to_dict().get('teamId') if doc_snapshot.exists else None
+
             # Deletar documento
-            self.db.collection('knowledge_documents').document(document_id).delete()
+            doc_ref.delete()
+
+            # Deletar chunks (duplicados de outros documentos que apontavam para eles são promovidos)
+            chunks = []
+            for chunk in self.db.collection('knowledge_chunks').where('documentId', '==', document_id).stream():
+                data = chunk.to_dict()
+                team_id = team_id or data.get('teamId')
+                chunks.append({
+                    'chunkId': chunk.id,
+                    'content': data.get('content', ''),
+                    'canonicalChunkId': data.get('canonicalChunkId')
+                })
 
-            # Deletar chunks
-            chunks = self.db.collection('knowledge_chunks')\
-                .where('documentId', '==', document_id)\
-                .stream()
+            if chunks:
+                self._remove_chunks(team_id, chunks)
 
-            batch = self.db.batch()
-            for chunk in chunks:
-                batch.delete(chunk.reference)
-            batch.commit()
+            team_id = self.chunk_store.delete_document(document_id) or team_id
+            if team_id:
+                self._touch_team(team_id)
+                self._update_team_indexes(team_id, [document_id])
 
             print(f"🗑️ Documento {document_id} deletado")
             return True
@@ -0,0 +1,236 @@
+# sparse_index_files.py - Formato em disco e estrutura base dos índices da Knowledge Base
+
+import os
+import json
+import mmap
+import shutil
+import sys
+import threading
+from typing import Dict, Any, List, Tuple, Optional, Iterable
+import numpy as np
+from scipy.sparse import csr_matrix
+
+META_FILENAME = 'meta.json'
+
+
+def save_index_files(path: str, arrays: Dict[str, np.ndarray], meta: Dict[str, Any]):
+    """
+    Grava o índice em um diretório: um .npy por array + meta.json
+
+    A escrita acontece num diretório temporário renomeado no final, então
+    um leitor nunca vê um índice pela metade. Arrays que já vieram de um
+    .npy via mmap (segmentos antigos de um índice incremental) são
+    reaproveitados com hard link em vez de regravados.
+    """
+    tmp_path = f"{path}.tmp-{os.getpid()}-{threading.get_ident()}"
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+
+    for name, array in arrays.items():
+        target = os.path.join(tmp_path, f"{name}.npy")
+        if _is_npy_mmap(array):
+            try:
+                os.link(array.filename, target)
+                continue
+            except OSError:
+                pass
+        np.save(target, np.ascontiguousarray(array))
+
+    with open(os.path.join(tmp_path, META_FILENAME), 'w', encoding='utf-8') as f:
+        json.dump(meta, f, ensure_ascii=False)
+
+    shutil.rmtree(path, ignore_errors=True)
+    os.replace(tmp_path, path)
+
+
+def _is_npy_mmap(array: np.ndarray) -> bool:
+    """Array aberto inteiro via np.load(mmap_mode='r') (não é uma fatia)"""
+    return (
+        isinstance(array, np.memmap)
+        and isinstance(array.base, mmap.mmap)
+        and bool(array.filename)
+        and os.path.exists(array.filename)
+    )
+
+
+def load_index_files(path: str, names: Tuple[str, ...]) -> Tuple[Dict[str, np.ndarray], Dict[str, Any]]:
+    """Abre os arrays via mmap (somente leitura) - nada é copiado para a RAM"""
+    with open(os.path.join(path, META_FILENAME), 'r', encoding='utf-8') as f:
+        meta = json.load(f)
+
+    arrays = {
+        name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode='r')
+        for name in names
+    }
+    return arrays, meta
+
+
+def terms_table(terms: List[str]) -> np.ndarray:
+    """Tabela de vocabulário ordenada (largura fixa, pesquisável via mmap)"""
+    return np.array(sorted(terms), dtype=str) if terms else np.array([], dtype='<U1')
+
+
+def lookup_term_rows(terms: np.ndarray, tokens: List[str]) -> List[int]:
+    """Linha de cada token na tabela de vocabulário (-1 se não existir)"""
+    if not tokens or len(terms) == 0:
+        return [-1] * len(tokens)
+
+    positions = np.searchsorted(terms, np.array(tokens, dtype=str))
+    rows = []
+    for token, position in zip(tokens, positions.tolist()):
+        rows.append(position if position < len(terms) and terms[position] == token else -1)
+    return rows
+
+
+def estimate_nbytes(arrays: Dict[str, np.ndarray], chunk_ids: List[str]) -> int:
+    """Bytes ocupados pelo índice (arrays + lista de chunk ids em Python)"""
+    return (
+        sum(array.nbytes for array in arrays.values())
+        + sys.getsizeof(chunk_ids)
+        + sum(sys.getsizeof(chunk_id) for chunk_id in chunk_ids)
+    )
+
+
+def select_top_k(
+    docs: np.ndarray,
+    scores: np.ndarray,
+    top_k: int,
+    pad_candidates: Optional[Iterable[int]] = None
+) -> List[Tuple[int, float]]:
+    """
+    Seleção parcial (argpartition) só entre os chunks com score
+
+    Com pad_candidates, completa o top_k com esses chunks (score 0).
+    """
+    if top_k <= 0:
+        return []
+    if top_k < len(scores):
+        candidates = np.argpartition(-scores, top_k - 1)[:top_k]
+    else:
+        candidates = np.arange(len(scores))
+    ordered = candidates[np.argsort(-scores[candidates], kind='stable')]
+    results = [(int(docs[i]), float(scores[i])) for i in ordered]
+
+    if pad_candidates is not None and len(results) < top_k:
+        matched = set(docs.tolist())
+        for doc_idx in pad_candidates:
+            if len(results) >= top_k:
+                break
+            if doc_idx not in matched:
+                results.append((int(doc_idx), 0.0))
+
+    return results
+
+
+def split_rows(scores: csr_matrix) -> List[Tuple[np.ndarray, np.ndarray]]:
+    """(posições, scores) de cada linha de uma matriz de scores CSR"""
+    return [
+        (
+            scores.indices[scores.indptr[i]:scores.indptr[i + 1]],
+            scores.data[scores.indptr[i]:scores.indptr[i + 1]]
+        )
+        for i in range(scores.shape[0])
+    ]
+
+
+class PostingsIndex:
+    """
+    Base dos índices: posting lists em CSR (termo x chunk) com peso pré-calculado
+
+    - terms: vocabulário ordenado (linha t = terms[t])
+    - postings_indptr[t]:postings_indptr[t+1] delimita a lista do termo t
+    - postings_docs: posição do chunk
+    - postings_weights: contribuição do termo para o score do chunk
+
+    O score de uma query é a soma ponderada das linhas dos seus termos,
+    então N queries viram um único produto esparso Q (queries x termos)
+    por P (termos x chunks). As subclasses só definem como construir os
+    pesos e como vetorizar a query.
+    """
+
+    ranker = ''
+    ARRAYS: Tuple[str, ...] = ('terms', 'postings_indptr', 'postings_docs', 'postings_weights')
+
+    # Completar o top_k com chunks de score 0 (comportamento original do TF-IDF)
+    pad_results = False
+
+    def __init__(self, chunk_ids: List[str], arrays: Dict[str, np.ndarray], params: Dict[str, Any]):
+        self.chunk_ids = chunk_ids
+        self.arrays = arrays
+        self.params = params
+        self.persistent = True
+
+        self.terms = arrays['terms']
+        self.postings_indptr = arrays['postings_indptr']
+        self.postings_docs = arrays['postings_docs']
+        self.postings_weights = arrays['postings_weights']
+        self._postings_matrix = None
+
+    def __len__(self) -> int:
+        return len(self.chunk_ids)
+
+    def nbytes(self) -> int:
+        return estimate_nbytes(self.arrays, self.chunk_ids)
+
+    def query_vector(self, query: str) -> Tuple[List[int], List[float]]:
+        """(linhas do vocabulário, pesos) da query"""
+        raise NotImplementedError
+
+    def postings_matrix(self) -> csr_matrix:
+        """P (termos x chunks) apontando para os mesmos arrays (sem cópia)"""
+        if self._postings_matrix is None:
+            self._postings_matrix = csr_matrix(
+                (self.postings_weights, self.postings_docs, self.postings_indptr),
+                shape=(len(self.terms), len(self.chunk_ids)),
+                copy=False
+            )
+        return self._postings_matrix
+
+    def search(self, query: str, top_k: int) -> List[Tuple[int, float]]:
+        """Retorna [(posição do chunk, score)] dos top_k chunks, ordenado por relevância"""
+        return self.search_batch([query], top_k)[0]
+
+    def search_batch(self, queries: List[str], top_k: int) -> List[List[Tuple[int, float]]]:
+        """Top-k de várias queries com um único produto esparso Q @ P"""
+        pad_candidates = range(len(self.chunk_ids)) if self.pad_results else None
+        return [
+            select_top_k(docs, scores, top_k, pad_candidates)
+            for docs, scores in split_rows(self.score_matrix(queries))
+        ]
+
+    def score_matrix(self, queries: List[str]) -> csr_matrix:
+        """Scores (queries x chunks) = Q @ P"""
+        rows: List[int] = []
+        cols: List[int] = []
+        weights: List[float] = []
+        for query_idx, query in enumerate(queries):
+            term_rows, term_weights = self.query_vector(query)
+            rows.extend([query_idx] * len(term_rows))
+            cols.extend(term_rows)
+            weights.extend(term_weights)
+
+        queries_matrix = csr_matrix(
+            (np.array(weights, dtype=np.float32), (rows, cols)),
+            shape=(len(queries), len(self.terms))
+        )
+        return (queries_matrix @ self.postings_matrix()).tocsr()
+
+
+def postings_arrays(
+    term_rows: List[int],
+    chunk_positions: List[int],
+    weights: List[float],
+    n_terms: int,
+    n_chunks: int
+) -> Dict[str, np.ndarray]:
+    """Monta postings_indptr/docs/weights (CSR termo x chunk) a partir de triplas"""
+    postings = csr_matrix(
+        (np.array(weights, dtype=np.float32), (term_rows, chunk_positions)),
+        shape=(n_terms, n_chunks)
+    )
+    postings.sort_indices()
+    return {
+        'postings_indptr': postings.indptr.astype(np.int64),
+        'postings_docs': postings.indices.astype(np.int32),
+        'postings_weights': postings.data.astype(np.float32),
+    }
@@ -0,0 +1,33 @@
+# sync_knowledge_store.py - Reconcilia o chunk store local com o Firestore
+#
+# Uso:
+#   python sync_knowledge_store.py              # todas as equipes
+#   python sync_knowledge_store.py --team 12    # apenas uma equipe
+
+import argparse
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from simple_knowledge_service import get_knowledge_service
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sincroniza knowledge_chunks do Firestore para o store local")
+    parser.add_argument("--team", action="append", dest="teams", help="ID da equipe (pode repetir)")
+    args = parser.parse_args()
+
+    knowledge_service = get_knowledge_service()
+
+    if args.teams:
+        results = [knowledge_service.sync_team(team_id) for team_id in args.teams]
+    else:
+        results = knowledge_service.sync_all_teams()
+
+    total_chunks = sum(r['chunks'] for r in results)
+    print(f"✅ {len(results)} equipe(s) sincronizada(s), {total_chunks} chunks no total")
+    print(f"💾 {knowledge_service.chunk_store.stats()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,6 @@
+# conftest.py - Módulos do serviço importáveis nos testes (crewai-service não é um pacote instalado)
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
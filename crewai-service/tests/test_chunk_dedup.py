@@ -0,0 +1,101 @@
+# test_chunk_dedup.py - Chunks repetidos (MinHash + LSH, confirmação por texto normalizado)
+
+from chunk_dedup import MINHASHER, MinHasher, NearDuplicateLinker, normalize_text
+from knowledge_chunk_store import LocalChunkStore
+
+TABLE = "\n".join(f"Exame {i} | Preparo: jejum de {i % 12} horas | Valor: R$ {100 + i},00" for i in range(40))
+OTHER = "\n".join(f"Médico {i} | Especialidade: cardiologia | Atende às {8 + i % 10}h" for i in range(40))
+PRICES = "Tabela de preços de março.\n" + "\n".join(f"Produto {i} custa R$ {i * 10},00 à vista" for i in range(1, 30))
+
+
+def similarity(a, b):
+    return MINHASHER.similarity(MINHASHER.signature(a), MINHASHER.signature(b))
+
+
+def no_contents(chunk_ids):
+    return {}
+
+
+def store_linker(store, team_id):
+    return NearDuplicateLinker(
+        lambda band_keys: store.near_duplicate_candidates(team_id, band_keys),
+        lambda chunk_ids: {chunk['chunkId']: chunk['content'] for chunk in store.get_chunks(chunk_ids) if chunk},
+    )
+
+
+def put(store, document_id, content):
+    store.put_document('1', document_id, [{
+        'chunkId': f'{document_id}_chunk_0', 'documentId': document_id, 'chunkIndex': 0,
+        'content': content, 'metadata': {}, 'canonicalChunkId': None,
+    }])
+
+
+def test_signature_is_normalized_and_deterministic():
+    signature = MINHASHER.signature("Preço da consulta: R$ 10")
+
+    assert (MinHasher().signature("preco da CONSULTA r$ 10") == signature).all()
+    assert (MINHASHER.from_bytes(MINHASHER.to_bytes(signature)) == signature).all()
+    assert MINHASHER.signature("  ... ") is None
+    assert normalize_text("Preço:  R$ 10,00!") == normalize_text("preco r$ 10 00") == "preco r 10 00"
+
+
+def test_similarity_tracks_shared_content():
+    assert similarity(TABLE, TABLE) == 1.0
+    assert similarity(TABLE, OTHER) < 0.2
+
+
+def test_identical_chunks_share_every_band():
+    keys = MINHASHER.band_keys(MINHASHER.signature(TABLE))
+
+    assert len(keys) == MINHASHER.bands
+    assert keys == MINHASHER.band_keys(MINHASHER.signature(TABLE.upper()))
+    assert not set(keys) & set(MINHASHER.band_keys(MINHASHER.signature(OTHER)))
+
+
+def test_repeated_chunks_inside_the_same_document_link_to_first_chunk():
+    linker = NearDuplicateLinker(lambda band_keys: {}, no_contents)
+
+    assert linker.link('doc_chunk_0', TABLE) is None
+    assert linker.link('doc_chunk_1', OTHER) is None
+    assert linker.link('doc_chunk_2', TABLE.upper()) == 'doc_chunk_0'
+    assert linker.link('doc_chunk_3', TABLE) == 'doc_chunk_0'
+
+    linker.forget_pending()
+    assert linker.link('doc_chunk_4', TABLE) is None
+
+
+def test_changed_number_is_never_linked(tmp_path):
+    store = LocalChunkStore(str(tmp_path / 'chunks.db'))
+    put(store, 'marco', PRICES)
+    april = PRICES.replace("Produto 7 custa R$ 70,00", "Produto 7 custa R$ 95,00")
+    # Quase idênticos pelo MinHash, mas o preço mudou: o conteúdo novo precisa ser mantido
+    assert similarity(PRICES, april) > 0.9
+
+    linker = store_linker(store, '1')
+
+    assert linker.link('abril_chunk_0', april) is None
+    assert linker.link('abril_chunk_1', PRICES.replace("março", "abril")) is None
+    same_document = NearDuplicateLinker(lambda band_keys: {}, no_contents)
+    same_document.link('a', PRICES)
+    assert same_document.link('b', april) is None
+
+
+def test_candidates_come_from_the_team_store(tmp_path):
+    store = LocalChunkStore(str(tmp_path / 'chunks.db'))
+    put(store, 'jan', TABLE)
+
+    linker = store_linker(store, '1')
+    other_team = store_linker(store, '2')
+
+    assert linker.link('fev_chunk_0', TABLE.replace("|", " - ")) == 'jan_chunk_0'
+    assert linker.link('fev_chunk_1', OTHER) is None
+    assert other_team.link('fev_chunk_0', TABLE) is None
+
+
+def test_same_shingles_in_another_order_are_not_linked(tmp_path):
+    store = LocalChunkStore(str(tmp_path / 'chunks.db'))
+    put(store, 'a', "um dois três um dois três um")
+
+    # Mesmo conjunto de trigramas (assinatura idêntica), texto diferente
+    assert similarity("um dois três um dois três um", "um dois três um dois três um dois três um") == 1.0
+    assert store_linker(store, '1').link('b_chunk_0', "um dois três um dois três um dois três um") is None
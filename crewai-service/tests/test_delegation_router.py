@@ -0,0 +1,109 @@
+# test_delegation_router.py - Roteador local do modo hierárquico
+
+from delegation_router import DelegationRouter
+
+MANAGER = {'id': 10, 'name': 'Ana', 'function': 'Coordenadora', 'keywords': []}
+SPECIALISTS = [
+    {
+        'id': 1, 'name': 'Carlos', 'function': 'Agendamento',
+        'keywords': ['agendar', 'marcar consulta', 'remarcar', 'cancelar consulta'],
+        'objective': 'Agendar, remarcar e cancelar consultas dos pacientes',
+    },
+    {
+        'id': 2, 'name': 'Júlia', 'function': 'Financeiro',
+        'keywords': ['preço', 'valor', 'pagamento', 'boleto', 'pix', 'convênio'],
+        'objective': 'Informar valores, formas de pagamento e convênios aceitos',
+    },
+    {
+        'id': 3, 'name': 'Pedro', 'function': 'Suporte e dúvidas',
+        'keywords': ['exames', 'médicos', 'especialidade', 'endereço', 'preparo'],
+        'objective': 'Tirar dúvidas sobre médicos, exames, preparo e localização da clínica',
+    },
+]
+
+
+def route(router, message, team_id='1'):
+    return router.route(team_id, message, MANAGER, SPECIALISTS)
+
+
+def test_confident_message_is_routed_locally():
+    router = DelegationRouter(enabled=True)
+
+    decision = route(router, 'quero marcar uma consulta pra sexta')
+
+    assert decision['choice'] == 1
+    assert decision['method'] == 'local_router'
+    assert decision['score'] >= router.min_score
+    assert decision['margin'] >= router.min_margin
+
+
+def test_unknown_topic_falls_back_to_manager_llm():
+    router = DelegationRouter(enabled=True)
+
+    assert route(router, 'tem estacionamento?') is None
+    assert router.llm_fallbacks == 1
+
+
+def test_thresholds_decide_between_local_and_llm():
+    strict = DelegationRouter(enabled=True, min_score=0.99, min_margin=0.0)
+    lenient = DelegationRouter(enabled=True, min_score=0.1, min_margin=0.0)
+
+    # "onde fica a clínica" só se parece com o objetivo do suporte (score < 1)
+    assert route(strict, 'onde fica a clínica?') is None
+    assert route(lenient, 'onde fica a clínica?')['choice'] == 3
+
+
+def test_greeting_goes_to_manager():
+    router = DelegationRouter(enabled=True)
+
+    decision = route(router, 'oi, tudo bem? boa tarde!')
+
+    assert decision == {'choice': 0, 'method': 'small_talk', 'score': 1.0, 'margin': 1.0}
+
+
+def test_message_empty_after_normalization_is_not_small_talk():
+    router = DelegationRouter(enabled=True)
+
+    for message in ['quero saber', '?', '👍']:
+        assert route(router, message) is None
+
+    assert router.small_talk_decisions == 0
+    assert len(router.decisions) == 0
+
+
+def test_manager_decision_is_cached_and_learned():
+    router = DelegationRouter(enabled=True)
+    assert route(router, 'quanto custa a ressonância?') is None
+
+    router.record('1', 'quanto custa a ressonância?', MANAGER, SPECIALISTS, 2)
+
+    assert route(router, 'Quanto custa a ressonancia')['method'] == 'cache'
+    learned = route(router, 'quanto custa o raio x')
+    assert learned['choice'] == 2
+    assert learned['method'] == 'local_router'
+
+
+def test_decisions_are_isolated_per_team():
+    router = DelegationRouter(enabled=True)
+    router.record('1', 'quanto custa a ressonância?', MANAGER, SPECIALISTS, 2)
+
+    assert route(router, 'quanto custa a ressonância?', team_id='2') is None
+
+
+def test_team_without_id_never_routes_or_records():
+    router = DelegationRouter(enabled=True)
+
+    assert route(router, 'quero marcar uma consulta', team_id=None) is None
+    router.record(None, 'quanto custa a ressonância?', MANAGER, SPECIALISTS, 2)
+
+    assert router.recorded == 0
+    assert len(router.decisions) == 0
+
+
+def test_config_change_invalidates_cached_decisions():
+    router = DelegationRouter(enabled=True)
+    router.record('1', 'quanto custa a ressonância?', MANAGER, SPECIALISTS, 2)
+
+    changed = [dict(SPECIALISTS[0], keywords=['agenda']), SPECIALISTS[1], SPECIALISTS[2]]
+
+    assert router.route('1', 'quanto custa a ressonância?', MANAGER, changed)['method'] != 'cache'
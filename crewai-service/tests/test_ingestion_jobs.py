@@ -0,0 +1,70 @@
+# test_ingestion_jobs.py - Fila de ingestão e lotes de upload em massa
+
+import threading
+
+from ingestion_jobs import STAGES, IngestionBatch, IngestionJob, IngestionQueue
+
+
+def make_queue(worker=None):
+    return IngestionQueue(worker or (lambda job, upload: {'success': True}), max_workers=1)
+
+
+def finished_in(queue, items):
+    threads = []
+    batch = IngestionBatch('1', items, lambda batch: threads.append(threading.current_thread().name))
+    queue.add_batch(batch)
+    assert batch.future.result(timeout=5) is batch
+    return threads
+
+
+def test_batch_of_resolved_jobs_completes_in_ingestion_pool():
+    queue = make_queue()
+    job = queue.complete(IngestionJob('1', 'a.txt', 'doc-a', 10), {'success': True, 'alreadyExists': True})
+
+    threads = finished_in(queue, [{'filename': 'a.txt', 'job': job, 'error': None}])
+
+    assert threads and threads[0].startswith('kb-ingest')
+    assert threads[0] != threading.current_thread().name
+
+
+def test_batch_without_jobs_completes_in_ingestion_pool():
+    queue = make_queue()
+
+    threads = finished_in(queue, [{'filename': 'x.exe', 'job': None, 'error': 'Tipo de arquivo não suportado'}])
+
+    assert threads[0].startswith('kb-ingest')
+
+
+def test_batch_completes_once_after_last_job():
+    release = threading.Event()
+    queue = make_queue(lambda job, upload: release.wait(5) and {'success': True})
+    jobs = [queue.submit(IngestionJob('1', f'{name}.txt', name, 10), None) for name in ('a', 'b')]
+    calls = []
+    batch = IngestionBatch('1', [{'filename': job.filename, 'job': job, 'error': None} for job in jobs], calls.append)
+    queue.add_batch(batch)
+
+    assert batch.status == 'running'
+    release.set()
+    batch.future.result(timeout=5)
+
+    assert calls == [batch]
+    assert batch.to_dict()['succeeded'] == 2
+
+
+def test_progress_follows_stages():
+    job = IngestionJob('1', 'a.txt', 'doc-a', 10)
+    progress = []
+    for stage in STAGES:
+        job.set_stage(stage)
+        progress.append(job.progress)
+
+    assert progress == sorted(progress)
+    assert progress[0] == 0.0 and progress[-1] == 1.0
+
+
+def test_resolved_job_reports_counts_of_existing_document():
+    result = {'success': True, 'alreadyExists': True, 'chunksCount': 12, 'wordCount': 3400, 'duplicateChunks': 2}
+
+    job = make_queue().complete(IngestionJob('1', 'a.txt', 'doc-a', 10), result).to_dict()
+
+    assert (job['status'], job['chunks_count'], job['word_count'], job['duplicate_chunks']) == ('done', 12, 3400, 2)
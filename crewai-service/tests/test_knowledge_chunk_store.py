@@ -0,0 +1,90 @@
+# test_knowledge_chunk_store.py - Cópia local (SQLite) dos chunks
+
+import sqlite3
+
+import pytest
+
+from knowledge_chunk_store import LocalChunkStore
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = LocalChunkStore(str(tmp_path / 'chunks.db'))
+    # Limite de variáveis por comando das versões antigas do SQLite: listas maiores precisam ser fatiadas
+    store._conn.setlimit(sqlite3.SQLITE_LIMIT_VARIABLE_NUMBER, 999)
+    return store
+
+
+def chunk(document_id, index, content=None, canonical=None):
+    return {
+        'chunkId': f'{document_id}_chunk_{index}',
+        'documentId': document_id,
+        'chunkIndex': index,
+        'content': '' if canonical else (content or f'conteúdo {document_id} {index}'),
+        'metadata': {'filename': f'{document_id}.txt'},
+        'canonicalChunkId': canonical,
+    }
+
+
+def test_large_id_lists_stay_under_sqlite_variable_limit(store):
+    document_ids = [f'doc{i:04d}' for i in range(1200)]
+    for document_id in document_ids[:600]:
+        store.put_document('1', document_id, [chunk(document_id, 0), chunk(document_id, 1)])
+
+    assert store.missing_documents('1', document_ids) == document_ids[600:]
+
+    loaded = store.load_chunks('1', document_ids)
+    assert len(loaded) == 1200
+    assert [(c['documentId'], c['chunkIndex']) for c in loaded] == sorted((c['documentId'], c['chunkIndex']) for c in loaded)
+
+    chunk_ids = [f'{document_id}_chunk_0' for document_id in document_ids[:600]]
+    assert [c['chunkId'] for c in store.get_chunks(chunk_ids)] == chunk_ids
+
+    store.delete_chunks(chunk_ids)
+    assert store.get_chunks(chunk_ids) == [None] * 600
+    assert len(store.load_chunks('1', document_ids)) == 600
+
+
+def test_duplicate_reads_content_of_canonical(store):
+    store.put_document('1', 'a', [chunk('a', 0, 'tabela de preços')])
+    store.put_document('1', 'b', [chunk('b', 0, canonical='a_chunk_0')])
+
+    assert [c['content'] for c in store.get_chunks(['a_chunk_0', 'b_chunk_0'])] == ['tabela de preços'] * 2
+    # Com o canônico no conjunto, o duplicado não aparece de novo
+    assert [c['chunkId'] for c in store.load_chunks('1')] == ['a_chunk_0']
+    assert [c['chunkId'] for c in store.load_chunks('1', ['b'])] == ['b_chunk_0']
+
+
+def test_stale_team_is_synced_again(store):
+    store.replace_team('1', {'a': [chunk('a', 0)]}, stamp=3)
+    assert store.team_stamp('1') == 3
+    assert store.is_team_synced('1')
+
+    store.mark_team_stale('1', 5)
+
+    assert store.team_stamp('1') == 5
+    assert not store.is_team_synced('1')
+    assert store.missing_documents('1', ['a']) == ['a']
+
+
+def test_team_stamp_advances_only_by_one(store):
+    store.replace_team('1', {}, stamp=3)
+
+    assert store.advance_team_stamp('1', 4)
+    assert store.team_stamp('1') == 4
+    # Outro nó mudou a equipe no meio: o store não reflete o carimbo 6
+    assert not store.advance_team_stamp('1', 6)
+    assert store.team_stamp('1') == 4
+    assert not store.advance_team_stamp('2', 1)
+
+
+def test_writes_from_another_connection_are_detected(store, tmp_path):
+    version = store.data_version()
+    store.put_document('1', 'a', [chunk('a', 0)])
+    assert store.data_version() == version
+
+    other = LocalChunkStore(str(tmp_path / 'chunks.db'))
+    other.replace_team('2', {'b': [chunk('b', 0)]})
+
+    assert store.data_version() != version
+    assert set(store.teams_synced_since(0)) == {'1', '2'}
@@ -0,0 +1,93 @@
+# test_knowledge_index.py - Atualização incremental dos índices (reconcile_index)
+
+import pytest
+
+from knowledge_index import KnowledgeIndexCache, SegmentedIndex, TfidfIndex, build_index, reconcile_index
+
+TOPICS = {
+    'agenda': 'consultas podem ser marcadas ou remarcadas pelo telefone da recepção',
+    'precos': 'o valor da consulta particular é pago por pix boleto ou cartão',
+    'exames': 'exames de sangue exigem jejum de oito horas antes da coleta',
+    'endereco': 'a clínica fica na avenida central perto da estação do metrô',
+    'convenio': 'aceitamos convênio unimed bradesco e amil para consultas e exames',
+}
+
+
+def chunks(*names):
+    return [
+        {'chunkId': f'{name}_chunk_{i}', 'documentId': name, 'content': f'{TOPICS[name]} parte {i}'}
+        for name in names for i in range(2)
+    ]
+
+
+def found(index, query, top_k=2):
+    return [index.chunk_ids[position] for position, score in index.search(query, top_k) if score > 0]
+
+
+@pytest.mark.parametrize('ranker', ['tfidf', 'bm25'])
+def test_reconcile_adds_segment_and_tombstones_removed_chunks(ranker):
+    base = build_index(chunks('agenda', 'precos', 'exames', 'endereco'), ranker)
+
+    index = reconcile_index(base, chunks('agenda', 'precos', 'exames', 'convenio'))
+
+    assert isinstance(index, SegmentedIndex)
+    assert len(index.segments) == 2
+    assert index.live_chunk_ids() == {chunk['chunkId'] for chunk in chunks('agenda', 'precos', 'exames', 'convenio')}
+    assert len(index) == 8
+    assert not any(chunk_id.startswith('endereco') for chunk_id in found(index, 'avenida central metrô', 5))
+    # O segmento novo usa o vocabulário do fit: termos que já existiam no corpus
+    assert set(found(index, 'consultas e exames')) == {'convenio_chunk_0', 'convenio_chunk_1'}
+
+
+def test_reconcile_with_same_chunks_changes_nothing():
+    base = build_index(chunks('agenda', 'precos', 'exames'), 'bm25')
+
+    index = reconcile_index(base, list(reversed(chunks('agenda', 'precos', 'exames'))))
+
+    assert len(index.segments) == 1
+    assert len(index.tombstones) == 0
+    assert index.search('jejum coleta', 3) == base.search('jejum coleta', 3)
+
+
+def test_removed_chunk_added_again_is_searchable():
+    base = build_index(chunks('agenda', 'precos', 'exames'), 'bm25')
+    without = reconcile_index(base, chunks('agenda', 'precos'))
+
+    again = reconcile_index(without, chunks('agenda', 'precos', 'exames'))
+
+    # A posição antiga continua tombstone; o chunk volta num segmento novo
+    assert len(again.segments) == 2
+    assert again.live_chunk_ids() == {chunk['chunkId'] for chunk in chunks('agenda', 'precos', 'exames')}
+    positions = [position for position, score in again.search('jejum coleta', 2) if score > 0]
+    assert positions and all(position >= len(base.chunk_ids) for position in positions)
+
+
+def test_compaction_is_requested_after_many_changes():
+    base = build_index(chunks('agenda', 'precos', 'exames', 'endereco', 'convenio'), 'bm25')
+
+    assert not reconcile_index(base, chunks('agenda', 'precos', 'exames', 'endereco', 'convenio')).needs_compaction()
+    assert reconcile_index(base, chunks('agenda', 'precos', 'exames')).needs_compaction()
+
+
+def test_keyword_fallback_is_not_incremental():
+    base = TfidfIndex.build(chunks('agenda')[:1])
+
+    assert not base.persistent
+    assert reconcile_index(base, chunks('agenda')) is None
+
+
+def test_reconciled_index_round_trips_through_disk(tmp_path):
+    cache = KnowledgeIndexCache(index_dir=str(tmp_path), max_bytes=1)
+    index = reconcile_index(
+        build_index(chunks('agenda', 'precos', 'exames', 'endereco'), 'bm25'),
+        chunks('agenda', 'precos', 'exames', 'convenio'),
+    )
+    cache.put('1', None, 'bm25', index)
+    cache.put('2', None, 'bm25', index)  # despeja a equipe 1 da memória
+
+    loaded = cache.get('1', None, 'bm25')
+
+    assert cache.disk_loads == 1
+    assert loaded.chunk_ids == index.chunk_ids
+    assert loaded.live_chunk_ids() == index.live_chunk_ids()
+    assert loaded.search('consultas e exames', 3) == index.search('consultas e exames', 3)
@@ -0,0 +1,110 @@
+# test_llm_client_pool.py - Pool de clientes LLM
+
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from llm_client_pool import LLMClientPool
+
+
+class SlowFactory:
+    def __init__(self, seconds=0.2):
+        self.seconds = seconds
+        self.created = []
+        self.lock = threading.Lock()
+
+    def __call__(self, model, temperature, max_output_tokens, location, project):
+        time.sleep(self.seconds)
+        with self.lock:
+            self.created.append((model, temperature))
+        return object()
+
+
+def test_same_key_is_created_once_for_concurrent_requests():
+    factory = SlowFactory()
+    pool = LLMClientPool(factory=factory)
+
+    with ThreadPoolExecutor(8) as executor:
+        clients = list(executor.map(lambda _: pool.get('gemini', temperature=0.7), range(8)))
+
+    assert factory.created == [('gemini', 0.7)]
+    assert all(client is clients[0] for client in clients)
+    assert pool.stats()['misses'] == 1
+
+
+def test_different_keys_are_created_in_parallel():
+    factory = SlowFactory(seconds=0.3)
+    pool = LLMClientPool(factory=factory)
+
+    started = time.monotonic()
+    with ThreadPoolExecutor(4) as executor:
+        list(executor.map(lambda temperature: pool.get('gemini', temperature=temperature), [0.1, 0.2, 0.3, 0.4]))
+
+    # Com a criação dentro do lock seriam 4 x 0.3s
+    assert time.monotonic() - started < 0.9
+    assert len(factory.created) == 4
+
+
+def test_failed_creation_is_retried_and_shared_with_waiters():
+    calls = []
+
+    def factory(*args):
+        calls.append(args)
+        time.sleep(0.1)
+        if len(calls) == 1:
+            raise RuntimeError('credenciais')
+        return object()
+
+    pool = LLMClientPool(factory=factory)
+    with ThreadPoolExecutor(2) as executor:
+        results = [executor.submit(pool.get, 'gemini') for _ in range(2)]
+        errors = [future.exception() for future in results]
+
+    assert [str(error) for error in errors] == ['credenciais', 'credenciais']
+    assert pool.get('gemini') is pool.get('gemini')
+    assert len(calls) == 2
+
+
+def test_aget_does_not_block_event_loop():
+    pool = LLMClientPool(factory=SlowFactory(seconds=0.3))
+
+    async def main():
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.02)
+                ticks += 1
+
+        task = asyncio.create_task(ticker())
+        client = await pool.aget('gemini')
+        task.cancel()
+        return client, ticks
+
+    client, ticks = asyncio.run(main())
+
+    assert ticks >= 5
+    assert asyncio.run(pool.aget('gemini')) is client
+
+
+def test_least_recently_used_client_is_evicted():
+    pool = LLMClientPool(max_size=2, factory=SlowFactory(seconds=0))
+    first = pool.get('a')
+    pool.get('b')
+    pool.get('a')
+    pool.get('c')
+
+    assert pool.get('a') is first
+    assert [client['model'] for client in pool.stats()['clients']] == ['a', 'c']
+    assert pool.evictions == 1
+
+
+@pytest.mark.parametrize('temperature', [0.7, '0.70', 0.7000001])
+def test_equivalent_temperatures_share_a_client(temperature):
+    pool = LLMClientPool(factory=SlowFactory(seconds=0))
+
+    assert pool.get('gemini', temperature=0.7) is pool.get('gemini', temperature=temperature)
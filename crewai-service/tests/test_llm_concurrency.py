@@ -0,0 +1,73 @@
+# test_llm_concurrency.py - Limite de chamadas simultâneas ao LLM
+
+import asyncio
+
+from llm_concurrency import LLMConcurrencyLimiter
+
+
+class FakeLLM:
+    def __init__(self, seconds=0.05):
+        self.seconds = seconds
+        self.running = 0
+        self.peak = 0
+
+    async def ainvoke(self, messages):
+        self.running += 1
+        self.peak = max(self.peak, self.running)
+        await asyncio.sleep(self.seconds)
+        self.running -= 1
+        return 'ok'
+
+
+def test_per_tenant_and_global_limits():
+    limiter = LLMConcurrencyLimiter(max_concurrency=3, per_tenant=2)
+    llm = FakeLLM()
+
+    async def main():
+        busy = [limiter.ainvoke(llm, [], 'a') for _ in range(6)]
+        others = [limiter.ainvoke(llm, [], tenant) for tenant in ('b', 'c') for _ in range(2)]
+        return await asyncio.gather(*busy, *others)
+
+    assert asyncio.run(main()) == ['ok'] * 10
+    assert llm.peak == 3
+    assert limiter.stats()['calls'] == 10
+
+
+def test_idle_tenant_semaphores_are_dropped():
+    limiter = LLMConcurrencyLimiter(max_concurrency=8, per_tenant=2)
+    llm = FakeLLM(seconds=0)
+
+    async def main():
+        held = asyncio.Event()
+        release = asyncio.Event()
+
+        async def hold():
+            async with limiter.slot('busy'):
+                held.set()
+                await release.wait()
+
+        task = asyncio.create_task(hold())
+        await held.wait()
+        for tenant in range(1000):
+            await limiter.ainvoke(llm, [], str(tenant))
+
+        during = limiter.stats()['tenantSemaphores']
+        release.set()
+        await task
+        return during
+
+    assert asyncio.run(main()) == 1
+    assert limiter.stats()['tenantSemaphores'] == 0
+    assert limiter.stats()['tenantsInFlight'] == {}
+
+
+def test_recreated_tenant_semaphore_keeps_the_limit():
+    limiter = LLMConcurrencyLimiter(max_concurrency=8, per_tenant=2)
+    llm = FakeLLM()
+
+    async def main():
+        await limiter.ainvoke(llm, [], 'a')
+        await asyncio.gather(*[limiter.ainvoke(llm, [], 'a') for _ in range(5)])
+
+    asyncio.run(main())
+    assert llm.peak == 2
@@ -0,0 +1,100 @@
+# test_response_cache.py - Cache de respostas (chave de contexto e perguntas parecidas)
+
+from response_cache import ResponseCache, tokenize_message
+
+AGENT = {'id': 1, 'name': 'Ana', 'function': 'Atendimento', 'doList': ['ser cordial']}
+TEAM = {'temperature': 0.7, 'managerLLM': None}
+RESOURCES = {
+    'trainingExamples': [{'id': 1, 'userMessage': 'qual o horário?', 'agentResponse': 'Das 8h às 18h', 'priority': 5}],
+    'agentFiles': [{'id': 3, 'originalName': 'tabela.pdf', 'description': 'Tabela de preços', 'fileType': 'pdf'}],
+}
+
+
+def key(cache, agent=AGENT, version=1, context='horário: 8h às 18h', history=None, resources=RESOURCES):
+    return cache.context_key(agent, TEAM, version, context, history, resources)
+
+
+def test_tokenize_drops_greetings_accents_and_courtesy():
+    assert tokenize_message('Boa tarde! Qual é o horário de vocês, por favor?') == ['qual', 'horario']
+    assert tokenize_message('oi') == []
+
+
+def test_everything_in_the_prompt_changes_the_key():
+    cache = ResponseCache()
+    base = key(cache)
+
+    assert key(cache) == base
+    assert key(cache, agent=dict(AGENT, doList=['ser breve'])) != base
+    assert key(cache, version=2) != base
+    assert key(cache, context='horário: 9h às 17h') != base
+    assert key(cache, history=[{'role': 'Cliente', 'body': 'oi'}]) != base
+    assert key(cache, resources=dict(RESOURCES, trainingExamples=[])) != base
+    assert key(cache, resources=dict(RESOURCES, agentFiles=[dict(RESOURCES['agentFiles'][0], description='Cardápio')])) != base
+
+
+def test_history_is_normalized_in_the_key():
+    cache = ResponseCache()
+
+    assert key(cache, history=[{'role': 'Cliente', 'body': 'Olá, qual o preço?'}]) == \
+        key(cache, history=[{'role': 'Cliente', 'body': 'qual o preco'}])
+
+
+def test_similar_question_reuses_answer():
+    cache = ResponseCache(similarity=0.85)
+    context = key(cache)
+    cache.set('1', context, 'Qual o horário de atendimento?', 'Das 8h às 18h', agent_name='Ana')
+
+    exact = cache.get('1', context, 'boa tarde, qual é o horario de atendimento')
+    typo = cache.get('1', context, 'qual o horaio de atendimento?')
+
+    assert exact['response'] == 'Das 8h às 18h' and exact['similarity'] == 1.0
+    assert typo['response'] == 'Das 8h às 18h' and typo['similarity'] < 1.0
+    assert cache.similar_hits == 1
+
+
+def test_different_word_or_number_is_a_miss():
+    cache = ResponseCache(similarity=0.5)
+    context = key(cache)
+    cache.set('1', context, 'qual o preço do exame 12?', 'R$ 112,00')
+    cache.set('1', context, 'qual o preço da consulta?', 'R$ 200,00')
+
+    assert cache.get('1', context, 'qual o preço do exame 13?') is None
+    assert cache.get('1', context, 'qual o preço da vacina?') is None
+    assert cache.get('1', key(cache, version=2), 'qual o preço da consulta?') is None
+    assert cache.get('2', context, 'qual o preço da consulta?') is None
+
+
+def test_expired_and_evicted_entries_are_misses():
+    cache = ResponseCache(max_entries=2)
+    context = key(cache)
+    cache.set('1', context, 'qual o endereço?', 'Av. Central, 100', ttl_seconds=-1)
+    cache.set('1', context, 'qual o horário?', 'Das 8h às 18h')
+    cache.set('1', context, 'aceita pix?', 'Sim')
+    cache.set('1', context, 'aceita convênio?', 'Unimed e Amil')
+
+    assert cache.get('1', context, 'qual o endereço?', similarity=1.0) is None
+    assert cache.get('1', context, 'qual o horário?', similarity=1.0) is None
+    assert cache.get('1', context, 'aceita pix?', similarity=1.0)['response'] == 'Sim'
+    assert cache.evictions == 2
+
+
+def test_follow_up_questions_are_not_cacheable():
+    cache = ResponseCache(max_history=4)
+    history = [{'role': 'Cliente', 'body': 'que dia o Dr. Ricardo atende?'}]
+
+    assert cache.is_cacheable('qual o horário?', None)
+    assert cache.is_cacheable('qual o horário?', history)
+    assert not cache.is_cacheable('e ele atende sábado?', history)
+    assert not cache.is_cacheable('qual o horário?', history * 5)
+    assert not cache.is_cacheable('👍', None)
+
+
+def test_invalidate_team_drops_only_that_team():
+    cache = ResponseCache()
+    context = key(cache)
+    cache.set('1', context, 'qual o horário?', 'Das 8h às 18h')
+    cache.set('2', context, 'qual o horário?', 'Das 9h às 17h')
+
+    assert cache.invalidate_team('1') == 1
+    assert cache.get('1', context, 'qual o horário?') is None
+    assert cache.get('2', context, 'qual o horário?')['response'] == 'Das 9h às 17h'
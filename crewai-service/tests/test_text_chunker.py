@@ -0,0 +1,91 @@
+# test_text_chunker.py - Chunkers da Knowledge Base
+
+from text_chunker import (
+    DEFAULT_CHUNKER, SentenceChunker, count_tokens, get_chunker, iter_char_chunks,
+    resolve_chunker, split_sentences,
+)
+
+PARAGRAPH = (
+    "A clínica atende de segunda a sexta, das 8h às 18h. "
+    "Aos sábados o atendimento vai até o meio-dia! "
+    "Consultas podem ser remarcadas com 24 horas de antecedência? Sim, pelo telefone.\n"
+)
+TABLE = "".join(f"Exame {i} | Preparo: jejum de {i % 12} horas | Valor: R$ {100 + i},00\n" for i in range(200))
+TEXT = PARAGRAPH * 40 + TABLE
+
+
+def fragments(text, size):
+    return [text[i:i + size] for i in range(0, len(text), size)]
+
+
+def test_count_tokens_and_sentences():
+    assert count_tokens("Olá, mundo... tudo bem?") == 7
+    assert count_tokens("") == 0
+    assert split_sentences("Primeira frase.  Segunda frase!\nlinha  de tabela | 10") == [
+        "Primeira frase.", "Segunda frase!", "linha de tabela | 10",
+    ]
+    # Ponto sem espaço depois (números, URLs) não encerra a frase
+    assert split_sentences("Valor 10.50 em site.com.br hoje") == ["Valor 10.50 em site.com.br hoje"]
+
+
+def test_char_chunks_stream_same_as_whole_text():
+    whole = list(iter_char_chunks([TEXT]))
+
+    for size in (1, 97, 1000, 4096):
+        assert list(iter_char_chunks(fragments(TEXT, size))) == whole
+
+
+def test_char_chunks_respect_size_and_break_at_sentence_end():
+    chunks = list(iter_char_chunks([TEXT]))
+
+    assert chunks
+    assert all(50 < len(chunk) <= 1000 for chunk in chunks)
+    assert all(chunk.endswith(('.', '!', '?', ',00')) for chunk in chunks[:-1])
+    assert list(iter_char_chunks(["curto demais"])) == []
+
+
+def test_sentence_chunks_stay_within_budget_and_keep_lines_whole():
+    chunker = SentenceChunker(max_tokens=64, overlap_tokens=16)
+    sentences = set(split_sentences(TEXT))
+
+    chunks = list(chunker.iter_chunks([TEXT]))
+
+    assert chunks
+    for chunk in chunks:
+        assert count_tokens(chunk) <= 64
+        assert all(sentence in sentences for sentence in split_sentences(chunk))
+
+
+def test_sentence_chunks_overlap_whole_sentences():
+    chunker = SentenceChunker(max_tokens=64, overlap_tokens=16)
+
+    chunks = list(chunker.iter_chunks([TEXT]))
+
+    for previous, current in zip(chunks, chunks[1:]):
+        first = split_sentences(current)[0]
+        if count_tokens(first) <= 16:
+            assert first in split_sentences(previous)
+
+
+def test_sentence_chunks_stream_same_as_whole_text():
+    chunker = SentenceChunker(max_tokens=64, overlap_tokens=16)
+    chunker.window_chars = 2048
+    whole = list(chunker.iter_chunks([TEXT]))
+
+    for size in (13, 500, 3000):
+        assert list(chunker.iter_chunks(fragments(TEXT, size))) == whole
+
+
+def test_oversized_line_is_split_by_budget():
+    chunker = SentenceChunker(max_tokens=10, overlap_tokens=0)
+
+    chunks = list(chunker.iter_chunks([" ".join(f"palavra{i}" for i in range(35))]))
+
+    assert [count_tokens(chunk) for chunk in chunks] == [10, 10, 10, 5]
+
+
+def test_unknown_chunker_falls_back_to_default():
+    assert resolve_chunker('SENTENCES') == 'sentences'
+    assert resolve_chunker(None) == DEFAULT_CHUNKER
+    assert resolve_chunker('paragraphs') == DEFAULT_CHUNKER
+    assert list(get_chunker('chars')([TEXT])) == list(iter_char_chunks([TEXT]))
@@ -0,0 +1,70 @@
+# test_upload_dedup.py - Uploads repetidos enquanto o primeiro ainda está na fila
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+pytest.importorskip('google.cloud.firestore')
+
+from ingestion_jobs import IngestionQueue, IngestionQueueFull  # noqa: E402
+from simple_knowledge_service import SimpleKnowledgeService  # noqa: E402
+from upload_spool import SpooledUpload  # noqa: E402
+
+
+def make_service(worker, lookup_seconds=0.1):
+    """Só a parte do serviço usada no submit (sem Firestore)"""
+    service = SimpleKnowledgeService.__new__(SimpleKnowledgeService)
+    service._pending_uploads = {}
+    service._pending_uploads_lock = threading.Lock()
+    service.ingestion_queue = IngestionQueue(worker, max_workers=2)
+    # Consulta lenta: os dois uploads passam juntos pela primeira checagem de pendentes
+    service.find_document_by_hash = lambda team_id, content_hash: time.sleep(lookup_seconds)
+    return service
+
+
+def test_concurrent_identical_uploads_share_one_job():
+    calls = []
+    release = threading.Event()
+    service = None
+
+    def worker(job, upload):
+        calls.append(job.job_id)
+        release.wait(5)
+        service._release_upload(job)
+        upload.cleanup()
+        return {'success': True, 'documentId': job.document_id}
+
+    service = make_service(worker)
+    with ThreadPoolExecutor(2) as executor:
+        futures = [executor.submit(service.submit_document, '1', b'tabela de precos', 'tabela.txt') for _ in range(2)]
+        jobs = [future.result(timeout=5) for future in futures]
+
+    assert jobs[0] is jobs[1]
+    assert service.ingestion_queue.stats()['pending'] == 1
+    release.set()
+
+    assert jobs[0].future.result(timeout=5)['documentId'] == jobs[0].document_id
+    assert len(calls) == 1
+    assert service.ingestion_queue.stats()['pending'] == 0
+    assert service._pending_uploads == {}
+
+
+def test_waiter_is_released_when_queue_is_full():
+    service = make_service(lambda job, upload: {'success': True}, lookup_seconds=0)
+    service.ingestion_queue.max_pending = 0
+
+    with pytest.raises(IngestionQueueFull):
+        service.submit_document('1', b'abc', 'a.txt')
+
+    # O job recusado não fica pendente: o próximo upload igual é um job novo
+    upload = SpooledUpload.from_bytes(b'abc', suffix='.txt')
+    job, is_new = service._resolve_upload('1', upload, 'a.txt', False, None, None)
+    waiter, waiting = service._resolve_upload('1', upload, 'a.txt', False, None, None)
+    upload.cleanup()
+
+    assert is_new and waiter is job and not waiting
+    with pytest.raises(IngestionQueueFull):
+        service.ingestion_queue.submit(job, upload)
+    assert waiter.future.result(timeout=1)['success'] is False
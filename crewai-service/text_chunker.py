@@ -0,0 +1,224 @@
+# text_chunker.py - Chunkers da Knowledge Base (por caracteres ou por frases com orçamento de tokens)
+
+import os
+from typing import Callable, Iterable, Iterator, List, Optional, Tuple
+import numpy as np
+
+# Orçamento padrão do chunker por frases (tokens aproximados: palavras e pontuação)
+CHUNK_TOKENS = int(os.getenv('KNOWLEDGE_CHUNK_TOKENS', '192'))
+CHUNK_OVERLAP_TOKENS = int(os.getenv('KNOWLEDGE_CHUNK_OVERLAP_TOKENS', '32'))
+
+# Classe de cada caractere para a contagem de tokens: 0 espaço, 1 palavra, 2 pontuação.
+# Token = sequência de palavra ou de pontuação (aproxima \w+|[^\w\s]+ em numpy)
+_ASCII_CLASSES = np.array(
+    [0 if chr(c).isspace() else 1 if (chr(c).isalnum() or chr(c) == '_') else 2 for c in range(128)],
+    dtype=np.int8
+)
+_UNICODE_SPACES = np.array([0x85, 0xA0, 0x1680, *range(0x2000, 0x200B), 0x2028, 0x2029, 0x202F, 0x205F, 0x3000], dtype=np.uint32)
+
+# Fim de frase quando seguido de espaço; fim de linha sempre (linhas de tabela e parágrafos viram segmentos)
+_SENTENCE_ENDS = np.array([ord('.'), ord('!'), ord('?')], dtype=np.uint32)
+
+
+def _char_classes(text: str) -> Tuple[np.ndarray, np.ndarray]:
+    """(code points, classe de cada caractere), com os mesmos índices da str"""
+    codes = np.frombuffer(text.encode('utf-32-le'), dtype=np.uint32)
+    classes = np.ones(len(codes), dtype=np.int8)  # fora do ASCII: letras (acentos etc.)
+    ascii_mask = codes < 128
+    classes[ascii_mask] = _ASCII_CLASSES[codes[ascii_mask]]
+    classes[((codes >= 0xA1) & (codes <= 0xBF)) | ((codes >= 0x2010) & (codes <= 0x205E))] = 2
+    classes[np.isin(codes, _UNICODE_SPACES)] = 0
+    return codes, classes
+
+
+def _token_starts(classes: np.ndarray) -> np.ndarray:
+    previous = np.empty_like(classes)
+    previous[:1] = 0
+    previous[1:] = classes[:-1]
+    return np.nonzero((classes != 0) & (classes != previous))[0]
+
+
+def _boundaries(codes: np.ndarray, classes: np.ndarray) -> np.ndarray:
+    """Offsets logo após cada fim de linha e cada fim de frase ([.!?] seguido de espaço)"""
+    newlines = np.nonzero(codes == ord('\n'))[0]
+    sentence_ends = np.nonzero(np.isin(codes[:-1], _SENTENCE_ENDS) & (classes[1:] == 0))[0]
+    return np.concatenate((newlines, sentence_ends)) + 1
+
+
+def count_tokens(text: str) -> int:
+    """Tokens aproximados (palavras e sequências de pontuação)"""
+    return len(_token_starts(_char_classes(text)[1]))
+
+
+def split_sentences(text: str) -> List[str]:
+    """Frases/linhas do texto, com espaços normalizados"""
+    codes, classes = _char_classes(text)
+    bounds = np.unique(np.concatenate(([0], _boundaries(codes, classes), [len(text)]))).tolist()
+    sentences = (" ".join(text[start:end].split()) for start, end in zip(bounds[:-1], bounds[1:]))
+    return [sentence for sentence in sentences if sentence]
+
+
+def iter_char_chunks(fragments: Iterable[str], chunk_size: int = 1000, overlap: int = 200) -> Iterator[str]:
+    """
+    Divide o texto em chunks com overlap, lendo os fragmentos sob demanda
+
+    Gera exatamente os mesmos chunks que o texto concatenado geraria:
+    o buffer guarda só o texto a partir do chunk atual (overlap entre
+    páginas incluído) e é completado até passar do fim do chunk.
+    """
+    fragments = iter(fragments)
+    buffer = ""
+    offset = 0  # posição de buffer[0] no texto completo
+    start = 0
+    exhausted = False
+
+    while True:
+        while not exhausted and offset + len(buffer) <= start + chunk_size:
+            fragment = next(fragments, None)
+            if fragment is None:
+                exhausted = True
+            else:
+                buffer += fragment
+
+        # Com a entrada esgotada, é o tamanho do texto inteiro
+        text_length = offset + len(buffer)
+        if start >= text_length:
+            return
+
+        # Descarta o que já ficou para trás (amortizado)
+        if start - offset > len(buffer) // 2:
+            buffer = buffer[start - offset:]
+            offset = start
+
+        end = start + chunk_size
+        chunk = buffer[start - offset:end - offset]
+
+        # Tentar quebrar no final de frase
+        if end < text_length:
+            last_period = chunk.rfind('.')
+            last_newline = chunk.rfind('\n')
+            break_point = max(last_period, last_newline)
+
+            if break_point > chunk_size * 0.7:  # Pelo menos 70% do chunk
+                chunk = chunk[:break_point + 1]
+                end = start + break_point + 1
+
+        chunk = chunk.strip()
+        if len(chunk) > 50:  # Mínimo 50 chars
+            yield chunk
+        start = end - overlap
+
+
+class SentenceChunker:
+    """
+    Chunks de frases/linhas inteiras até `max_tokens` tokens, com overlap
+    de frases inteiras até `overlap_tokens`
+
+    O texto é segmentado uma vez por janela: offsets dos limites (fim de
+    frase ou de linha) e dos tokens viram arrays, a contagem de tokens por
+    segmento sai de um searchsorted e o empacotamento guloso usa a soma
+    acumulada, sem fatiar o texto a cada tentativa. Linhas de tabela
+    (XLSX) nunca são cortadas no meio; um segmento maior que o orçamento
+    é quebrado em pedaços de `max_tokens` tokens.
+    """
+
+    def __init__(self, max_tokens: int = CHUNK_TOKENS, overlap_tokens: int = CHUNK_OVERLAP_TOKENS):
+        self.max_tokens = max(1, max_tokens)
+        self.overlap_tokens = max(0, min(overlap_tokens, self.max_tokens - 1))
+        # Texto processado por vez no streaming (várias vezes o tamanho de um chunk)
+        self.window_chars = max(64 * 1024, self.max_tokens * 32)
+
+    def _segments(self, text: str) -> Tuple[np.ndarray, np.ndarray]:
+        """(limites dos segmentos [n+1], tokens por segmento [n])"""
+        codes, classes = _char_classes(text)
+        bounds = np.unique(np.concatenate(([0], _boundaries(codes, classes), [len(text)])))
+        starts = _token_starts(classes)
+
+        first_token = np.searchsorted(starts, bounds, side='left')
+        counts = np.diff(first_token)
+
+        # Segmentos acima do orçamento: limites extras a cada max_tokens tokens
+        oversized = np.nonzero(counts > self.max_tokens)[0]
+        if len(oversized):
+            extra = [
+                starts[first_token[k] + step]
+                for k in oversized
+                for step in range(self.max_tokens, int(counts[k]), self.max_tokens)
+            ]
+            bounds = np.unique(np.concatenate((bounds, np.array(extra, dtype=np.int64))))
+            counts = np.diff(np.searchsorted(starts, bounds, side='left'))
+
+        return bounds, counts
+
+    def split(self, text: str, final: bool = True) -> Tuple[int, List[str]]:
+        """
+        Chunks do texto. Com final=False, o último pedaço (que pode continuar
+        no próximo fragmento) não é emitido.
+
+        Returns:
+            (offset a partir do qual o texto ainda não virou chunk, chunks)
+        """
+        bounds, counts = self._segments(text)
+        cumulative = np.concatenate(([0], np.cumsum(counts)))
+        segments = len(counts)
+
+        chunks: List[str] = []
+        i = 0
+        while i < segments:
+            # Maior j com tokens(i..j) <= max_tokens (pelo menos um segmento)
+            j = int(np.searchsorted(cumulative, cumulative[i] + self.max_tokens, side='right')) - 1
+            j = max(j, i + 1)
+            if j >= segments and not final:
+                break
+
+            chunk = text[bounds[i]:bounds[j]].strip()
+            if chunk:
+                chunks.append(chunk)
+            if j >= segments:
+                i = segments
+                break
+
+            # Overlap: frases finais do chunk que cabem em overlap_tokens
+            k = int(np.searchsorted(cumulative, cumulative[j] - self.overlap_tokens, side='left'))
+            i = min(max(k, i + 1), j)
+
+        consumed = int(bounds[i]) if i < segments else len(text)
+        return consumed, chunks
+
+    def iter_chunks(self, fragments: Iterable[str]) -> Iterator[str]:
+        """Chunks em streaming: o buffer guarda só a janela atual"""
+        buffer = ""
+        threshold = self.window_chars
+        for fragment in fragments:
+            buffer += fragment
+            if len(buffer) >= threshold:
+                consumed, chunks = self.split(buffer, final=False)
+                yield from chunks
+                buffer = buffer[consumed:]
+                # Janela sem nenhum limite utilizável: esperar mais texto antes de tentar de novo
+                threshold = len(buffer) + self.window_chars if not consumed else self.window_chars
+
+        _, chunks = self.split(buffer, final=True)
+        yield from chunks
+
+
+# Chunkers disponíveis (configurados por equipe em Team.knowledgeChunker)
+CHUNKERS = {
+    'chars': lambda fragments: iter_char_chunks(fragments),
+    'sentences': lambda fragments: SentenceChunker().iter_chunks(fragments),
+}
+
+DEFAULT_CHUNKER = os.getenv('KNOWLEDGE_CHUNKER', 'chars')
+
+
+def resolve_chunker(chunker: Optional[str]) -> str:
+    """Normaliza o nome do chunker, caindo no padrão se for desconhecido"""
+    chunker = (chunker or DEFAULT_CHUNKER).lower()
+    if chunker not in CHUNKERS:
+        print(f"⚠️ Chunker desconhecido '{chunker}', usando '{DEFAULT_CHUNKER}'")
+        return DEFAULT_CHUNKER
+    return chunker
+
+
+def get_chunker(chunker: Optional[str]) -> Callable[[Iterable[str]], Iterator[str]]:
+    return CHUNKERS[resolve_chunker(chunker)]
@@ -0,0 +1,77 @@
+# ttl_cache.py - Cache LRU com expiração (TTL) e contadores de hit/miss
+
+import time
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional
+
+
+class TTLCache:
+    """
+    Cache LRU em memória com TTL por entrada
+
+    - max_entries: ao passar do limite, remove a entrada usada há mais tempo
+    - ttl_seconds: entradas mais antigas que isso contam como miss
+    - hits/misses/evictions para o endpoint de estatísticas
+    """
+
+    def __init__(self, max_entries: int = 1024, ttl_seconds: float = 600):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: 'OrderedDict[Hashable, tuple]' = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: Hashable, value: Any):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, predicate: Callable[[Hashable], bool]) -> int:
+        """Remove as entradas cuja chave satisfaz o predicado"""
+        with self._lock:
+            keys = [key for key in self._entries if predicate(key)]
+            for key in keys:
+                del self._entries[key]
+        return len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            'entries': len(self._entries),
+            'maxEntries': self.max_entries,
+            'ttlSeconds': self.ttl_seconds,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hitRate': round(self.hits / total, 3) if total else 0.0,
+            'evictions': self.evictions,
+        }
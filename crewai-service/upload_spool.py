@@ -0,0 +1,265 @@
+# upload_spool.py - Uploads gravados em arquivo temporário (sem o arquivo inteiro em memória)
+
+import os
+import mmap
+import asyncio
+import hashlib
+import zipfile
+import tempfile
+from contextlib import contextmanager
+from typing import BinaryIO, Iterator, Optional, List, Union, Tuple, Iterable
+
+# Tamanho máximo de um arquivo enviado para a Knowledge Base
+MAX_UPLOAD_BYTES = int(float(os.getenv('KNOWLEDGE_MAX_UPLOAD_MB', '50')) * 1024 * 1024)
+
+# Upload em massa: tamanho máximo da requisição/ZIP e quantidade máxima de arquivos
+MAX_BULK_UPLOAD_BYTES = int(float(os.getenv('KNOWLEDGE_MAX_BULK_UPLOAD_MB', '500')) * 1024 * 1024)
+BULK_MAX_FILES = int(os.getenv('KNOWLEDGE_BULK_MAX_FILES', '200'))
+
+# Diretório dos arquivos temporários (padrão: diretório temporário do sistema)
+UPLOAD_SPOOL_DIR = os.getenv('KNOWLEDGE_UPLOAD_DIR') or None
+
+# Bytes lidos/gravados por vez ao copiar o upload
+SPOOL_BLOCK_SIZE = 1024 * 1024
+
+# Folga do corpo multipart além do arquivo (boundary, headers e campos do form)
+MULTIPART_OVERHEAD = 1024 * 1024
+
+
+class UploadTooLarge(Exception):
+    """Arquivo maior que o tamanho máximo permitido"""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        super().__init__(f"Arquivo maior que o limite de {max_bytes / (1024 * 1024):.0f} MB")
+
+
+class SpooledUpload:
+    """
+    Arquivo enviado, gravado em disco, com tamanho e SHA-256 calculados na cópia
+
+    Extratores recebem o caminho (path) e abrem o arquivo sob demanda, em
+    vez de receber os bytes (que seriam copiados para cada processo do
+    pool de extração). Quem recebe o upload é dono dele: cleanup() apaga
+    o arquivo e pode ser chamado mais de uma vez.
+    """
+
+    def __init__(self, path: str, size: int, content_hash: str):
+        self.path = path
+        self.size = size
+        self.content_hash = content_hash
+
+    @classmethod
+    def from_bytes(cls, content: bytes, suffix: str = '', directory: Optional[str] = None) -> 'SpooledUpload':
+        """Upload a partir de bytes já em memória (scripts, chamadas internas)"""
+        fd, path = tempfile.mkstemp(prefix='kb-upload-', suffix=suffix, dir=directory or UPLOAD_SPOOL_DIR)
+        with os.fdopen(fd, 'wb') as f:
+            f.write(content)
+        return cls(path, len(content), hashlib.sha256(content).hexdigest())
+
+    def read_bytes(self) -> bytes:
+        with open(self.path, 'rb') as f:
+            return f.read()
+
+    @contextmanager
+    def mmap(self) -> Iterator[Union[mmap.mmap, bytes]]:
+        """Conteúdo mapeado em memória (páginas carregadas sob demanda pelo SO; fatias viram bytes)"""
+        if self.size == 0:
+            yield b''
+            return
+        with open(self.path, 'rb') as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                yield mapped
+            finally:
+                mapped.close()
+
+    def cleanup(self):
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+
+
+def spool_file(
+    source: BinaryIO,
+    suffix: str = '',
+    max_bytes: int = MAX_UPLOAD_BYTES,
+    directory: Optional[str] = None
+) -> SpooledUpload:
+    """
+    Copia um arquivo aberto para um arquivo temporário, bloco a bloco
+
+    O limite é verificado durante a cópia: passou de max_bytes, a cópia
+    para e o arquivo parcial é apagado. O sufixo (extensão) é mantido:
+    o openpyxl escolhe o formato pela extensão do caminho.
+
+    Raises:
+        UploadTooLarge: arquivo maior que max_bytes
+    """
+    fd, path = tempfile.mkstemp(prefix='kb-upload-', suffix=suffix, dir=directory or UPLOAD_SPOOL_DIR)
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            while True:
+                block = source.read(SPOOL_BLOCK_SIZE)
+                if not block:
+                    break
+                size += len(block)
+                if size > max_bytes:
+                    raise UploadTooLarge(max_bytes)
+                digest.update(block)
+                f.write(block)
+    except BaseException:
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+        raise
+
+    return SpooledUpload(path, size, digest.hexdigest())
+
+
+async def spool_upload(
+    upload,
+    suffix: str = '',
+    max_bytes: int = MAX_UPLOAD_BYTES,
+    directory: Optional[str] = None
+) -> SpooledUpload:
+    """spool_file de um UploadFile, fora do event loop"""
+    loop = asyncio.get_running_loop()
+    await upload.seek(0)
+    return await loop.run_in_executor(None, spool_file, upload.file, suffix, max_bytes, directory)
+
+
+def expand_zip(
+    archive: SpooledUpload,
+    extensions: Iterable[str],
+    max_bytes: int = MAX_UPLOAD_BYTES,
+    max_files: int = BULK_MAX_FILES,
+    directory: Optional[str] = None
+) -> List[Tuple[str, Optional[SpooledUpload], Optional[str]]]:
+    """
+    Arquivos de um ZIP, cada um gravado como um upload próprio
+
+    Pastas, arquivos ocultos e metadados do macOS são ignorados. Cada
+    entrada respeita max_bytes durante a descompactação (o tamanho
+    declarado no ZIP pode mentir), e entradas além de max_files são
+    recusadas.
+
+    Returns:
+        [(nome do arquivo, upload ou None, erro ou None)] na ordem do ZIP
+
+    Raises:
+        zipfile.BadZipFile: o arquivo não é um ZIP válido
+    """
+    extensions = set(extensions)
+    entries: List[Tuple[str, Optional[SpooledUpload], Optional[str]]] = []
+    accepted = 0
+
+    try:
+        with zipfile.ZipFile(archive.path) as zf:
+            for info in zf.infolist():
+                name = info.filename.rsplit('/', 1)[-1]
+                if info.is_dir() or info.filename.startswith('__MACOSX/') or not name or name.startswith('.'):
+                    continue
+
+                extension = name.lower().rsplit('.', 1)[-1] if '.' in name else ''
+                if extension not in extensions:
+                    entries.append((name, None, "Tipo de arquivo não suportado"))
+                    continue
+                if accepted >= max_files:
+                    entries.append((name, None, f"Limite de {max_files} arquivos por upload"))
+                    continue
+                if info.file_size > max_bytes:
+                    entries.append((name, None, str(UploadTooLarge(max_bytes))))
+                    continue
+
+                try:
+                    with zf.open(info) as source:
+                        entries.append((name, spool_file(source, f'.{extension}', max_bytes, directory), None))
+                    accepted += 1
+                except (UploadTooLarge, RuntimeError, zipfile.BadZipFile, NotImplementedError, OSError) as e:
+                    # RuntimeError: entrada criptografada; NotImplementedError: compressão não suportada
+                    entries.append((name, None, str(e)))
+    except BaseException:
+        for _, upload, _ in entries:
+            if upload is not None:
+                upload.cleanup()
+        raise
+
+    return entries
+
+
+class UploadSizeLimitMiddleware:
+    """
+    Middleware ASGI que limita o corpo das requisições de upload
+
+    O form multipart é lido inteiro antes do endpoint rodar; sem este
+    limite, um arquivo gigante seria recebido (e gravado em disco pelo
+    parser) antes de ser recusado. Content-Length acima do limite é
+    recusado na hora, e corpos sem Content-Length (chunked) são contados
+    enquanto chegam: passou do limite, a leitura para e a resposta é 413.
+    """
+
+    def __init__(self, app, paths: List[str], max_bytes: int = MAX_UPLOAD_BYTES + MULTIPART_OVERHEAD):
+        self.app = app
+        self.paths = set(paths)
+        self.max_bytes = max_bytes
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or scope.get('path') not in self.paths:
+            await self.app(scope, receive, send)
+            return
+
+        for name, value in scope.get('headers', []):
+            if name == b'content-length' and value.isdigit() and int(value) > self.max_bytes:
+                await self._reject(send)
+                return
+
+        received = 0
+        exceeded = False
+        response_started = False
+
+        async def limited_receive():
+            nonlocal received, exceeded
+            if exceeded:
+                return {'type': 'http.disconnect'}
+            message = await receive()
+            if message['type'] == 'http.request':
+                received += len(message.get('body', b''))
+                if received > self.max_bytes:
+                    # O parser vê uma desconexão e para de ler o corpo
+                    exceeded = True
+                    return {'type': 'http.disconnect'}
+            return message
+
+        async def guarded_send(message):
+            nonlocal response_started
+            # A resposta de erro do parser é trocada pelo 413
+            if exceeded:
+                if not response_started:
+                    response_started = True
+                    await self._reject(send)
+                return
+            response_started = True
+            await send(message)
+
+        try:
+            await self.app(scope, limited_receive, guarded_send)
+        except Exception:
+            if not exceeded:
+                raise
+        if exceeded and not response_started:
+            await self._reject(send)
+
+    async def _reject(self, send):
+        limit_mb = (self.max_bytes - MULTIPART_OVERHEAD) / (1024 * 1024)
+        body = f'{{"detail":"Arquivo maior que o limite de {limit_mb:.0f} MB"}}'.encode()
+        await send({
+            'type': 'http.response.start',
+            'status': 413,
+            'headers': [(b'content-type', b'application/json'), (b'content-length', str(len(body)).encode())],
+        })
+        await send({'type': 'http.response.body', 'body': body})
@@ -119,6 +119,7 @@ const TeamDetails = () => {
   const [temperature, setTemperature] = useState(0.7);
   const [verbose, setVerbose] = useState(true);
   const [managerAgentId, setManagerAgentId] = useState(null);
+  const [knowledgeChunker, setKnowledgeChunker] = useState("");
 
   useEffect(() => {
     loadTeamData();
@@ -150,6 +151,7 @@ const TeamDetails = () => {
       setTemperature(team.temperature !== undefined ? team.temperature : 0.7);
       setVerbose(team.verbose !== undefined ? team.verbose : true);
       setManagerAgentId(team.managerAgentId || null);
+      setKnowledgeChunker(team.knowledgeChunker || "");
 
       dispatch({ type: "LOAD_AGENTS", payload: team.agents || [] });
       setLoading(false);
@@ -226,7 +228,8 @@ const TeamDetails = () => {
         managerLLM,
         temperature,
         verbose,
-        managerAgentId
+        managerAgentId,
+        knowledgeChunker: knowledgeChunker || null
       });
       toast.success("Configurações avançadas salvas!");
       // Recarregar dados
@@ -477,6 +480,35 @@ const TeamDetails = () => {
                       </Typography>
                     </Grid>
 
+                    <Grid item xs={12} md={6}>
+                      <FormControl fullWidth variant="outlined" size="small">
+                        <InputLabel>Divisão dos Documentos (Knowledge Base)</InputLabel>
+                        <Select
+                          value={knowledgeChunker}
+                          onChange={(e) => setKnowledgeChunker(e.target.value)}
+                          label="Divisão dos Documentos (Knowledge Base)"
+                        >
+                          <MenuItem value="">
+                            <em>Padrão do serviço</em>
+                          </MenuItem>
+                          <MenuItem value="chars">
+                            Por caracteres (janelas de tamanho fixo)
+                          </MenuItem>
+                          <MenuItem value="sentences">
+                            Por frases (trechos não cortam frases)
+                          </MenuItem>
+                        </Select>
+                      </FormControl>
+                      <Typography
+                        variant="caption"
+                        color="textSecondary"
+                        style={{ marginTop: 4, display: "block" }}
+                      >
+                        Vale para os próximos uploads; documentos já enviados
+                        mudam ao enviar uma nova versão
+                      </Typography>
+                    </Grid>
+
                     <Grid item xs={12}>
                       <Button
                         variant="contained"